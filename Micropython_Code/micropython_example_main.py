@@ -38,6 +38,9 @@ while True:
     # Increment the count for the next message
     count += 1
 
+    # Print the link's log records, kept out of the interrupt handlers until now
+    transceiver.log.drain()
+
     # Pause for 0.5 seconds before sending the next message
     # This delay ensures the communication isn't too rapid, allowing the external device to process
     time.sleep(0.5)
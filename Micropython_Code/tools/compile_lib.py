@@ -0,0 +1,50 @@
+# Compile the MicroPython library to a .mpy file with mpy-cross, for the Pico.
+#
+# The library source is about 95 KB. Imported as a .py file, the Pico has to
+# hold the source, its parse tree and the bytecode in RAM together, and the
+# RP2040 runs out of heap with a MemoryError. A .mpy file is bytecode already:
+# it is loaded without the compiler, docstrings are left out, and only the
+# bytecode takes RAM.
+#
+# mpy-cross must come from the same MicroPython release as the Pico firmware,
+# eg for firmware 1.22.2:
+#   pip install mpy-cross==1.22.2
+#
+# Run from the Micropython_Code folder, then copy the .mpy to the Pico and
+# remove any V5_External_Comm_Lib.py there, which MicroPython would import first:
+#   python -m tools.compile_lib
+#   mpremote cp build/lib/V5_External_Comm_Lib.mpy :lib/
+#   mpremote rm :lib/V5_External_Comm_Lib.py
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+LIBRARIES = ["lib/V5_External_Comm_Lib.py"]
+
+
+def compile_library(mpy_cross, source, out_dir):
+    """
+    Compile one source file into out_dir, keeping its folder, and return the .mpy path.
+    """
+    target = os.path.join(out_dir, os.path.splitext(source)[0] + ".mpy")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    subprocess.run([mpy_cross, "-o", target, source], check=True)
+    return target
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compile the MicroPython library with mpy-cross.")
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross executable")
+    parser.add_argument("--out", default="build", help="folder for the .mpy files")
+    args = parser.parse_args()
+
+    mpy_cross = shutil.which(args.mpy_cross)
+    if mpy_cross is None:
+        sys.exit("mpy-cross not found, install the release matching the Pico firmware, eg pip install mpy-cross==1.22.2")
+
+    for source in LIBRARIES:
+        target = compile_library(mpy_cross, source, args.out)
+        print(f"{source} {os.path.getsize(source)} bytes -> {target} {os.path.getsize(target)} bytes")
@@ -1,135 +1,2644 @@
-import RPi.GPIO as GPIO
+import atexit
+import bisect
+import http.server
+import mmap
+import re
+import struct
+import sys
+import threading
 import time
+import zlib
+from collections import deque
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None  # Only needed to drive the pins, frame logs can be read and replayed on any PC
+
+# Frame kinds. A payload starting with a printable ASCII character is a plain
+# string message, a first byte below 0x20 marks one of the binary frame kinds.
+FRAME_TEXT = 0x00  # Not sent, used as the kind of plain string messages
+FRAME_TYPED = 0x01  # [FRAME_TYPED][type id][struct packed values]
+FRAME_BYTES = 0x02  # [FRAME_BYTES][raw bytes]
+FRAME_KEYFRAME = 0x03  # [FRAME_KEYFRAME][channel][sequence][zigzag varint values]
+FRAME_DELTA = 0x04  # [FRAME_DELTA][channel][sequence][zigzag varint changes]
+FRAME_RESYNC = 0x05  # [FRAME_RESYNC][channel], asks the sender for a keyframe
+
+FRAME_STATE = 0x06  # [FRAME_STATE]([key length][key][value tag][value])...
+
+FRAME_REQUEST = 0x07  # [FRAME_REQUEST][call id][method length][method][tagged values]
+FRAME_RESPONSE = 0x08  # [FRAME_RESPONSE][call id][status][tagged values]
+
+RPC_OK = 0
+RPC_FAILED = 1  # The values hold the error text
+RPC_UNKNOWN_METHOD = 2
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BIT_PERIOD_BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+STAGE_BUCKETS_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+# Stages timed by StageProfiler
+STAGE_CS_WAIT = "cs_wait"  # Waiting for the other end to release CS before sending
+STAGE_ENCODE = "encode"  # Checksum and bit encoding of the payload
+STAGE_CLOCKING = "clocking"  # Toggling the clock and data pins
+STAGE_PROCESS = "process"  # Decoding and checking a received frame
+STAGE_CALLBACK = "callback"  # dispatch_payload and the callbacks it runs
+PROFILE_STAGES = (STAGE_CS_WAIT, STAGE_ENCODE, STAGE_CLOCKING, STAGE_PROCESS, STAGE_CALLBACK)
+
+# Signals recorded by EdgeTracer
+SIGNAL_CS = 0
+SIGNAL_CLOCK = 1
+SIGNAL_DATA = 2
+TRACE_SIGNALS = ("cs", "clock", "data")
+
+# Log levels, see LinkLog
+LOG_DEBUG = 10  # Full frame dumps
+LOG_INFO = 20  # Messages sent and received
+LOG_WARNING = 30  # Rejected frames and ERROR replies
+LOG_ERROR = 40
+LOG_LEVEL_NAMES = {LOG_DEBUG: "DEBUG", LOG_INFO: "INFO", LOG_WARNING: "WARNING", LOG_ERROR: "ERROR"}
+LOG_SIZE = 64  # Records kept waiting to be drained
+
+# Value tags in state and RPC frames
+VALUE_INT = 0  # Zigzag varint
+VALUE_FLOAT = 1  # 32 bit float
+VALUE_TEXT = 2  # [length][utf-8 bytes]
+STATE_FRAME_LENGTH = 30  # Fits the 256 bit receive buffer of the MicroPython and V5 libraries
+
+# Flag bit on the frame kind, set when the rest of the frame is dictionary compressed
+FLAG_COMPRESSED = 0x10
+FRAME_COMPRESSED_TEXT = FRAME_TEXT | FLAG_COMPRESSED  # [0x10][compressed string]
+ESCAPE_BYTE = 0x7F  # Marks a literal byte in dictionary compressed data
+
+MAX_PAYLOAD_LENGTH = 255  # The length is sent in a single byte
+MESSAGE_POOL_SIZE = 2  # Received message objects recycled between frames
+RESYNC_RETRY = 10  # Repeat a resync request after this many dropped deltas
+
+# Bulk transfers, see send_bulk
+FRAME_BULK_START = 0x09  # [FRAME_BULK_START][transfer id][length, 4 bytes][chunk size][window][digest, 4 bytes][name]
+FRAME_BULK_CHUNK = 0x0A  # [FRAME_BULK_CHUNK][transfer id][chunk index, 2 bytes][data]
+FRAME_BULK_ACK = 0x0B  # [FRAME_BULK_ACK][transfer id][chunks received in order, 2 bytes][status]
+BULK_HEADER = ">IBBI"  # Length, chunk size, window and digest in a start frame
+BULK_HEADER_SIZE = 10
+BULK_RECEIVING = 0
+BULK_DONE = 1  # Every chunk arrived and the digest matched
+BULK_DIGEST_MISMATCH = 2  # Every chunk arrived but the digest did not match, the data is dropped
+BULK_REFUSED = 3  # No bulk handler, or too long
+BULK_MISSING = 4  # A chunk was skipped, send again from the count of chunks received
+BULK_STATUS_NAMES = ("receiving", "done", "digest mismatch", "refused", "missing")
+BULK_CHUNK_SIZE = 26  # Fits a chunk frame in the 256 bit receive buffer of the MicroPython and V5 libraries
+BULK_WINDOW = 8  # Chunks sent past the last acknowledged one
+BULK_ACK_TIMEOUT_MS = 1000  # Chunks are sent again from the last acknowledged one after this
+BULK_RETRIES = 5  # Timeouts in a row before a transfer is given up
+BULK_GAP_MS = 2  # Least time between chunks, so the receiver sees each frame end
+BULK_MAX_BYTES = 1 << 20  # Longest transfer accepted
+BULK_KEEP = 4  # Unfinished transfers kept to resume
+
+# Waypoint streams, see WaypointStreamer
+FRAME_WAYPOINT_REQUEST = 0x0C  # [FRAME_WAYPOINT_REQUEST][stream id][first index, 2 bytes][count]
+FRAME_WAYPOINTS = 0x0D  # [FRAME_WAYPOINTS][stream id][first index, 2 bytes][flags][packed waypoints]
+WAYPOINTS_LAST = 0x01  # Flag on the frame holding the final waypoint of a path
+WAYPOINT_HEADER_SIZE = 5
+WAYPOINT_FRAME_LENGTH = 30  # Fits the 256 bit receive buffer of the MicroPython and V5 libraries
+WAYPOINT_REQUEST_TIMEOUT_MS = 500  # A request not answered in this time is made again
+
+# Clock synchronisation, see ClockSync
+FRAME_TIME = 0x0E  # [FRAME_TIME][sequence] asks for the time, answered with [FRAME_TIME][sequence][t2, 4 bytes][t3, 4 bytes]
+FRAME_STAMPED = 0x0F  # [FRAME_STAMPED][sender time, 4 bytes][a payload of any other kind]
+TIME_REQUEST_LENGTH = 2
+TIME_REPLY_LENGTH = 10
+TIME_REPLY = ">BBII"
+STAMP_HEADER = ">BI"
+STAMP_HEADER_SIZE = 5
+CLOCK_MASK = 0xFFFFFFFF  # Link times are microseconds modulo 2**32
+SYNC_INTERVAL_MS = 1000  # Time between exchanges from start_clock_sync
+SYNC_SAMPLES = 8  # Exchanges the least delayed offset is picked from
+SYNC_AGE_PENALTY = 0.00002  # Delay added per microsecond of a sample's age when picking, as NTP's dispersion
+SYNC_DRIFT_POINTS = 16  # Picked offsets the drift is fitted over
+
+FRAME_GAP_US = 2000  # Least time between frames sent, frames sent back to back are lost
+
+# Frame log, see FrameLog
+FRAME_LOG_MAGIC = b"V5FL\x01"  # Start of a log file, with the format version
+FRAME_LOG_RECORD = struct.Struct("<QBBH")  # time.time_ns(), direction, status, frame length
+FRAME_LOG_INDEX = struct.Struct("<QQ")  # time.time_ns(), offset of the first record at or after it
+FRAME_LOG_INDEX_NS = 100000000  # Log time between index entries
+FRAME_LOG_BUFFER = 65536  # Bytes buffered before a write to the file
+FRAME_IN = 0
+FRAME_OUT = 1
+FRAME_STATUS_OK = 0
+FRAME_STATUS_CHECKSUM = 1  # Checksum mismatch, answered with ERROR
+FRAME_STATUS_TRUNCATED = 2  # Fewer bytes than the length byte promised
+FRAME_STATUS_SHORT = 3  # Fewer than 2 bytes
+FRAME_STATUS_NAMES = ("ok", "checksum", "truncated", "short")
+# Frames that are part of an exchange with the other end rather than data for
+# the callbacks, left out of a replay
+REPLAY_SKIPPED_KINDS = frozenset((FRAME_RESYNC, FRAME_REQUEST, FRAME_RESPONSE, FRAME_BULK_START, FRAME_BULK_CHUNK,
+                                  FRAME_BULK_ACK, FRAME_WAYPOINT_REQUEST, FRAME_WAYPOINTS, FRAME_TIME))
+
+
+class MessageSchema:
+    """
+    A precompiled binary layout for one message type.
+
+    Parameters:
+    - type_id (int): One byte identifier sent in front of the packed values.
+    - fmt (str): A `struct` format for the values, eg "hhH". Big endian is used
+        unless the format starts with its own byte order character.
+    - scales (sequence, optional): One scale factor per value for fixed point
+        fields. A value is multiplied by its scale and rounded before packing,
+        and divided by it after unpacking. Use 1 (or None) for raw fields.
+    - callback (callable, optional): Called with the decoded values when a
+        message of this type is received.
+    """
+
+    def __init__(self, type_id, fmt, scales=None, callback=None):
+        if not 0 <= type_id <= 255:
+            raise ValueError("Message type id must fit in one byte")
+
+        if fmt[:1] not in ("<", ">", "!", "=", "@"):
+            fmt = ">" + fmt
+
+        self.type_id = type_id
+        self.codec = struct.Struct(fmt)
+        self.header = bytes((FRAME_TYPED, type_id))
+        self.callback = callback
+
+        # Only the fixed point fields are touched when encoding and decoding
+        self.scaled_fields = []
+        if scales:
+            self.scaled_fields = [(i, scale) for i, scale in enumerate(scales) if scale not in (None, 1)]
+
+    def encode(self, values):
+        """
+        Pack the values into a complete typed frame payload.
+        """
+        if self.scaled_fields:
+            values = list(values)
+            for i, scale in self.scaled_fields:
+                values[i] = int(round(values[i] * scale))
+        return self.header + self.codec.pack(*values)
+
+    def decode(self, body):
+        """
+        Unpack the bytes following the frame header back into values.
+        """
+        values = self.codec.unpack(body)
+        if self.scaled_fields:
+            values = list(values)
+            for i, scale in self.scaled_fields:
+                values[i] = values[i] / scale
+            values = tuple(values)
+        return values
+
+
+class MessageRegistry:
+    """
+    Maps one byte type ids to their precompiled message schemas.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register(self, type_id, fmt, scales=None, callback=None):
+        """
+        Register (or replace) the schema for a message type and return it.
+        """
+        schema = MessageSchema(type_id, fmt, scales, callback)
+        self.schemas[type_id] = schema
+        return schema
+
+    def encode(self, type_id, values):
+        """
+        Encode values for a registered type into a frame payload.
+        """
+        schema = self.schemas.get(type_id)
+        if schema is None:
+            raise KeyError(f"Unknown message type {type_id}")
+        return schema.encode(values)
+
+    def decode(self, payload):
+        """
+        Decode a typed frame payload into its schema and values.
+        """
+        schema = self.schemas.get(payload[1])
+        if schema is None:
+            raise KeyError(f"Unknown message type {payload[1]}")
+        return schema, schema.decode(payload[2:])
+
+
+class ReceivedMessage:
+    """
+    A reusable view onto a received frame, handed to `on_bytes_received`.
+
+    `data` is a memoryview onto the receive buffer, so nothing is copied when a
+    frame arrives. The text and struct views are only decoded when asked for.
+    The object is recycled for later frames, copy `bytes(message.data)` to keep it.
+    """
+
+    __slots__ = ("kind", "data", "_text")
+
+    def __init__(self):
+        self.kind = FRAME_BYTES
+        self.data = memoryview(b"")
+        self._text = None
+
+    def load(self, kind, data):
+        """
+        Point the message at a new frame body.
+        """
+        self.kind = kind
+        self.data = data
+        self._text = None
+        return self
+
+    @property
+    def text(self):
+        """
+        The body decoded as UTF-8, decoded once on first access.
+        """
+        if self._text is None:
+            self._text = bytes(self.data).decode('utf-8')
+        return self._text
+
+    def unpack(self, fmt, offset=0):
+        """
+        Unpack values straight from the receive buffer with a `struct` format.
+        """
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FieldParser:
+    """
+    A parser for 'x90,y100' style string payloads, compiled once from a field spec.
+
+    Parameters:
+    - fields (dict): Maps each key to the function converting its value, in the
+        order the sender writes them, eg {"x": int, "y": int, "heading": float}.
+    - separator (str, optional): The character between fields, "," by default.
+    - record (bool, optional): Return a reused record with one slot per field
+        instead of a reused dict.
+
+    A key is followed directly by its value, which may not start with a letter.
+    Payloads laid out exactly like the spec are matched by one precompiled
+    regular expression. Anything else (missing, reordered or unknown fields)
+    falls back to a scan for the known keys. The same dict (or record) is
+    returned for every payload, keyed by the spec's own interned strings; the
+    record reads its attributes straight from that dict. Fields missing from a
+    payload are set to None and unknown keys are skipped. A payload holding none
+    of the fields parses to None.
+    """
+
+    def __init__(self, fields, separator=",", record=False):
+        self.keys = tuple(sys.intern(key) for key in fields)
+        self.converters = {key: fields[key] for key in self.keys}
+        self.layout_fields = tuple((key, fields[key]) for key in self.keys)
+
+        sep = re.escape(separator)
+        value = f"([^A-Za-z_{sep}][^{sep}]*)"
+        self.layout = re.compile(sep.join(re.escape(key) + value for key in self.keys))
+
+        # Longest key first so "xv" is tried before "x"
+        alternatives = "|".join(re.escape(key) for key in sorted(self.keys, key=len, reverse=True))
+        self.scanner = re.compile(f"(?:^|{sep})({alternatives}){value}")
+
+        self.blank = dict.fromkeys(self.keys)
+        self.values = dict(self.blank)
+        self.record = None
+        if record:
+            self.record = type("FieldRecord", (), {})()
+            self.record.__dict__ = self.values
+
+    def parse(self, payload):
+        """
+        Parse a payload in a single pass, returning None when it holds none of the fields.
+        Raises ValueError when a known field has a value that does not convert.
+        """
+        values = self.values
+        match = self.layout.fullmatch(payload)
+
+        if match is not None:
+            for (key, convert), value in zip(self.layout_fields, match.groups()):
+                values[key] = convert(value)
+        else:
+            found = self.scanner.findall(payload)
+            if not found:
+                return None
+            values.update(self.blank)
+            converters = self.converters
+            for key, value in found:
+                values[key] = converters[key](value)
+
+        return values if self.record is None else self.record
+
+
+def elapsed_ms(started):
+    """
+    Milliseconds since a time.monotonic() reading.
+    """
+    return (time.monotonic() - started) * 1000
+
+
+def ticks_us():
+    """
+    Microseconds from a monotonic clock, for timing frames.
+    """
+    return time.monotonic_ns() // 1000
+
+
+def ticks_diff_us(later, earlier):
+    """
+    Microseconds between two ticks_us() readings.
+    """
+    return later - earlier
+
+
+def write_varint(out, value):
+    """
+    Append a signed integer to a bytearray as a zigzag varint.
+    """
+    value = (value << 1) if value >= 0 else ((-value) << 1) - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    """
+    Read a zigzag varint from data at offset. Returns (value, next offset).
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    if value & 1:
+        return -((value + 1) >> 1), offset
+    return value >> 1, offset
+
+
+def write_value(out, value):
+    """
+    Append an int, float (as 32 bits) or string to a bytearray, after its value tag.
+    """
+    if isinstance(value, float):
+        out.append(VALUE_FLOAT)
+        out.extend(struct.pack(">f", value))
+    elif isinstance(value, int):
+        out.append(VALUE_INT)
+        write_varint(out, value)
+    else:
+        text = bytes(str(value), 'utf-8')
+        out.append(VALUE_TEXT)
+        out.append(len(text))
+        out.extend(text)
+
+
+def adler32(data, value=1):
+    """
+    Adler-32 checksum of some bytes, the digest of a bulk transfer.
+    """
+    return zlib.adler32(data, value)
+
+
+def read_value(data, offset):
+    """
+    Read a tagged value from data at offset. Returns (value, next offset).
+    """
+    tag = data[offset]
+    offset += 1
+    if tag == VALUE_INT:
+        return read_varint(data, offset)
+    if tag == VALUE_FLOAT:
+        return struct.unpack_from(">f", data, offset)[0], offset + 4
+    length = data[offset]
+    return bytes(data[offset + 1:offset + 1 + length]).decode('utf-8'), offset + 1 + length
+
+
+class DeltaChannel:
+    """
+    Delta codec for one stream of numeric samples, eg encoder counts or odometry.
+
+    Parameters:
+    - channel_id (int): One byte identifier, registered on both ends.
+    - count (int): Number of values in each sample.
+    - scales (sequence, optional): Fixed point scale per value, as for MessageSchema.
+    - keyframe_interval (int, optional): Send a full keyframe after this many deltas.
+    - callback (callable, optional): Called with the decoded values on the receiving end.
+
+    Each sample is sent as zigzag varints of its change from the previous one.
+    A frame that is not rejected with an ERROR moves both ends on to the new
+    reference. The sequence number lets the receiver spot a lost frame, it then
+    drops deltas until the next keyframe and asks the sender for one. A sender
+    that is told about a checksum failure sends a keyframe next.
+    """
+
+    def __init__(self, channel_id, count, scales=None, keyframe_interval=50, callback=None):
+        if not 0 <= channel_id <= 255:
+            raise ValueError("Delta channel id must fit in one byte")
+
+        self.channel_id = channel_id
+        self.count = count
+        self.keyframe_interval = keyframe_interval
+        self.callback = callback
+
+        self.scaled_fields = []
+        if scales:
+            self.scaled_fields = [(i, scale) for i, scale in enumerate(scales) if scale not in (None, 1)]
+
+        # Sending side
+        self.tx_reference = None  # None until a keyframe has been sent
+        self.tx_sequence = 0
+        self.tx_since_keyframe = 0
+
+        # Receiving side
+        self.rx_reference = None  # None while out of sync
+        self.rx_sequence = 0  # Sequence number expected next
+        self.rx_dropped = 0  # Deltas dropped while out of sync
+
+    def force_keyframe(self):
+        """
+        Make the next encoded sample a keyframe.
+        """
+        self.tx_reference = None
+
+    def encode(self, values):
+        """
+        Encode a sample into a keyframe or delta frame payload.
+        """
+        if len(values) != self.count:
+            raise ValueError("Delta channel expects " + str(self.count) + " values")
+
+        values = list(values)
+        for i, scale in self.scaled_fields:
+            values[i] = int(round(values[i] * scale))
+
+        reference = self.tx_reference
+        keyframe = reference is None or self.tx_since_keyframe >= self.keyframe_interval
+
+        out = bytearray((FRAME_KEYFRAME if keyframe else FRAME_DELTA, self.channel_id, self.tx_sequence))
+        if keyframe:
+            for value in values:
+                write_varint(out, value)
+            self.tx_since_keyframe = 0
+        else:
+            for value, previous in zip(values, reference):
+                write_varint(out, value - previous)
+            self.tx_since_keyframe += 1
+
+        self.tx_reference = values
+        self.tx_sequence = (self.tx_sequence + 1) & 0xFF
+        return bytes(out)
+
+    def decode(self, payload):
+        """
+        Decode a keyframe or delta frame payload into the sample values.
+        Returns None when a delta can not be applied until the next keyframe.
+        """
+        kind = payload[0]
+        sequence = payload[2]
+
+        if kind == FRAME_DELTA and (self.rx_reference is None or sequence != self.rx_sequence):
+            self.rx_reference = None
+            self.rx_dropped += 1
+            return None
+
+        values = []
+        offset = 3
+        for _ in range(self.count):
+            value, offset = read_varint(payload, offset)
+            values.append(value)
+
+        if kind == FRAME_DELTA:
+            values = [previous + change for previous, change in zip(self.rx_reference, values)]
+
+        self.rx_reference = values
+        self.rx_sequence = (sequence + 1) & 0xFF
+        self.rx_dropped = 0
+
+        if not self.scaled_fields:
+            return values
+        values = list(values)
+        for i, scale in self.scaled_fields:
+            values[i] = values[i] / scale
+        return values
+
+
+class DictionaryCodec:
+    """
+    Compresses string payloads against a preset dictionary of recurring text,
+    eg "Hello ", "RPI_OUT " or status words. Both ends must use the same
+    dictionary, tools/train_dictionary.py builds one from a message log.
+
+    Parameters:
+    - entries (sequence): Up to 128 strings or bytes, in a fixed order.
+
+    In the compressed form a byte of 0x80 or above stands for dictionary entry
+    (byte - 0x80), ESCAPE_BYTE marks the next byte as a literal, and any other
+    byte is itself. Matching is greedy, longest entry first.
+    """
+
+    def __init__(self, entries):
+        if len(entries) > 128:
+            raise ValueError("A dictionary holds at most 128 entries")
+
+        self.entries = [bytes(entry, 'utf-8') if isinstance(entry, str) else bytes(entry) for entry in entries]
+
+        # Candidate entries by first byte, longest first
+        self.candidates = {}
+        for code, entry in enumerate(self.entries):
+            self.candidates.setdefault(entry[0], []).append((entry, len(entry), 0x80 + code))
+        for matches in self.candidates.values():
+            matches.sort(key=lambda match: -match[1])
+
+    def compress(self, data):
+        """
+        Compress bytes, returns a bytearray.
+        """
+        out = bytearray()
+        candidates = self.candidates
+        i = 0
+        length = len(data)
+        while i < length:
+            byte = data[i]
+            for entry, entry_length, code in candidates.get(byte, ()):
+                if data[i:i + entry_length] == entry:
+                    out.append(code)
+                    i += entry_length
+                    break
+            else:
+                if byte >= ESCAPE_BYTE:
+                    out.append(ESCAPE_BYTE)
+                out.append(byte)
+                i += 1
+        return out
+
+    def decompress(self, data):
+        """
+        Expand compressed bytes, returns a bytearray.
+        """
+        out = bytearray()
+        entries = self.entries
+        i = 0
+        length = len(data)
+        while i < length:
+            byte = data[i]
+            i += 1
+            if byte >= 0x80:
+                out.extend(entries[byte - 0x80])
+            elif byte == ESCAPE_BYTE:
+                out.append(data[i])
+                i += 1
+            else:
+                out.append(byte)
+        return out
+
+
+class StateMirror:
+    """
+    Latest value store for state such as robot pose, target bearing or battery level.
+
+    The sending end calls set(key, value) as often as it likes and
+    V5ExternalComm.flush_state() at its own pace. Only keys whose value changed
+    since the last flush are sent, and a newer value simply replaces one that
+    is still waiting, so the link load follows the rate of change rather than
+    the rate of calls. The receiving end reads get(key), which also gives the
+    age of the value.
+
+    Values can be ints, floats (sent as 32 bit floats) or strings. Changes are
+    packed into frames of up to STATE_FRAME_LENGTH bytes.
+    """
+
+    def __init__(self):
+        self.pending = {}  # Values set since the last flush
+        self.sent = {}  # Values as of the last flush
+        self.values = {}  # Values received from the other end
+        self.stamps = {}  # When each received value arrived, from time.monotonic()
+
+    def set(self, key, value):
+        """
+        Set the value of a key, to be sent on the next flush if it changed.
+        """
+        self.pending[key] = value
+
+    def get(self, key):
+        """
+        Get a received value. Returns (value, age in ms), or (None, None) for a key never received.
+        """
+        if key not in self.values:
+            return None, None
+        return self.values[key], elapsed_ms(self.stamps[key])
+
+    def encode_changes(self, full=False):
+        """
+        Encode the changed values (every value when full is True) into frame
+        payloads, and mark them as sent.
+        """
+        if full:
+            changes = dict(self.sent)
+            changes.update(self.pending)
+        else:
+            changes = {}
+            for key, value in self.pending.items():
+                if key not in self.sent or self.sent[key] != value:
+                    changes[key] = value
+        self.pending = {}
+
+        frames = []
+        frame = bytearray((FRAME_STATE,))
+        for key, value in changes.items():
+            entry = bytearray()
+            key_bytes = bytes(key, 'utf-8')
+            entry.append(len(key_bytes))
+            entry.extend(key_bytes)
+            write_value(entry, value)
+
+            if len(frame) > 1 and len(frame) + len(entry) > STATE_FRAME_LENGTH:
+                frames.append(bytes(frame))
+                frame = bytearray((FRAME_STATE,))
+            frame.extend(entry)
+            self.sent[key] = value
+
+        if len(frame) > 1:
+            frames.append(bytes(frame))
+        return frames
+
+    def apply(self, payload):
+        """
+        Store the values from a received state frame payload.
+        """
+        now = time.monotonic()
+        offset = 1
+        while offset < len(payload):
+            key_length = payload[offset]
+            key = bytes(payload[offset + 1:offset + 1 + key_length]).decode('utf-8')
+            offset += 1 + key_length
+
+            value, offset = read_value(payload, offset)
+            self.values[key] = value
+            self.stamps[key] = now
+
+
+class LatencyHistogram:
+    """
+    Counts samples, eg latencies in ms, into fixed buckets without allocating.
+
+    Parameters:
+    - bounds (sequence, optional): Upper bound of each bucket, ascending. Samples
+        above the last bound go into one more overflow bucket.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Add one sample.
+        """
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        """
+        Mean of the samples, 0 when there are none.
+        """
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket holding the given percentile, eg 99.
+        Samples in the overflow bucket report the largest sample seen.
+        """
+        if not self.count:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+        Copy the histogram into a dict.
+        """
+        return {
+            "bounds": self.bounds,
+            "buckets": list(self.buckets),
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+    def reset(self):
+        """
+        Clear all samples.
+        """
+        for index in range(len(self.buckets)):
+            self.buckets[index] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class LinkStats:
+    """
+    Link health counters and histograms for one V5ExternalComm. Everything is
+    updated in place, so recording a frame allocates nothing.
+
+    - frames_in, bytes_in: Frames (and their payload bytes) received with a good checksum.
+    - frames_out, bytes_out: Frames (and their payload bytes) sent.
+    - checksum_failures: Frames rejected by the checksum, each answered with an ERROR.
+    - error_resends: Frames sent again because the other end reported an ERROR.
+    - truncated_frames: Frames with fewer bits than their length byte promised.
+    - rejected_frames: Frames with a good checksum that could not be handled, eg of an unknown message type.
+    - frame_latency_ms: Time from CS going high to the payload being handled.
+    - bit_period_us: Average clock period of each received frame.
+    - round_trip_ms: Delay of each clock exchange, see sync_clock.
+    - message_latency_ms: Time from sampling to handling of each stamped message, once the clock is synced.
+    """
+
+    def __init__(self):
+        self.frame_latency_ms = LatencyHistogram()
+        self.bit_period_us = LatencyHistogram(BIT_PERIOD_BUCKETS_US)
+        self.round_trip_ms = LatencyHistogram()
+        self.message_latency_ms = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        """
+        Zero every counter and histogram.
+        """
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.checksum_failures = 0
+        self.error_resends = 0
+        self.truncated_frames = 0
+        self.rejected_frames = 0
+        self.frame_latency_ms.reset()
+        self.bit_period_us.reset()
+        self.round_trip_ms.reset()
+        self.message_latency_ms.reset()
+
+    def snapshot(self):
+        """
+        Copy the current values into a dict.
+        """
+        return {
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "frames_out": self.frames_out,
+            "bytes_out": self.bytes_out,
+            "checksum_failures": self.checksum_failures,
+            "error_resends": self.error_resends,
+            "truncated_frames": self.truncated_frames,
+            "rejected_frames": self.rejected_frames,
+            "frame_latency_ms": self.frame_latency_ms.snapshot(),
+            "bit_period_us": self.bit_period_us.snapshot(),
+            "round_trip_ms": self.round_trip_ms.snapshot(),
+            "message_latency_ms": self.message_latency_ms.snapshot(),
+        }
+
+
+def format_stats_text(snapshot):
+    """
+    Format a snapshot_stats() dict as aligned text, one value per line.
+    """
+    lines = []
+    for name, value in snapshot.items():
+        if isinstance(value, dict):
+            lines.append(f"{name:<20}count {value['count']}  mean {value['mean']:.1f}  "
+                         f"p50 {value['p50']}  p99 {value['p99']}  max {value['max']:.1f}")
+        else:
+            lines.append(f"{name:<20}{value}")
+    return "\n".join(lines) + "\n"
+
+
+def format_stats_prometheus(snapshot, prefix="v5_link"):
+    """
+    Format a snapshot_stats() dict in the Prometheus text exposition format.
+    Counters end in _total, queue depths are gauges and histograms keep their buckets.
+    """
+    lines = []
+    for name, value in snapshot.items():
+        metric = f"{prefix}_{name}"
+        if isinstance(value, dict):
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(value["bounds"], value["buckets"]):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {value["count"]}')
+            lines.append(f"{metric}_sum {value['sum']}")
+            lines.append(f"{metric}_count {value['count']}")
+        elif name.startswith("pending_"):
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        else:
+            lines.append(f"# TYPE {metric}_total counter")
+            lines.append(f"{metric}_total {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_stats(comm, port=9105):
+    """
+    Serve the link statistics of a V5ExternalComm over HTTP from a background
+    thread: Prometheus format at /metrics, plain text anywhere else.
+    Returns the server, call shutdown() on it to stop.
+    """
+
+    class StatsHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = format_stats_prometheus(comm.snapshot_stats())
+                content_type = "text/plain; version=0.0.4"
+            else:
+                body = format_stats_text(comm.snapshot_stats())
+                content_type = "text/plain"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the console
+
+    server = http.server.ThreadingHTTPServer(("", port), StatsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StageProfiler:
+    """
+    Times the stages of sending and receiving frames into histograms of
+    microseconds, and counts the stages that run past a time budget.
+
+    The library takes a ticks_us() reading where a stage starts and calls
+    record when it ends, so the cost is two timer reads per stage. Only the
+    callback stage has a budget by default, as a slow callback delays
+    every frame after it.
+
+    Parameters:
+    - callback_budget_us (int): Budget for the callback stage.
+    - budgets (dict, optional): Budgets in us for other stages, by stage name.
+    - on_overrun (callable, optional): Called with (stage, elapsed_us) for every overrun.
+    """
+
+    def __init__(self, callback_budget_us=1000, budgets=None, on_overrun=None):
+        self.stages = {stage: LatencyHistogram(STAGE_BUCKETS_US) for stage in PROFILE_STAGES}
+        self.budgets = {STAGE_CALLBACK: callback_budget_us}
+        if budgets:
+            self.budgets.update(budgets)
+        self.overruns = {stage: 0 for stage in PROFILE_STAGES}
+        self.on_overrun = on_overrun
+
+    def record(self, stage, started):
+        """
+        Record a stage that started at a ticks_us() reading. Returns the time
+        now, so the next stage can start from it.
+        """
+        now = ticks_us()
+        elapsed = ticks_diff_us(now, started)
+        self.stages[stage].record(elapsed)
+
+        budget = self.budgets.get(stage)
+        if budget is not None and elapsed > budget:
+            self.overruns[stage] += 1
+            if self.on_overrun is not None:
+                self.on_overrun(stage, elapsed)
+        return now
+
+    def snapshot(self):
+        """
+        Copy the stage histograms into a dict by stage name, with the total
+        time, budget and overrun count of each stage.
+        """
+        snapshot = {}
+        for stage, histogram in self.stages.items():
+            stage_snapshot = histogram.snapshot()
+            stage_snapshot["total_us"] = histogram.total
+            stage_snapshot["budget_us"] = self.budgets.get(stage)
+            stage_snapshot["overruns"] = self.overruns[stage]
+            snapshot[stage] = stage_snapshot
+        return snapshot
+
+    def reset(self):
+        """
+        Clear all samples and overrun counts.
+        """
+        for stage in PROFILE_STAGES:
+            self.stages[stage].reset()
+            self.overruns[stage] = 0
+
+
+class EdgeTracer:
+    """
+    Opt-in ring buffer of timestamped CS, clock and data edges, see
+    V5ExternalComm.enable_trace. Recording an edge writes into preallocated
+    storage only, so it is safe to leave running inside the pin interrupts.
+
+    Parameters:
+    - size (int, optional): Number of edges kept, older edges are overwritten.
+
+    The receiving side only sees the rising clock edges it is interrupted on,
+    and records the data line as sampled on them.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.times = [0] * size  # ticks_us() of each edge
+        self.edges = bytearray(size)  # (signal << 1) | level of each edge
+        self.index = 0  # Next slot to write
+        self.count = 0  # Edges recorded since the last clear
+
+    def record(self, signal, level):
+        """
+        Record one edge of a signal, SIGNAL_CS, SIGNAL_CLOCK or SIGNAL_DATA.
+        """
+        index = self.index
+        self.times[index] = ticks_us()
+        self.edges[index] = (signal << 1) | level
+        index += 1
+        self.index = index if index < self.size else 0
+        self.count += 1
+
+    def clear(self):
+        """
+        Forget every recorded edge.
+        """
+        self.index = 0
+        self.count = 0
+
+    def events(self):
+        """
+        Copy the ring, oldest edge first, as a list of (time_us, signal, level).
+        The link keeps running while the copy is made.
+        """
+        count = min(self.count, self.size)
+        start = (self.index - count) % self.size
+        events = []
+        for i in range(count):
+            slot = (start + i) % self.size
+            edge = self.edges[slot]
+            events.append((self.times[slot], edge >> 1, edge & 1))
+        return events
+
+    def bit_periods(self):
+        """
+        Periods in us between the rising clock edges of each frame.
+        """
+        periods = []
+        last_rise = None
+        for time_us, signal, level in self.events():
+            if signal == SIGNAL_CS:
+                last_rise = None  # Do not measure across frames
+            elif signal == SIGNAL_CLOCK and level:
+                if last_rise is not None:
+                    periods.append(ticks_diff_us(time_us, last_rise))
+                last_rise = time_us
+        return periods
+
+    def jitter(self):
+        """
+        Bit period statistics from the edges in the ring, in us.
+        """
+        periods = self.bit_periods()
+        if not periods:
+            return {"count": 0, "mean_us": 0, "stdev_us": 0, "min_us": 0, "max_us": 0, "peak_to_peak_us": 0}
+
+        mean = sum(periods) / len(periods)
+        variance = sum((period - mean) ** 2 for period in periods) / len(periods)
+        return {
+            "count": len(periods),
+            "mean_us": mean,
+            "stdev_us": variance ** 0.5,
+            "min_us": min(periods),
+            "max_us": max(periods),
+            "peak_to_peak_us": max(periods) - min(periods),
+        }
+
+    def write_vcd(self, out):
+        """
+        Write the edges in the ring to a file like object as a VCD waveform,
+        for viewing in a waveform viewer such as GTKWave. Times are in us from
+        the oldest edge. When only rising clock edges were recorded, each one
+        is drawn as a 1 us pulse.
+        """
+        events = self.events()
+        codes = ("!", '"', "#")
+
+        out.write("$timescale 1us $end\n$scope module v5_link $end\n")
+        for signal, name in enumerate(TRACE_SIGNALS):
+            out.write("$var wire 1 " + codes[signal] + " " + name + " $end\n")
+        out.write("$upscope $end\n$enddefinitions $end\n")
+        if not events:
+            return
+
+        start = events[0][0]
+        pulse_clock = True
+        for time_us, signal, level in events:
+            if signal == SIGNAL_CLOCK and not level:
+                pulse_clock = False
+                break
+
+        changes = []
+        for time_us, signal, level in events:
+            offset = ticks_diff_us(time_us, start)
+            changes.append((offset, str(level) + codes[signal]))
+            if pulse_clock and signal == SIGNAL_CLOCK:
+                changes.append((offset + 1, "0" + codes[signal]))
+        changes.sort(key=lambda change: change[0])
+
+        last_offset = None
+        for offset, change in changes:
+            if offset != last_offset:
+                out.write("#" + str(offset) + "\n")
+                last_offset = offset
+            out.write(change + "\n")
+
+
+def format_bits(bits):
+    """
+    A sequence of bits as a string of 0s and 1s.
+    """
+    return "".join(map(str, bits))
+
+
+def format_frame_dump(frame):
+    """
+    Describe a received frame bit by bit: the raw bits, the length, each byte
+    in ASCII and binary, and the checksum. Called lazily by LinkLog, so the
+    work is only done for frames logged at LOG_DEBUG.
+
+    Parameters:
+    - frame (bytes): The bytes clocked in between CS going high and low.
+    """
+    bits = [(byte >> (7 - i)) & 1 for byte in frame for i in range(8)]
+    lines = ["RECEIVE", "Buffer content (raw): " + format_bits(bits)]
+    if len(bits) < 16:
+        lines.append("Buffer too short to process.")
+        return "\n".join(lines)
+
+    length_bits = format_bits(bits[:8])
+    length = int(length_bits, 2)
+    lines.append(f"Length: {length}\tBinary: {length_bits}")
+    if len(bits) < 8 + length * 8 + 8:
+        lines.append("Insufficient bits for data and checksum.")
+        return "\n".join(lines)
+
+    lines.append("Bytes (ASCII and Binary):")
+    for i in range(length):
+        byte_bits = format_bits(bits[8 + i * 8:16 + i * 8])
+        value = int(byte_bits, 2)
+        lines.append(f"Byte {i + 1}: ASCII '{chr(value) if 32 <= value <= 126 else '.'}' "
+                     f"({value}) Binary {byte_bits}")
+
+    checksum_bits = format_bits(bits[8 + length * 8:16 + length * 8])
+    lines.append(f"Checksum: {int(checksum_bits, 2)}\tBinary: {checksum_bits}")
+    return "\n".join(lines)
+
+
+def format_record(seconds, level, message, args):
+    """
+    Format a LinkLog record as one line: the monotonic time in seconds, the level and the message.
+    """
+    if callable(message):
+        text = message(*args)
+    elif args:
+        text = message % args
+    else:
+        text = message
+    return f"[{seconds:.3f}] {LOG_LEVEL_NAMES.get(level, level)} {text}"
+
+
+class LinkLog:
+    """
+    Leveled log that keeps formatting and printing out of the edge callbacks.
+
+    A record below the level costs a single comparison. Others are stored
+    unformatted, as the message and its arguments, in a ring of the last
+    `size` records, and are only formatted and written out by drain(),
+    called from a background thread started with the first stored record, see
+    start. When the ring is full the oldest record is overwritten and counted
+    as dropped. The message may also be a function,
+    called with the arguments when drained, for output that is costly to
+    build such as format_frame_dump.
+
+    Parameters:
+    - level (int): LOG_DEBUG, LOG_INFO, LOG_WARNING or LOG_ERROR.
+    - size (int): Records kept waiting to be drained.
+    - sink (callable): Called with each formatted line, print by default.
+    """
+
+    def __init__(self, level=LOG_INFO, size=LOG_SIZE, sink=print):
+        self.level = level
+        self.sink = sink
+        self.records = deque(maxlen=size)  # Appends and pops are thread safe
+        self.dropped = 0
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def log(self, level, message, *args):
+        """
+        Store a record, when level is at or above the log level.
+        """
+        if level < self.level:
+            return
+        records = self.records
+        if len(records) == records.maxlen:
+            self.dropped += 1  # The append pushes out the oldest record
+        records.append((time.monotonic(), level, message, args))
+        if self.thread is None:
+            self.start()
+
+    def debug(self, message, *args):
+        self.log(LOG_DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(LOG_INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(LOG_WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(LOG_ERROR, message, *args)
+
+    def drain(self, limit=None):
+        """
+        Format and write out the waiting records, oldest first.
+        Returns the number of records written.
+        """
+        if self.dropped:
+            dropped = self.dropped
+            self.dropped = 0
+            self.sink(f"{dropped} log records dropped")
+
+        written = 0
+        while limit is None or written < limit:
+            try:
+                record = self.records.popleft()
+            except IndexError:
+                break
+            self.sink(format_record(*record))
+            written += 1
+        return written
+
+    def start(self, interval=0.05):
+        """
+        Drain the log from a daemon thread every `interval` seconds, and once
+        more when the program exits.
+        """
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+                self.thread.start()
+                atexit.register(self.drain)
+
+    def run(self, interval):
+        while True:
+            self.drain()
+            time.sleep(interval)
+
+
+class FrameLog:
+    """
+    Append-only binary log of every frame sent and received, see
+    V5ExternalComm.enable_frame_log. Each record is the time, direction,
+    decode status and the raw frame, [length][payload][checksum] as sent or
+    as many bytes as were received. Records are buffered in memory and
+    written in large blocks. Every FRAME_LOG_INDEX_NS of log time the offset
+    of the next record is added to a sidecar index, path + ".idx", so that
+    FrameLogReader can seek to a time without reading from the start.
+
+    Parameters:
+    - path (str): Log file, appended to when it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # Frames are logged from the pin callbacks and the sending thread
+        self.file = open(path, "ab", buffering=FRAME_LOG_BUFFER)
+        self.offset = self.file.tell()
+        if self.offset == 0:
+            self.file.write(FRAME_LOG_MAGIC)
+            self.offset = len(FRAME_LOG_MAGIC)
+        self.index = open(path + ".idx", "ab", buffering=FRAME_LOG_BUFFER)
+        self.next_index_ns = 0
+        self.records = 0
+
+    def record(self, direction, status, frame):
+        """
+        Log one frame, FRAME_IN or FRAME_OUT, with its FRAME_STATUS_*.
+        """
+        now = time.time_ns()
+        with self.lock:
+            if self.file.closed:
+                return  # Logged while disable_frame_log was closing it
+            if now >= self.next_index_ns:
+                self.index.write(FRAME_LOG_INDEX.pack(now, self.offset))
+                self.next_index_ns = now + FRAME_LOG_INDEX_NS
+            self.file.write(FRAME_LOG_RECORD.pack(now, direction, status, len(frame)))
+            self.file.write(frame)
+            self.offset += FRAME_LOG_RECORD.size + len(frame)
+            self.records += 1
+
+    def flush(self):
+        """
+        Write out the buffered records, eg before reading the log while it is still being written.
+        """
+        with self.lock:
+            self.file.flush()
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index.close()
+
+
+class FrameLogReader:
+    """
+    Reads a FrameLog through mmap, seeking with its index.
+
+    Parameters:
+    - path (str): Log file written by FrameLog.
+
+    A record cut short at the end of the file, by a crash or because the log
+    is still being written, is left out. An empty file, a log whose first
+    block is still buffered by the FrameLog, has no records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as log_file:
+            try:
+                self.map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.map = None  # mmap refuses an empty file
+        if self.map is not None and self.map[:len(FRAME_LOG_MAGIC)] != FRAME_LOG_MAGIC:
+            raise ValueError(path + " is not a frame log")
+        try:
+            with open(path + ".idx", "rb") as index_file:
+                entries = list(FRAME_LOG_INDEX.iter_unpack(index_file.read()))
+        except FileNotFoundError:
+            entries = []
+        self.index_times = [entry[0] for entry in entries]
+        self.index_offsets = [entry[1] for entry in entries]
+
+    def seek(self, timestamp_ns):
+        """
+        Offset of a record at or before the first record at timestamp_ns, from the index.
+        """
+        slot = bisect.bisect_right(self.index_times, timestamp_ns) - 1
+        return self.index_offsets[slot] if slot >= 0 else len(FRAME_LOG_MAGIC)
+
+    def records(self, start_ns=None, end_ns=None):
+        """
+        Yield (time_ns, direction, status, frame) for each record from start_ns up to end_ns, as time.time_ns().
+        """
+        log_map = self.map
+        if log_map is None:
+            return
+        offset = self.seek(start_ns) if start_ns is not None else len(FRAME_LOG_MAGIC)
+        while offset + FRAME_LOG_RECORD.size <= len(log_map):
+            timestamp_ns, direction, status, length = FRAME_LOG_RECORD.unpack_from(log_map, offset)
+            start = offset + FRAME_LOG_RECORD.size
+            offset = start + length
+            if offset > len(log_map) or (end_ns is not None and timestamp_ns > end_ns):
+                break
+            if start_ns is None or timestamp_ns >= start_ns:
+                yield timestamp_ns, direction, status, log_map[start:offset]
+
+    def first_ns(self):
+        """
+        Time of the first record, or None for an empty log.
+        """
+        for record in self.records():
+            return record[0]
+        return None
+
+    def replay(self, sink, speed=1.0, start_ns=None, end_ns=None):
+        """
+        Feed the frames received intact into a ReplaySink, and so on to its
+        on_message_received and other callbacks, with the gaps between them as
+        logged divided by speed. speed=None replays as fast as possible, eg to
+        benchmark the callbacks. Frames of the exchanges with the other end,
+        calls, clock exchanges, bulk transfers, waypoint requests, resyncs and
+        ERROR replies, are left out.
+        Returns the number of frames replayed.
+        """
+        if not isinstance(sink, ReplaySink):
+            raise TypeError("Replay into a ReplaySink, a V5ExternalComm would answer the frames on the link")
+
+        replayed = 0
+        started = time.monotonic()
+        first_ns = None
+        for timestamp_ns, direction, status, frame in self.records(start_ns, end_ns):
+            if direction != FRAME_IN or status != FRAME_STATUS_OK:
+                continue
+            payload = frame[1:1 + frame[0]]
+            if len(payload) and (payload[0] in REPLAY_SKIPPED_KINDS or payload == b"ERROR"):
+                continue
+            if speed:
+                if first_ns is None:
+                    first_ns = timestamp_ns
+                delay = (timestamp_ns - first_ns) / 1e9 / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            sink.dispatch_payload(payload)
+            replayed += 1
+        return replayed
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+
+def wrap_signed(value):
+    """
+    A difference of two link times, modulo 2**32, as a signed number.
+    """
+    value &= CLOCK_MASK
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class ClockSync:
+    """
+    Estimates the other end's clock from timed exchanges over the link, NTP
+    style, see V5ExternalComm.sync_clock. Link times are microseconds modulo
+    2**32, from ticks_us() on each end.
+
+    Each exchange gives four times, t1 when the request was sent and t4 when
+    the reply arrived on this end's clock, t2 when the request arrived and t3
+    when the reply was sent on the other end's. Send times are taken just
+    before CS is raised, after any wait for the line, see stamp(), and
+    arrival times when CS went high, so neither the wait nor the length of a
+    frame counts. Then
+
+        offset = ((t2 - t1) + (t3 - t4)) / 2  # Other end's clock minus this end's
+        delay = (t4 - t1) - (t3 - t2)  # Round trip, less the time the other end held the request
+
+    An exchange that waited behind another frame is lopsided, so the offset
+    comes from the exchange with the least delay of the last SYNC_SAMPLES,
+    older exchanges counting as slightly more delayed so newer ones take over.
+    The drift is the slope of a least squares line through those offsets
+    over time, and carries the offset on between exchanges.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.request_sent = None  # t1 of the request awaiting a reply
+        self.samples = deque(maxlen=SYNC_SAMPLES)  # (t4, offset, delay) of the latest exchanges
+        self.points = deque(maxlen=SYNC_DRIFT_POINTS)  # (t4, offset) of the least delayed ones
+        self.reference_time = 0  # Link time the estimate is anchored at
+        self.reference_offset = 0  # Offset at reference_time, modulo 2**32
+        self.correction_us = 0.0  # Fitted offset at reference_time, less reference_offset
+        self.drift = 0.0  # Offset change per microsecond
+        self.delay_us = None  # Delay of the exchange the offset comes from
+        self.exchanges = 0
+        self.unanswered = 0  # Requests replaced by a new one before a reply arrived
+
+    def link_time(self, ticks):
+        """
+        Link time of a ticks_us() reading.
+        """
+        return ticks & CLOCK_MASK
+
+    def now(self):
+        return self.link_time(ticks_us())
+
+    def synced(self):
+        return self.exchanges > 0
+
+    def request(self):
+        """
+        The payload of a new request, its send time is taken by stamp().
+        """
+        if self.request_sent is not None:
+            self.unanswered += 1
+        self.sequence = (self.sequence + 1) & 0xFF
+        self.request_sent = None
+        return bytes((FRAME_TIME, self.sequence))
+
+    def reply(self, payload, t2):
+        """
+        The reply to a received request, its send time t3 is filled in by stamp().
+        """
+        return struct.pack(TIME_REPLY, FRAME_TIME, payload[1], t2, 0)
+
+    def stamp(self, payload, now):
+        """
+        Take the send time of a request, or fill it into a reply, called by
+        send_frame just before CS is raised. Returns the payload to send.
+        """
+        if len(payload) == TIME_REQUEST_LENGTH:
+            self.request_sent = now
+            return payload
+        return payload[:TIME_REPLY_LENGTH - 4] + struct.pack(">I", now)
+
+    def add_reply(self, payload, t4):
+        """
+        Take in a reply that arrived at t4. Returns the delay of the exchange in
+        microseconds, or None when the reply was not for the latest request.
+        """
+        _, sequence, t2, t3 = struct.unpack_from(TIME_REPLY, payload)
+        t1 = self.request_sent
+        if t1 is None or sequence != self.sequence:
+            return None
+        self.request_sent = None
+
+        # Both halves as differences that wrap, so only their gap has to be small
+        there = wrap_signed(t2 - t1)
+        offset = (t2 - t1 + wrap_signed(t3 - t4 - there) // 2) & CLOCK_MASK
+        delay = wrap_signed(t4 - t1) - wrap_signed(t3 - t2)
+        self.samples.append((t4, offset, delay))
+        self.exchanges += 1
+
+        best = min(self.samples, key=lambda sample: sample[2] + wrap_signed(t4 - sample[0]) * SYNC_AGE_PENALTY)
+        if not self.points or self.points[-1][0] != best[0]:
+            self.points.append(best[:2])
+            self.fit()
+        self.delay_us = best[2]
+        return delay
+
+    def fit(self):
+        """
+        Fit the offset and drift to the points, relative to the latest one.
+        """
+        self.reference_time, self.reference_offset = self.points[-1]
+        if len(self.points) < 3:
+            self.correction_us = 0.0
+            self.drift = 0.0
+            return
+        xs = [wrap_signed(time - self.reference_time) for time, _ in self.points]
+        ys = [wrap_signed(offset - self.reference_offset) for _, offset in self.points]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        spread = sum((x - mean_x) ** 2 for x in xs)
+        self.drift = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread if spread else 0.0
+        self.correction_us = mean_y - self.drift * mean_x
+
+    def offset_us(self, local=None):
+        """
+        The other end's clock minus this end's at a link time, now by default, as a signed number.
+        """
+        if local is None:
+            local = self.now()
+        offset = self.correction_us + self.drift * wrap_signed(local - self.reference_time)
+        return wrap_signed(self.reference_offset + round(offset))
+
+    def to_local(self, remote):
+        """
+        This end's link time at the other end's link time remote.
+        """
+        return (remote - self.offset_us()) & CLOCK_MASK
+
+    def to_remote(self, local):
+        """
+        The other end's link time at this end's link time local.
+        """
+        return (local + self.offset_us(local)) & CLOCK_MASK
+
+    def snapshot(self):
+        return {
+            "synced": self.synced(),
+            "offset_us": self.offset_us() if self.synced() else None,
+            "drift_ppm": self.drift * 1e6,
+            "delay_us": self.delay_us,
+            "exchanges": self.exchanges,
+            "unanswered": self.unanswered,
+        }
+
+
+class BulkTransfer:
+    """
+    Progress of a transfer started by V5ExternalComm.send_bulk.
+    """
+
+    def __init__(self, transfer_id, name, data, chunk_size, window):
+        self.transfer_id = transfer_id
+        self.name = name
+        self.data = data
+        self.chunk_size = chunk_size
+        self.window = window
+        self.chunks = (len(data) + chunk_size - 1) // chunk_size
+        self.digest = adler32(data)
+        self.started = time.monotonic()
+        self.acked = 0  # Chunks the receiver has in order
+        self.acks = 0  # Acknowledgements received
+        self.status = None  # Last status the receiver sent, None before the first acknowledgement
+        self.rewind = None  # Chunk to send again from, set by a BULK_MISSING acknowledgement
+        self.chunks_sent = 0
+        self.chunks_resent = 0
+        self.link_ms = 0  # Time spent sending chunks
+        self.elapsed = 0  # Milliseconds from start to finish
+        self.complete = False
+        self.error = None
+
+    def progress(self):
+        """
+        Fraction of the data the receiver has.
+        """
+        return self.acked / self.chunks if self.chunks else float(self.complete)
+
+    def snapshot(self):
+        elapsed = self.elapsed or elapsed_ms(self.started)
+        received = min(self.acked * self.chunk_size, len(self.data))
+        return {
+            "name": self.name,
+            "bytes": len(self.data),
+            "chunks": self.chunks,
+            "acked": self.acked,
+            "progress": self.progress(),
+            "chunks_sent": self.chunks_sent,
+            "chunks_resent": self.chunks_resent,
+            "elapsed_ms": elapsed,
+            "throughput_Bps": received * 1000 / elapsed if elapsed else 0,
+            "link_share": self.link_ms / elapsed if elapsed else 0,
+            "complete": self.complete,
+            "error": self.error,
+        }
+
+    def acknowledge(self, received, status):
+        """
+        Note an acknowledgement from the receiver.
+        """
+        if status == BULK_MISSING:
+            self.rewind = received
+        if received > self.acked:
+            self.acked = received
+        self.status = status
+        self.acks += 1
+
+
+class BulkIncoming:
+    """
+    A transfer being received, kept by its digest so it can be resumed.
+    """
+
+    def __init__(self, name, length, chunk_size, window, digest):
+        self.name = name
+        self.data = bytearray(length)
+        self.chunk_size = chunk_size
+        self.chunks = (length + chunk_size - 1) // chunk_size
+        self.ack_every = max(1, window // 2)
+        self.digest = digest
+        self.received = 0  # Chunks received in order
+        self.missing_sent = False  # A BULK_MISSING acknowledgement was sent for the current gap
+        self.status = BULK_RECEIVING
+
+
+class RpcError(Exception):
+    """
+    Raised by RpcFuture.result() when the remote handler failed.
+    """
+    pass
+
+
+class RpcTimeout(RpcError):
+    """
+    Raised by RpcFuture.result() when no reply arrived in time.
+    """
+    pass
+
+
+class RpcFuture:
+    """
+    The pending result of V5ExternalComm.call().
+    """
+
+    def __init__(self, comm, call_id, method, timeout_ms):
+        self.comm = comm
+        self.call_id = call_id
+        self.method = method
+        self.started = time.monotonic()
+        self.timeout_ms = timeout_ms
+        self.done = False
+        self.value = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def expired(self):
+        """
+        True once the timeout has passed without a reply.
+        """
+        return not self.done and elapsed_ms(self.started) > self.timeout_ms
+
+    def set_result(self, value, error=None):
+        """
+        Complete the call, called when the reply arrives.
+        """
+        self.value = value
+        self.error = error
+        self.done = True
+        self.finished.set()
+
+    def result(self):
+        """
+        Wait for the reply and return the handler's result.
+        Raises RpcTimeout if the timeout passes first, RpcError if the handler failed.
+        """
+        if not self.finished.wait(max(0, self.timeout_ms / 1000 - (time.monotonic() - self.started))):
+            self.comm.expire_call(self)
+        if not self.done:
+            raise RpcTimeout("RPC call " + self.method + " timed out")
+        if self.error is not None:
+            raise RpcError(self.error)
+        return self.value
+
 
 class V5ExternalComm:
     
-    def __init__(self, cs_pin, clock_pin, data_pin, on_message_received=None):
+    def __init__(self, cs_pin, clock_pin, data_pin, on_message_received=None,
+                 on_typed_message_received=None, message_registry=None, on_bytes_received=None,
+                 on_fields_received=None, fields=None, field_record=False, dictionary=None,
+                 log_level=LOG_INFO):
         self.cs_pin = cs_pin
         self.clock_pin = clock_pin
         self.data_pin = data_pin
         self.running = False
         self.cs_active = False  # Indicates if CS is active (HIGH)
-        self.current_byte = []  # Store bits for the current byte
-        self.received_data = []  # Store all received bytes
+        self.current_byte = 0  # Bits of the current byte, shifted in MSB first
+        self.bit_count = 0  # Number of bits in the current byte
+        self.received_data = bytearray(MAX_PAYLOAD_LENGTH + 2)  # Length, data and checksum bytes, reused
+        self.received_count = 0  # Number of bytes in received_data
         self.on_message_received = on_message_received
 
-        self.last_message = ""
+        # Typed messages, called with (type_id, values) when a type has no callback of its own
+        self.on_typed_message_received = on_typed_message_received
+        self.message_registry = message_registry if message_registry is not None else MessageRegistry()
+
+        # Binary frames (and string messages when on_message_received is not set)
+        # are handed over as recycled ReceivedMessage objects
+        self.on_bytes_received = on_bytes_received
+        self.message_pool = [ReceivedMessage() for _ in range(MESSAGE_POOL_SIZE)]
+        self.message_pool_index = 0
+
+        # 'x90,y100' style string messages parsed with a precompiled FieldParser
+        # and handed to on_fields_received as a reused dict or record
+        self.on_fields_received = on_fields_received
+        self.field_parser = FieldParser(fields, record=field_record) if fields else None
+
+        # Delta encoded telemetry channels by channel id
+        self.delta_channels = {}
+
+        # String messages are compressed against this preset dictionary when it helps
+        self.dictionary_codec = DictionaryCodec(dictionary) if dictionary else None
+
+        # Latest value state shared with the other end, see flush_state
+        self.state = StateMirror()
+
+        # RPC: handlers served to the other end, calls waiting for a reply and
+        # the reply latency of each method called
+        self.rpc_handlers = {}
+        self.pending_calls = {}
+        self.next_call_id = 0
+        self.rpc_latency = {}
+        self.rpc_timeouts = {}
+
+        # Bulk transfers: the handler for received ones, those being received
+        # by transfer id and by digest, to resume, and those being sent
+        self.bulk_handler = None
+        self.bulk_receiving = {}
+        self.bulk_partial = {}
+        self.bulk_sending = {}
+        self.next_bulk_id = 0
+
+        # Paths served to WaypointStreamers on the brain by stream id, see serve_waypoints
+        self.waypoint_sources = {}
+
+        # Link health, see snapshot_stats
+        self.stats = LinkStats()
+        self.frame_started = 0  # ticks_us() when CS last went high
+
+        # Frames waiting to go out, see send_frame. Only the thread that set
+        # sending clocks frames out, so threads never interleave on the pins.
+        # The send thread clocks out frames queued by queue_frames
+        self.send_lock = threading.Lock()
+        self.outbox = deque()
+        self.sending = False
+        self.send_wakeup = threading.Event()
+        self.send_thread = None
+        self.frame_ended = 0  # ticks_us() when CS last went low after sending
+
+        # Estimate of the other end's clock, see sync_clock, and while the callback for
+        # a stamped message runs, when it was sent on this end's clock and how long ago
+        self.clock = ClockSync()
+        self.clock_thread = None
+        self.message_sent_us = None
+        self.message_latency_us = None
+
+        # Edge trace ring, None until enable_trace is called
+        self.tracer = None
+
+        # Stage timing, None until enable_profiling is called
+        self.profiler = None
+
+        # Binary log of every frame, None until enable_frame_log is called
+        self.frame_log = None
+
+        # Frame logging, formatted and printed by a background thread started
+        # with the first record. LOG_DEBUG dumps every frame, LOG_WARNING only
+        # logs rejected frames
+        self.log = LinkLog(log_level)
+
+        self.last_message = b""
+
+        self.BIT_DELAY_US = 100  # Clock high time of each bit in microseconds
 
         self.set_pins_receive()
 
     def process_and_display_buffer(self):
         """
-        Process and validate the received payload, displaying it in a detailed tabular format.
+        Process and validate the received payload. At LOG_DEBUG the whole frame
+        is dumped to the log, byte by byte in ASCII and binary.
         """
-        # Convert received data (bytes) to a binary bitstream
-        bitstream = []
+        profiler = self.profiler
+        started = ticks_us() if profiler is not None else 0
 
-        for byte in self.received_data:
-            bitstream.extend([int(bit) for bit in f"{byte:08b}"])  # Convert each byte to 8 bits
+        count = self.received_count
+        if self.log.level <= LOG_DEBUG:
+            self.log.debug(format_frame_dump, bytes(self.received_data[:count]))
 
-        print("\nRECEIVE\nBuffer content (raw):", "".join(map(str, bitstream)))
-
-        if len(bitstream) < 16:
-            print("Error: Buffer too short to process.")
+        frame_log = self.frame_log
+        if count < 2:
+            if frame_log is not None:
+                frame_log.record(FRAME_IN, FRAME_STATUS_SHORT, self.received_data[:count])
+            self.log.warning("Buffer too short to process.")
+            self.stats.truncated_frames += 1
             return
 
         try:
-            # Decode length
-            length_bits = bitstream[:8]
-            length = int("".join(map(str, length_bits)), 2)
-            print(f"Length: {length}\tBinary: {''.join(map(str, length_bits))}\n")
-
-            # Check if buffer has enough bits for length, data, and checksum
-            if len(bitstream) < 8 + length * 8 + 8:
-                print("Error: Insufficient bits for data and checksum.")
+            # Check if buffer has enough bytes for length, data, and checksum
+            length = self.received_data[0]
+            if count < 1 + length + 1:
+                if frame_log is not None:
+                    frame_log.record(FRAME_IN, FRAME_STATUS_TRUNCATED, self.received_data[:count])
+                self.log.warning("Insufficient bits for data and checksum.")
+                self.stats.truncated_frames += 1
                 return
 
-            # Decode data
-            data_bits = bitstream[8:8 + length * 8]
-            received_data = []
-            print("Bytes (ASCII and Binary):")
-            for i in range(0, len(data_bits), 8):
-                char_bits = data_bits[i:i + 8]
-                char = chr(int("".join(map(str, char_bits)), 2))
-                received_data.append(char)
-                binary_representation = "".join(map(str, char_bits))
-                print(f"Byte {i // 8 + 1}: ASCII '{char if 32 <= ord(char) <= 126 else '.'}' "
-                    f"({ord(char)}) Binary {binary_representation}")
-
-            decoded_data = "".join(received_data)
-
-            # Decode checksum
-            checksum_bits = bitstream[8 + length * 8:8 + length * 8 + 8]
-            received_checksum = int("".join(map(str, checksum_bits)), 2)
-            print(f"\nChecksum: {received_checksum}\tBinary: {''.join(map(str, checksum_bits))}")
+            payload = memoryview(self.received_data)[1:1 + length]
+            received_checksum = self.received_data[1 + length]
 
             # Validate checksum
-            calculated_checksum = self.calculate_checksum(decoded_data)
+            calculated_checksum = self.calculate_checksum(payload)
+            if frame_log is not None:
+                status = FRAME_STATUS_OK if received_checksum == calculated_checksum else FRAME_STATUS_CHECKSUM
+                frame_log.record(FRAME_IN, status, self.received_data[:count])
             if received_checksum == calculated_checksum:
-                print("Checksum validation passed.")
-
-                if decoded_data == "ERROR":
-                    self.send_data(self.last_message)
-                else:
-                    if self.on_message_received:
-                        self.on_message_received(decoded_data)
+                self.stats.frames_in += 1
+                self.stats.bytes_in += length
+                if profiler is not None:
+                    started = profiler.record(STAGE_PROCESS, started)
+                self.dispatch_payload(payload)
+                if profiler is not None:
+                    profiler.record(STAGE_CALLBACK, started)
+                self.stats.frame_latency_ms.record(ticks_diff_us(ticks_us(), self.frame_started) / 1000)
             else:
-                print(f"Checksum mismatch. Received: {received_checksum}, Calculated: {calculated_checksum}")
+                self.log.warning("Checksum mismatch. Received: %s, Calculated: %s",
+                                 received_checksum, calculated_checksum)
+                self.stats.checksum_failures += 1
                 self.send_data("ERROR")
 
         except Exception as e:
 
-            print(f"Error processing buffer: {e}")
+            self.log.error("Error processing buffer: %s", e)
+
+
+    def next_message(self):
+        """
+        Take the next message object from the pool.
+        """
+        self.message_pool_index = (self.message_pool_index + 1) % MESSAGE_POOL_SIZE
+        return self.message_pool[self.message_pool_index]
+
+    def dispatch_payload(self, payload):
+        """
+        Hand a validated payload to the callback for its frame kind.
+        """
+        kind = payload[0] if len(payload) else FRAME_TEXT
+
+        if kind == FRAME_BYTES:
+            if self.on_bytes_received:
+                self.on_bytes_received(self.next_message().load(FRAME_BYTES, payload[1:]))
+            return
+
+        if kind == FRAME_KEYFRAME or kind == FRAME_DELTA:
+            channel = self.delta_channels.get(payload[1])
+            if channel is None:
+                self.log.warning("Unknown delta channel %s", payload[1])
+                self.stats.rejected_frames += 1
+                return
+
+            values = channel.decode(payload)
+            if values is None:
+                if channel.rx_dropped % RESYNC_RETRY == 1:
+                    self.send_frame(bytes((FRAME_RESYNC, channel.channel_id)), remember=False)
+            elif channel.callback:
+                channel.callback(values)
+            return
+
+        if kind == FRAME_REQUEST:
+            self.handle_request(payload)
+            return
+
+        if kind == FRAME_RESPONSE:
+            self.handle_response(payload)
+            return
+
+        if kind == FRAME_STATE:
+            self.state.apply(payload)
+            return
+
+        if kind == FRAME_BULK_CHUNK:
+            self.handle_bulk_chunk(payload)
+            return
+
+        if kind == FRAME_BULK_ACK:
+            transfer = self.bulk_sending.get(payload[1])
+            if transfer is not None:
+                transfer.acknowledge(payload[2] << 8 | payload[3], payload[4])
+            return
+
+        if kind == FRAME_BULK_START:
+            self.handle_bulk_start(payload)
+            return
+
+        if kind == FRAME_WAYPOINT_REQUEST:
+            self.handle_waypoint_request(payload)
+            return
+
+        if kind == FRAME_TIME:
+            self.handle_time(payload)
+            return
+
+        if kind == FRAME_STAMPED:
+            self.handle_stamped(payload)
+            return
+
+        if kind == FRAME_COMPRESSED_TEXT:
+            if self.dictionary_codec is None:
+                self.log.warning("Compressed message received without a dictionary")
+                self.stats.rejected_frames += 1
+                return
+            try:
+                data = self.dictionary_codec.decompress(payload[1:])
+            except IndexError:
+                self.log.warning("Compressed message does not match the dictionary")
+                self.stats.rejected_frames += 1
+                return
+            self.dispatch_payload(memoryview(data))
+            return
+
+        if kind == FRAME_RESYNC:
+            channel = self.delta_channels.get(payload[1])
+            if channel is not None:
+                channel.force_keyframe()
+            else:
+                self.log.warning("Resync asked for unknown delta channel %s", payload[1])
+                self.stats.rejected_frames += 1
+            return
+
+        if kind == FRAME_TYPED:
+            try:
+                schema, values = self.message_registry.decode(payload)
+            except (KeyError, IndexError, struct.error) as e:
+                self.log.warning("Typed message rejected: %s", e)
+                self.stats.rejected_frames += 1
+                return
+
+            if schema.callback:
+                schema.callback(values)
+            elif self.on_typed_message_received:
+                self.on_typed_message_received(schema.type_id, values)
+            return
+
+        if payload == b"ERROR":
+            self.stats.error_resends += 1
+            self.send_frame(self.last_message)
+            # The receiver may have lost a delta, so resync every channel
+            for channel in self.delta_channels.values():
+                channel.force_keyframe()
+            return
+
+        if self.on_fields_received and self.field_parser:
+            decoded_data = str(payload, "utf-8")
+            try:
+                fields = self.field_parser.parse(decoded_data)
+            except ValueError as e:
+                self.stats.rejected_frames += 1
+                self.log.warning("Field message rejected: %s", e)
+                return
+            # Text holding none of the fields is an ordinary message
+            if fields is not None:
+                self.on_fields_received(fields)
+                if self.on_message_received:
+                    self.on_message_received(decoded_data)
+                return
+
+        if self.on_message_received:
+            self.on_message_received(str(payload, "utf-8"))
+        elif self.on_bytes_received:
+            self.on_bytes_received(self.next_message().load(FRAME_TEXT, payload))
+
+    def register_message(self, type_id, fmt, scales=None, callback=None):
+        """
+        Register a typed message layout, see MessageSchema for the parameters.
+        Both ends of the link must register the same layouts.
+        """
+        return self.message_registry.register(type_id, fmt, scales, callback)
+
+    def send_message(self, type_id, values):
+        """
+        Send a typed message, packing the values with the registered schema.
+        """
+        self.send_frame(self.message_registry.encode(type_id, values))
+
+    def register_delta_channel(self, channel_id, count, scales=None, keyframe_interval=50, callback=None):
+        """
+        Register a delta encoded telemetry channel, see DeltaChannel for the parameters.
+        Both ends of the link must register the same channels.
+        """
+        channel = DeltaChannel(channel_id, count, scales, keyframe_interval, callback)
+        self.delta_channels[channel_id] = channel
+        return channel
+
+    def snapshot_stats(self, reset=False):
+        """
+        Copy the link statistics, plus the current queue depths, into a dict.
+        With reset=True the statistics are zeroed afterwards.
+        """
+        snapshot = self.stats.snapshot()
+        snapshot["pending_calls"] = len(self.pending_calls)
+        snapshot["pending_state"] = len(self.state.pending)
+        if reset:
+            self.stats.reset()
+        return snapshot
+
+    def enable_trace(self, size=1024):
+        """
+        Start recording CS, clock and data edges into a ring of the given size.
+        Returns the EdgeTracer, which can export VCD and jitter statistics.
+        """
+        self.tracer = EdgeTracer(size)
+        return self.tracer
+
+    def disable_trace(self):
+        """
+        Stop recording edges.
+        """
+        self.tracer = None
+
+    def enable_profiling(self, callback_budget_us=1000, budgets=None):
+        """
+        Start timing each stage of sending and receiving frames. Stages that
+        overrun their budget are counted and logged as warnings.
+        Returns the StageProfiler, see StageProfiler.snapshot.
+        """
+        self.profiler = StageProfiler(callback_budget_us, budgets, self.log_overrun)
+        return self.profiler
+
+    def disable_profiling(self):
+        """
+        Stop timing stages.
+        """
+        self.profiler = None
+
+    def enable_frame_log(self, path):
+        """
+        Start logging every frame sent and received to a binary file.
+        Returns the FrameLog, read it back or replay it with FrameLogReader.
+        """
+        self.disable_frame_log()
+        self.frame_log = FrameLog(path)
+        return self.frame_log
+
+    def disable_frame_log(self):
+        """
+        Stop logging frames and write out the buffered records.
+        """
+        frame_log = self.frame_log
+        if frame_log is not None:
+            self.frame_log = None
+            frame_log.close()
+
+    def log_overrun(self, stage, elapsed_us):
+        """
+        Log a stage that overran its budget, see enable_profiling.
+        """
+        self.log.warning("%s stage took %s us, over its %s us budget",
+                         stage, elapsed_us, self.profiler.budgets[stage])
+
+    def register_handler(self, method, handler):
+        """
+        Serve RPC calls to a method name. The handler is called with the call's
+        arguments and may return None, one value or a tuple of values.
+        """
+        self.rpc_handlers[method] = handler
+
+    def call(self, method, args=(), timeout_ms=1000):
+        """
+        Call a method registered on the other end and return an RpcFuture for the result.
+        Several calls can be in flight at once, replies are matched by their call id.
+        """
+        # Free the ids of calls that timed out
+        for call_id in [call_id for call_id, future in self.pending_calls.items() if future.expired()]:
+            self.expire_call(self.pending_calls[call_id])
+
+        call_id = self.next_call_id
+        while call_id in self.pending_calls:
+            call_id = (call_id + 1) & 0xFF
+            if call_id == self.next_call_id:
+                raise RpcError("Too many RPC calls in flight")
+        self.next_call_id = (call_id + 1) & 0xFF
+
+        method_bytes = bytes(method, 'utf-8')
+        payload = bytearray((FRAME_REQUEST, call_id, len(method_bytes)))
+        payload.extend(method_bytes)
+        for value in args:
+            write_value(payload, value)
+
+        future = RpcFuture(self, call_id, method, timeout_ms)
+        self.pending_calls[call_id] = future
+        self.send_frame(bytes(payload))
+        return future
+
+    def expire_call(self, future):
+        """
+        Forget a call that timed out, a late reply to it is ignored.
+        """
+        if self.pending_calls.get(future.call_id) is future:
+            del self.pending_calls[future.call_id]
+            self.rpc_timeouts[future.method] = self.rpc_timeouts.get(future.method, 0) + 1
+
+    def handle_request(self, payload):
+        """
+        Run the handler for a received call and send back its result.
+        """
+        call_id = payload[1]
+        method_length = payload[2]
+        method = bytes(payload[3:3 + method_length]).decode('utf-8')
+
+        args = []
+        offset = 3 + method_length
+        while offset < len(payload):
+            value, offset = read_value(payload, offset)
+            args.append(value)
+
+        reply = bytearray((FRAME_RESPONSE, call_id, RPC_OK))
+        handler = self.rpc_handlers.get(method)
+        if handler is None:
+            reply[2] = RPC_UNKNOWN_METHOD
+            write_value(reply, "Unknown method " + method)
+        else:
+            try:
+                result = handler(*args)
+            except Exception as e:
+                reply[2] = RPC_FAILED
+                write_value(reply, str(e))
+            else:
+                if result is not None:
+                    for value in (result if isinstance(result, tuple) else (result,)):
+                        write_value(reply, value)
+
+        # Sent from the send thread, so this callback is not held up waiting
+        # for the caller to finish sending its next call
+        self.queue_frames((bytes(reply),))
+
+    def handle_response(self, payload):
+        """
+        Complete the pending call a reply belongs to.
+        """
+        future = self.pending_calls.pop(payload[1], None)
+        if future is None:
+            return  # Timed out already, or not ours
+
+        values = []
+        offset = 3
+        while offset < len(payload):
+            value, offset = read_value(payload, offset)
+            values.append(value)
+
+        histogram = self.rpc_latency.get(future.method)
+        if histogram is None:
+            histogram = self.rpc_latency[future.method] = LatencyHistogram()
+        histogram.record(elapsed_ms(future.started))
+
+        if payload[2] != RPC_OK:
+            future.set_result(None, values[0] if values else "RPC call failed")
+        elif not values:
+            future.set_result(None)
+        else:
+            future.set_result(values[0] if len(values) == 1 else tuple(values))
+
+    def register_bulk_handler(self, handler):
+        """
+        Accept bulk transfers from the other end. The handler is called with
+        (name, data) once all of a transfer has arrived and its digest matches.
+        """
+        self.bulk_handler = handler
+
+    def send_bulk(self, data, name="", chunk_size=BULK_CHUNK_SIZE, window=BULK_WINDOW, share=0.5, on_progress=None):
+        """
+        Send a block of data, eg a path plan or a log dump, in numbered chunks.
+
+        Up to `window` chunks are sent past the last one the receiver acknowledged,
+        so the link is not left idle waiting for every acknowledgement. After a
+        lost chunk, or no acknowledgement for BULK_ACK_TIMEOUT_MS, chunks are sent
+        again from the last acknowledged one. The receiver checks an Adler-32
+        digest of the whole block. Sending stops after every chunk for long
+        enough that bulk chunks take at most `share` (above 0, up to 1) of the link time, leaving
+        the rest to other messages. on_progress is called with the BulkTransfer
+        whenever an acknowledgement moves it on.
+
+        chunk_size may be up to 251 when the receiver is a Raspberry Pi, chunks
+        over 26 bytes are too long for the MicroPython and V5 libraries.
+
+        Returns the BulkTransfer, check its `complete` and `error`. A transfer that
+        gives up can be resumed by calling send_bulk again with the same data,
+        the receiver keeps the chunks it has and sending starts after them.
+        """
+        if not 0 < share <= 1:
+            raise ValueError("Share must be above 0 and at most 1, not " + str(share))
+        if not 0 < chunk_size <= MAX_PAYLOAD_LENGTH - 4:
+            raise ValueError("Chunk size must be from 1 to " + str(MAX_PAYLOAD_LENGTH - 4))
+        if len(data) > 0xFFFF * chunk_size:
+            raise ValueError("Too much data for 65535 chunks of " + str(chunk_size) + " bytes")
+
+        transfer_id = self.next_bulk_id
+        self.next_bulk_id = (transfer_id + 1) & 0xFF
+        transfer = BulkTransfer(transfer_id, name, data, chunk_size, window)
+        self.bulk_sending[transfer_id] = transfer
+
+        start = bytearray((FRAME_BULK_START, transfer_id))
+        start.extend(struct.pack(BULK_HEADER, len(data), chunk_size, window, transfer.digest))
+        start.extend(bytes(name, 'utf-8'))
+        try:
+            self.run_bulk(transfer, bytes(start), share, on_progress)
+        finally:
+            del self.bulk_sending[transfer_id]
+            transfer.elapsed = elapsed_ms(transfer.started)
+        return transfer
+
+    def run_bulk(self, transfer, start, share, on_progress):
+        """
+        Send the chunks of a transfer until the receiver reports it finished, see send_bulk.
+        """
+        retries = 0
+        next_chunk = None  # Set once the start is acknowledged, with the chunks the receiver already has
+        acks = 0
+        while retries <= BULK_RETRIES:
+            if next_chunk is None:
+                self.send_frame(start, remember=False)
+            else:
+                # Pipeline up to a window of chunks past the last acknowledged one
+                while next_chunk < min(transfer.acked + transfer.window, transfer.chunks):
+                    if transfer.rewind is not None:
+                        break
+                    offset = next_chunk * transfer.chunk_size
+                    chunk = bytearray((FRAME_BULK_CHUNK, transfer.transfer_id, next_chunk >> 8, next_chunk & 0xFF))
+                    chunk.extend(transfer.data[offset:offset + transfer.chunk_size])
+                    sent = time.monotonic()
+                    self.send_frame(bytes(chunk), remember=False)
+                    link_ms = elapsed_ms(sent)
+                    transfer.link_ms += link_ms
+                    transfer.chunks_sent += 1
+                    next_chunk += 1
+                    time.sleep(max(link_ms * (1 - share) / share, BULK_GAP_MS) / 1000)
+
+            # Wait for an acknowledgement
+            waited = time.monotonic()
+            while transfer.acks == acks and elapsed_ms(waited) < BULK_ACK_TIMEOUT_MS:
+                time.sleep(0.001)  # Acknowledgements arrive through the pin callbacks
+
+            if transfer.acks == acks:
+                retries += 1  # Nothing back, send again from the last acknowledged chunk
+                if next_chunk is not None:
+                    transfer.chunks_resent += next_chunk - transfer.acked
+                    next_chunk = transfer.acked
+                continue
+
+            acks = transfer.acks
+            retries = 0
+            if transfer.status == BULK_DONE:
+                transfer.complete = True
+                return
+            if transfer.status == BULK_REFUSED or transfer.status == BULK_DIGEST_MISMATCH:
+                transfer.error = BULK_STATUS_NAMES[transfer.status]
+                return
+            if next_chunk is None:
+                next_chunk = transfer.acked  # Resumes after the chunks the receiver kept
+            if transfer.rewind is not None:
+                transfer.chunks_resent += max(0, next_chunk - transfer.rewind)
+                next_chunk = transfer.rewind
+                transfer.rewind = None
+            if on_progress:
+                on_progress(transfer)
+
+        transfer.error = "no acknowledgement"
+
+    def send_bulk_ack(self, transfer_id, incoming, status):
+        self.send_frame(bytes((FRAME_BULK_ACK, transfer_id, incoming.received >> 8, incoming.received & 0xFF,
+                               status)), remember=False)
+
+    def handle_bulk_start(self, payload):
+        """
+        Start receiving a transfer, or resume one already partly received, and acknowledge it.
+        """
+        transfer_id = payload[1]
+        length, chunk_size, window, digest = struct.unpack_from(BULK_HEADER, payload, 2)
+        name = bytes(payload[2 + BULK_HEADER_SIZE:]).decode('utf-8')
+
+        incoming = self.bulk_partial.get(digest)
+        if incoming is None or len(incoming.data) != length or incoming.chunk_size != chunk_size:
+            if self.bulk_handler is None or length > BULK_MAX_BYTES:
+                self.send_frame(bytes((FRAME_BULK_ACK, transfer_id, 0, 0, BULK_REFUSED)), remember=False)
+                return
+            while len(self.bulk_partial) >= BULK_KEEP:
+                del self.bulk_partial[next(iter(self.bulk_partial))]  # Make room by dropping an unfinished transfer
+            incoming = BulkIncoming(name, length, chunk_size, window, digest)
+            self.bulk_partial[digest] = incoming
+        incoming.missing_sent = False
+        self.bulk_receiving[transfer_id] = incoming
+
+        if incoming.received == incoming.chunks:
+            self.finish_bulk(transfer_id, incoming)
+        else:
+            self.send_bulk_ack(transfer_id, incoming, BULK_RECEIVING)
+
+    def handle_bulk_chunk(self, payload):
+        """
+        Store a chunk that arrived in order, and acknowledge every few chunks or a gap.
+        """
+        transfer_id = payload[1]
+        incoming = self.bulk_receiving.get(transfer_id)
+        if incoming is None:
+            return  # Its start was never received
+        index = payload[2] << 8 | payload[3]
+
+        if incoming.status != BULK_RECEIVING or index < incoming.received:
+            # A chunk sent again because an acknowledgement was lost
+            if index + 1 >= incoming.received or incoming.status != BULK_RECEIVING:
+                self.send_bulk_ack(transfer_id, incoming, incoming.status)
+            return
+
+        if index > incoming.received:
+            if not incoming.missing_sent:
+                incoming.missing_sent = True
+                self.send_bulk_ack(transfer_id, incoming, BULK_MISSING)
+            return
+
+        offset = index * incoming.chunk_size
+        data = payload[4:]
+        incoming.data[offset:offset + len(data)] = data
+        incoming.received += 1
+        incoming.missing_sent = False
+
+        if incoming.received == incoming.chunks:
+            self.finish_bulk(transfer_id, incoming)
+        elif incoming.received % incoming.ack_every == 0:
+            self.send_bulk_ack(transfer_id, incoming, BULK_RECEIVING)
+
+    def finish_bulk(self, transfer_id, incoming):
+        """
+        Check the digest of a complete transfer, acknowledge it and hand it to the bulk handler.
+        """
+        self.bulk_partial.pop(incoming.digest, None)
+        data = incoming.data
+        incoming.data = b""  # Only the status is kept, to answer chunks sent again
+        incoming.status = BULK_DONE if adler32(data) == incoming.digest else BULK_DIGEST_MISMATCH
+        self.send_bulk_ack(transfer_id, incoming, incoming.status)
+        if incoming.status == BULK_DONE:
+            self.bulk_handler(incoming.name, bytes(data))
+        else:
+            self.log.warning("Bulk transfer %s failed its digest", incoming.name)
+
+    def serve_waypoints(self, stream_id, waypoints, fmt, scales=None):
+        """
+        Serve a path to a WaypointStreamer on the brain. waypoints is a sequence
+        of value tuples packed with `fmt` and `scales`, as in MessageSchema.
+        Calling it again replaces the path, eg after replanning.
+        """
+        schema = MessageSchema(stream_id, fmt, scales)
+        if WAYPOINT_HEADER_SIZE + schema.codec.size > WAYPOINT_FRAME_LENGTH:
+            raise ValueError("A waypoint of " + str(schema.codec.size) + " bytes does not fit a frame")
+        self.waypoint_sources[stream_id] = (schema, waypoints)
+
+    def handle_waypoint_request(self, payload):
+        """
+        Queue the requested waypoints for the send thread, as many to a frame as
+        fit the brain's receive buffer. Replies take several frames, which must
+        not be clocked out from the receive callback: edges on CS while it runs
+        are only handled once it returns. Frames still queued for an earlier
+        request on the stream are dropped.
+        """
+        stream_id = payload[1]
+        source = self.waypoint_sources.get(stream_id)
+        if source is None:
+            return
+        schema, waypoints = source
+        per_frame = (WAYPOINT_FRAME_LENGTH - WAYPOINT_HEADER_SIZE) // schema.codec.size
+        index = payload[2] << 8 | payload[3]
+        end = min(index + payload[4], len(waypoints))
+
+        frames = []
+        while True:
+            count = min(per_frame, end - index)
+            last = index + count >= len(waypoints)
+            frame = bytearray((FRAME_WAYPOINTS, stream_id, index >> 8, index & 0xFF, WAYPOINTS_LAST if last else 0))
+            for values in waypoints[index:index + count]:
+                frame.extend(schema.encode(values)[2:])  # Without the typed frame header
+            frames.append(bytes(frame))
+            index += count
+            if index >= end:
+                break
+        self.queue_frames(frames, lambda queued: queued[0] == FRAME_WAYPOINTS and queued[1] == stream_id)
+
+    def sync_clock(self):
+        """
+        Make one clock exchange with the other end, see ClockSync. The estimate
+        in self.clock is updated when the reply arrives.
+        """
+        clock = self.clock
+        self.send_frame(clock.request(), remember=False)
+
+    def start_clock_sync(self, interval_ms=SYNC_INTERVAL_MS):
+        """
+        Sync the clock every interval_ms from a daemon thread.
+        """
+        if self.clock_thread is None:
+            self.clock_thread = threading.Thread(target=self.run_clock_sync, args=(interval_ms,), daemon=True)
+            self.clock_thread.start()
+
+    def run_clock_sync(self, interval_ms):
+        while True:
+            self.sync_clock()
+            time.sleep(interval_ms / 1000)
+
+    def handle_time(self, payload):
+        """
+        Answer a clock request, or take in the reply to one.
+        """
+        clock = self.clock
+        received = clock.link_time(self.frame_started)
+        if len(payload) == TIME_REQUEST_LENGTH:
+            self.send_frame(clock.reply(payload, received), remember=False)
+            return
+        delay = clock.add_reply(payload, received)
+        if delay is not None:
+            self.stats.round_trip_ms.record(max(delay, 0) / 1000)
+
+    def send_stamped(self, payload, sampled=None):
+        """
+        Send a string, or the payload of any other frame kind, with the time it was
+        sampled, a ticks_us() reading, now by default. The receiver sees when that
+        was on its own clock in message_sent_us, once its clock is synced.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        stamp = self.clock.link_time(ticks_us() if sampled is None else sampled)
+        self.send_frame(struct.pack(STAMP_HEADER, FRAME_STAMPED, stamp) + bytes(payload))
+
+    def handle_stamped(self, payload):
+        """
+        Dispatch the payload inside a stamped frame, with message_sent_us and
+        message_latency_us set while its callback runs.
+        """
+        clock = self.clock
+        if clock.synced():
+            sent = clock.to_local(struct.unpack_from(STAMP_HEADER, payload)[1])
+            self.message_sent_us = sent
+            self.message_latency_us = wrap_signed(clock.now() - sent)
+            self.stats.message_latency_ms.record(max(self.message_latency_us, 0) / 1000)
+        try:
+            self.dispatch_payload(payload[STAMP_HEADER_SIZE:])
+        finally:
+            self.message_sent_us = None
+            self.message_latency_us = None
+
+    def flush_state(self, full=False):
+        """
+        Send the state values set since the last flush that have changed.
+        With full=True every value is sent, eg to refresh a receiver that restarted.
+        """
+        for payload in self.state.encode_changes(full):
+            self.send_frame(payload)
 
+    def send_delta(self, channel_id, values):
+        """
+        Send a sample on a delta channel, as a keyframe or as changes from the last sample.
+        """
+        self.send_frame(self.delta_channels[channel_id].encode(values))
 
     def send_data(self, data):
         """
-        Send data to the external device by toggling clock and data pins.
+        Send a string message to the external device.
+        """
+        self.log.info("SEND: %s", data)
+
+        payload = bytes(data, "utf-8")
+        if self.dictionary_codec:
+            payload = self.compress_payload(payload)
+
+        self.send_frame(payload, remember=data != "ERROR")
+
+    def compress_payload(self, payload):
+        """
+        Dictionary compress a string payload, but only when that makes it shorter.
+        """
+        compressed = self.dictionary_codec.compress(payload)
+        if len(compressed) + 1 < len(payload):
+            return bytes((FRAME_COMPRESSED_TEXT,)) + compressed
+        return payload
+
+    def send_bytes(self, buf):
+        """
+        Send binary data (bytes, bytearray or memoryview) to the external device.
+        """
+        self.send_frame(bytes((FRAME_BYTES,)) + bytes(buf))
+
+    def send_frame(self, payload, remember=True):
+        """
+        Send a raw payload to the external device by toggling clock and data pins.
+        The payload is remembered so it can be resent when the receiver reports an ERROR.
+
+        Frames go out one at a time, whichever thread sends them. A frame sent
+        while another is going out is queued and sent next by the thread
+        sending that one, so a receive callback never waits on the main loop.
+        """
+        if len(payload) > MAX_PAYLOAD_LENGTH:
+            raise ValueError(f"Payload is longer than {MAX_PAYLOAD_LENGTH} bytes")
+
+        if remember:
+            self.last_message = payload
+
+        with self.send_lock:
+            self.outbox.append(payload)
+            if self.sending:
+                return
+            self.sending = True
+        self.send_queued()
+
+    def queue_frames(self, payloads, replaces=None):
+        """
+        Queue frames to be sent from the send thread, for receive callbacks that
+        must not wait for several frames to go out. Queued frames that the
+        function replaces(payload) is true for are dropped first. The frames are
+        not remembered for ERROR resends.
         """
+        with self.send_lock:
+            if replaces is not None:
+                self.outbox = deque(queued for queued in self.outbox if not replaces(queued))
+            self.outbox.extend(payloads)
+        if self.send_thread is None:
+            self.send_thread = threading.Thread(target=self.run_sender, daemon=True)
+            self.send_thread.start()
+        self.send_wakeup.set()
 
-        if data != "ERROR":
-            self.last_message = data
+    def run_sender(self):
+        while True:
+            self.send_wakeup.wait()
+            self.send_wakeup.clear()
+            with self.send_lock:
+                if self.sending or not self.outbox:
+                    continue  # The thread sending will send them
+                self.sending = True
+            self.send_queued()
+
+    def send_queued(self):
+        """
+        Clock out queued frames until there are none, by the thread that set sending.
+        """
+        while True:
+            with self.send_lock:
+                if not self.outbox:
+                    self.sending = False
+                    return
+                payload = self.outbox.popleft()
+            try:
+                self.transmit(payload)
+            except Exception:
+                with self.send_lock:
+                    self.sending = False
+                raise
+
+    def transmit(self, payload):
+        """
+        Clock one frame out, called by send_frame.
+        """
+        gap_us = FRAME_GAP_US - ticks_diff_us(ticks_us(), self.frame_ended)
+        if gap_us > 0:
+            time.sleep(gap_us / 1000000)  # Let the receiver see the last frame end
 
-        print(f"\nSEND: {data}\n")
+        profiler = self.profiler
+        started = ticks_us() if profiler is not None else 0
 
+        # Wait for CS to be low and for the end of any frame being received to
+        # be handled, or a reply that just arrived would be lost when the pins
+        # switch over. A falling edge that was missed is given up on after
+        # FRAME_GAP_US of CS low
+        low_since = None
         while True:
             try:
-                if GPIO.input(self.cs_pin) == 0:
+                if GPIO.input(self.cs_pin) == 1:
+                    low_since = None
+                elif not self.cs_active:
+                    break
+                elif low_since is None:
+                    low_since = ticks_us()
+                elif ticks_diff_us(ticks_us(), low_since) > FRAME_GAP_US:
+                    self.cs_active = False
                     break
             except:
                 pass
-                time.sleep(0.001)
+            time.sleep(0.001)  # Poll rather than spin while the other end is sending
 
         self.set_pins_send()  # Configure pins for sending mode
+        if profiler is not None:
+            started = profiler.record(STAGE_CS_WAIT, started)
+
+        tracer = self.tracer
+        last_bit = None
+
+        if len(payload) and payload[0] == FRAME_TIME:
+            payload = self.clock.stamp(payload, self.clock.now())
 
         # Activate CS pin to start transmission
         GPIO.output(self.cs_pin, GPIO.HIGH)
+        if tracer is not None:
+            tracer.record(SIGNAL_CS, 1)
         time.sleep(0.00001)  # Brief delay for stability
 
         # Convert data to binary stream (length, data, checksum)
-        length = len(data)
-        checksum = self.calculate_checksum(data)
-        payload = self.encode_payload(length, data, checksum)
+        length = len(payload)
+        checksum = self.calculate_checksum(payload)
+        bits = self.encode_payload(length, payload, checksum)
+        if profiler is not None:
+            started = profiler.record(STAGE_ENCODE, started)
 
         # Send each bit in the payload
-        for bit in payload:
+        for bit in bits:
             GPIO.output(self.data_pin, bit)  # Set data pin to bit value
             GPIO.output(self.clock_pin, GPIO.HIGH)  # Rising edge
-            time.sleep(0.0001)  # Delay for clock timing
+            if tracer is not None:
+                if bit != last_bit:
+                    tracer.record(SIGNAL_DATA, bit)
+                    last_bit = bit
+                tracer.record(SIGNAL_CLOCK, 1)
+            time.sleep(self.BIT_DELAY_US / 1000000)  # Delay for clock timing
             GPIO.output(self.clock_pin, GPIO.LOW)  # Falling edge
+            if tracer is not None:
+                tracer.record(SIGNAL_CLOCK, 0)
 
-        # Deactivate CS pin to end transmission
+        # Deactivate CS pin to end transmission, and be ready for a reply
         GPIO.output(self.cs_pin, GPIO.LOW)
-
+        self.frame_ended = ticks_us()
         self.set_pins_receive()  # Restore pins to receive mode
+        if tracer is not None:
+            tracer.record(SIGNAL_CS, 0)
+        if profiler is not None:
+            profiler.record(STAGE_CLOCKING, started)
+
+        self.stats.frames_out += 1
+        self.stats.bytes_out += length
+        if self.frame_log is not None:
+            self.frame_log.record(FRAME_OUT, FRAME_STATUS_OK, bytes((length,)) + bytes(payload) + bytes((checksum,)))
 
     def encode_payload(self, length, data, checksum):
         """
         Encode the length, data, and checksum into a binary stream.
         """
         bits = [int(bit) for bit in f"{length:08b}"]  # Length in 8 bits
-        for char in data:
-            bits.extend([int(bit) for bit in f"{ord(char):08b}"])  # ASCII of each character
+        for byte in data:
+            bits.extend([int(bit) for bit in f"{byte:08b}"])  # Each payload byte
         bits.extend([int(bit) for bit in f"{checksum:08b}"])  # Checksum in 8 bits
         return bits
 
@@ -140,40 +2649,60 @@ class V5ExternalComm:
         cs_state = GPIO.input(self.cs_pin)
         self.cs_active = cs_state == 1  # Update CS active state
 
+        if self.tracer is not None:
+            self.tracer.record(SIGNAL_CS, cs_state)
+
         if self.cs_active:
             # print("\nCS ACTIVE (HIGH): Communication started\n")
-            self.current_byte = []  # Reset current byte buffer
-            self.received_data = []  # Clear received data buffer
+            self.frame_started = ticks_us()
+            self.current_byte = 0  # Reset current byte
+            self.bit_count = 0
+            self.received_count = 0  # Clear received data buffer
         else:
             # print("\nCS INACTIVE (LOW): Communication ended\n")
+            bit_count = self.received_count * 8 + self.bit_count
+            if bit_count:
+                self.stats.bit_period_us.record(ticks_diff_us(ticks_us(), self.frame_started) / bit_count)
             self.process_and_display_buffer()  # Display the captured data
 
     def log_pins(self, pin):
         """
         Logs the state of the data pin when the clock pin goes high.
-        Captures 8 bits as one byte and calculates its ASCII value.
+        Captures 8 bits as one byte and stores it in the receive buffer.
         """
         if self.cs_active:  # Only log if CS is active
 
             data_state = GPIO.input(self.data_pin)
-            self.current_byte.append(data_state)
+            if self.tracer is not None:
+                # Record data changes, and the first bit of every byte
+                if self.bit_count == 0 or data_state != self.current_byte & 1:
+                    self.tracer.record(SIGNAL_DATA, data_state)
+                self.tracer.record(SIGNAL_CLOCK, 1)
+            self.current_byte = (self.current_byte << 1) | data_state
+            self.bit_count += 1
 
-            # If we have 8 bits, process the byte
-            if len(self.current_byte) == 8:
-                byte_value = int("".join(map(str, self.current_byte)), 2)  # Convert bits to integer
-                self.received_data.append(byte_value)  # Store the byte
-                self.current_byte = []  # Clear the byte buffer
+            # If we have 8 bits, store the byte
+            if self.bit_count == 8:
+                if self.received_count < len(self.received_data):
+                    self.received_data[self.received_count] = self.current_byte
+                    self.received_count += 1
+                self.current_byte = 0  # Clear the byte
+                self.bit_count = 0
 
     def calculate_checksum(self, data):
         """
-        Calculate the checksum for the given data.
+        Calculate the checksum for the given data (a string or bytes).
         """
-        return sum(bytearray(data, 'ascii')) % 256
+        if isinstance(data, str):
+            data = bytearray(data, 'utf-8')
+        return sum(data) % 256
 
     def set_pins_receive(self):
         """
         Configure GPIO pins for receive mode.
         """
+        if GPIO is None:
+            raise ImportError("Driving the pins needs RPi.GPIO, pip install RPi.GPIO")
         GPIO.cleanup()
 
         GPIO.setmode(GPIO.BCM)
@@ -197,4 +2726,28 @@ class V5ExternalComm:
 
         GPIO.output(self.cs_pin, GPIO.LOW)
         GPIO.output(self.clock_pin, GPIO.LOW)
-        GPIO.output(self.data_pin, GPIO.LOW)
\ No newline at end of file
+        GPIO.output(self.data_pin, GPIO.LOW)
+
+
+class ReplaySink(V5ExternalComm):
+    """
+    Receives the frames of a FrameLogReader.replay like a V5ExternalComm, with
+    the same callbacks, message types and delta channels, but has no pins and
+    never sends. Frames it would send, such as a resync after a lost delta, are
+    dropped. It needs no RPi.GPIO, so a log can be replayed on any PC.
+
+    Takes the keyword arguments of V5ExternalComm, eg
+    ReplaySink(on_message_received=print, dictionary=entries).
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(None, None, None, **kwargs)
+
+    def set_pins_receive(self):
+        pass
+
+    def send_frame(self, payload, remember=True):
+        pass
+
+    def queue_frames(self, payloads, replaces=None):
+        pass
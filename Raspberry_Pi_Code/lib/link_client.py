@@ -0,0 +1,257 @@
+# Client for link_daemon.py, which shares one V5ExternalComm between processes.
+#
+# Messages between a client and the daemon are framed as
+# [4 byte length][op][topic length][topic][body], the length counting everything
+# after itself. Topics name the kind of frame on the link:
+#
+# - "text": string messages, the body is utf-8.
+# - "bytes": binary frames from send_bytes, the body is the data.
+# - "typed/<type id>", "delta/<channel id>", "state": the whole frame payload,
+#     to decode with MessageSchema, DeltaChannel or StateMirror.
+#
+# Subscribing to "typed" receives every "typed/<type id>" topic and "*" receives
+# everything. Publishing to any topic other than "text" and "bytes" sends the
+# body as a complete frame payload, eg the output of MessageSchema.encode.
+#
+#     client = LinkClient(name="camera")
+#     client.subscribe("text")
+#     client.start(lambda topic, body: print(topic, body))
+#     client.publish("text", b"RPI_OUT 1")
+#
+# A client on the same Pi can ask for shared memory rings, see lib/shm_ring.py,
+# instead of the socket for its messages. Messages then cost one eventfd write
+# instead of a socket send and receive, the reader wakes once for a burst, and
+# bodies passed to the callback are memoryviews into the ring, only valid until
+# the callback returns:
+#
+#     client = LinkClient(name="odometry", shared_memory=True)
+#     space = client.rings.outbound.reserve(OP_PUBLISH, "bytes", 12)
+#     struct.pack_into("<fff", space, 0, x, y, heading)
+#     client.rings.outbound.commit()
+import json
+import queue
+import select
+import socket
+import struct
+import threading
+from collections import deque
+
+from lib.shm_ring import DEFAULT_RING_BYTES, SharedRings
+
+DEFAULT_SOCKET = "/tmp/v5_link.sock"
+
+OP_HELLO = 1  # Topic holds the client name, shown in the statistics
+OP_SUBSCRIBE = 2
+OP_UNSUBSCRIBE = 3
+OP_PUBLISH = 4  # Client to daemon, a message to send on the link
+OP_MESSAGE = 5  # Daemon to client, a message received on the link
+OP_STATS = 6  # Asks for the statistics, answered with a JSON body
+OP_SHARED_MEMORY = 7  # Asks for shared memory rings, answered with their file descriptors
+
+HEADER = struct.Struct(">IBB")  # Length, op, topic length
+MAX_MESSAGE_LENGTH = 65536
+
+
+def encode_message(op, topic="", body=b""):
+    """
+    Frame one message between a client and the daemon.
+    """
+    topic_bytes = topic.encode("utf-8")
+    return HEADER.pack(2 + len(topic_bytes) + len(body), op, len(topic_bytes)) + topic_bytes + bytes(body)
+
+
+def decode_messages(buffer):
+    """
+    Take every complete message from the front of a bytearray.
+    Returns a list of (op, topic, body) and leaves any partial message in the buffer.
+    """
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        length, op, topic_length = HEADER.unpack_from(buffer, offset)
+        if length > MAX_MESSAGE_LENGTH:
+            raise ValueError("Message of " + str(length) + " bytes is too long")
+        end = offset + 4 + length
+        if len(buffer) < end:
+            break
+        topic_end = offset + HEADER.size + topic_length
+        messages.append((op, buffer[offset + HEADER.size:topic_end].decode("utf-8"), bytes(buffer[topic_end:end])))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+def topic_matches(subscription, topic):
+    """
+    True when a subscription covers a topic: the same name, a parent like
+    "typed" for "typed/3", or "*".
+    """
+    return subscription == "*" or subscription == topic or topic.startswith(subscription + "/")
+
+
+def connect_socket(address):
+    """
+    Connect to a Unix socket path, or a (host, port) tuple or "host:port" string over TCP.
+    """
+    if isinstance(address, str) and ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        address = (host, int(port))
+    if isinstance(address, tuple):
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+class LinkClient:
+    """
+    One process's connection to the link daemon.
+
+    Parameters:
+    - address (str or tuple): Unix socket path, or "host:port" for TCP.
+    - name (str): Shown against this client in the daemon's statistics.
+    - shared_memory (bool): Exchange messages through shared memory rings, Unix socket only.
+    - ring_bytes (int): Size of each ring, a power of two.
+    """
+
+    def __init__(self, address=DEFAULT_SOCKET, name="client", shared_memory=False, ring_bytes=DEFAULT_RING_BYTES):
+        self.sock = connect_socket(address)
+        self.send_lock = threading.Lock()
+        self.buffer = bytearray()
+        self.pending = deque()  # Messages read but not yet returned by receive
+        self.stats_replies = queue.Queue()
+        self.thread = None
+        self.rings = None
+        self.ring_full = 0  # Messages not published because the outbound ring was full
+        self.send(OP_HELLO, name)
+        if shared_memory:
+            self.attach_rings(ring_bytes)
+
+    def attach_rings(self, ring_bytes):
+        if self.sock.family != socket.AF_UNIX:
+            raise ValueError("Shared memory needs the daemon's Unix socket")
+        self.send(OP_SHARED_MEMORY, "", str(ring_bytes).encode("utf-8"))
+        received = []
+        while True:
+            data, fds, _, _ = socket.recv_fds(self.sock, 65536, 8)
+            if not data:
+                raise ConnectionError("The link daemon closed the connection")
+            received.extend(fds)
+            self.buffer.extend(data)
+            for message in decode_messages(self.buffer):
+                if message[0] != OP_SHARED_MEMORY:
+                    self.pending.append(message)
+                elif not received:
+                    raise ValueError("The link daemon refused shared memory")
+                else:
+                    self.rings = SharedRings(fds=received, description=json.loads(message[2]))
+                    return
+
+    def send(self, op, topic="", body=b""):
+        with self.send_lock:
+            self.sock.sendall(encode_message(op, topic, body))
+
+    def subscribe(self, topic):
+        self.send(OP_SUBSCRIBE, topic)
+
+    def unsubscribe(self, topic):
+        self.send(OP_UNSUBSCRIBE, topic)
+
+    def publish(self, topic, body):
+        """
+        Queue a message for the link, a str body is sent as utf-8.
+        Returns False when the shared memory ring is full and the message was dropped.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if self.rings is None:
+            self.send(OP_PUBLISH, topic, body)
+        elif not self.rings.outbound.push(OP_PUBLISH, topic, body):
+            self.ring_full += 1
+            return False
+        return True
+
+    def receive(self):
+        """
+        Wait for the next message from the daemon. Returns (op, topic, body), or None once it has closed.
+        """
+        while not self.pending:
+            if not self.read_socket():
+                return None
+        return self.pending.popleft()
+
+    def read_socket(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            return False
+        self.buffer.extend(chunk)
+        self.pending.extend(decode_messages(self.buffer))
+        return True
+
+    def poll(self, callback, timeout=None):
+        """
+        Call callback(topic, body) for every message in the inbound ring, waiting up to timeout seconds for one.
+        Returns how many there were.
+        """
+        ring = self.rings.inbound
+        if not ring.used():
+            select.select([ring.wakeup], [], [], timeout)
+        ring.wakeup.clear()
+        return ring.drain(lambda op, topic, body: callback(topic, body))
+
+    def start(self, callback):
+        """
+        Call callback(topic, body) from a background thread for every message received.
+        """
+        def run_rings():
+            while True:
+                readable, _, _ = select.select([self.sock, self.rings.inbound.wakeup], [], [])
+                if self.sock in readable:
+                    if not self.read_socket():
+                        break
+                    while self.pending:
+                        op, topic, body = self.pending.popleft()
+                        if op == OP_STATS:
+                            self.stats_replies.put(json.loads(body))
+                self.rings.inbound.wakeup.clear()
+                self.rings.inbound.drain(lambda op, topic, body: callback(topic, body))
+
+        def run():
+            while True:
+                message = self.receive()
+                if message is None:
+                    break
+                op, topic, body = message
+                if op == OP_MESSAGE:
+                    callback(topic, body)
+                elif op == OP_STATS:
+                    self.stats_replies.put(json.loads(body))
+
+        self.thread = threading.Thread(target=run if self.rings is None else run_rings, daemon=True)
+        self.thread.start()
+
+    def stats(self, timeout=1.0):
+        """
+        The daemon's statistics as a dict.
+        """
+        self.send(OP_STATS)
+        if self.thread is not None:
+            return self.stats_replies.get(timeout=timeout)
+
+        # Read up to the reply, keeping the messages before it for receive
+        skipped = []
+        while True:
+            message = self.receive()
+            if message is None:
+                raise ConnectionError("The link daemon closed the connection")
+            if message[0] == OP_STATS:
+                self.pending.extendleft(reversed(skipped))
+                return json.loads(message[2])
+            skipped.append(message)
+
+    def close(self):
+        self.sock.close()
+        if self.rings is not None and self.thread is None:
+            self.rings.close()  # Left to the process exit while the reader thread may be using them
@@ -0,0 +1,245 @@
+# Shared memory rings between link_daemon.py and a client on the same Pi.
+#
+# A pair of single producer, single consumer rings live in one memfd that
+# the daemon passes to the client over its Unix socket, along with an eventfd
+# (or a pipe where there is no eventfd) per ring for wakeups. The inbound ring
+# carries messages received on the link from the daemon to the client, the
+# outbound ring messages for the link from the client to the daemon.
+#
+# Records use the same framing as the socket, [length][op][topic length]
+# [topic][body], padded to 4 bytes. Each ring has a head, only written by its
+# producer, and a tail, only written by its consumer, so no locks are needed.
+# Both are free running 32 bit counts of bytes, which are written in one store
+# on a 32 bit Pi too.
+#
+# The producer signals the wakeup after every message. Checking whether the
+# consumer had emptied the ring first would save the write, but Python has no
+# memory fence, so the producer could read a stale tail while the consumer
+# reads a stale head, and both would decide the other has nothing to do. The
+# eventfd write is a system call, which orders the head store before it, and
+# its count adds up, so the consumer still wakes once for a burst of messages.
+#
+#     rings = SharedRings(65536)
+#     rings.outbound.push(OP_PUBLISH, "bytes", b"\x01\x02")
+#     rings.outbound.drain(lambda op, topic, body: print(topic, bytes(body)))
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+HEADER = struct.Struct(">IBB")  # Length, op, topic length, as link_client.HEADER
+COUNTER = struct.Struct(">I")  # Head, tail and record lengths
+RING_HEADER = 128  # Head and tail on separate cache lines
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+PADDING = 0xFFFFFFFF  # Length of a record that skips to the start of the ring
+DEFAULT_RING_BYTES = 65536
+MAX_RING_BYTES = 1 << 24
+
+
+def align(size):
+    return (size + 3) & ~3
+
+
+class Wakeup:
+    """
+    An eventfd, or a pipe, to wake the consumer of a ring.
+
+    Parameters:
+    - fds (list, optional): File descriptors received from the other process, a new eventfd when None.
+    """
+
+    def __init__(self, fds=None):
+        if fds is None:
+            if hasattr(os, "eventfd"):
+                fds = [os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)]
+            else:
+                fds = list(os.pipe())
+                for fd in fds:
+                    os.set_blocking(fd, False)
+        self.fds = fds
+        self.read_fd = fds[0]
+        self.write_fd = fds[-1]
+
+    def fileno(self):
+        return self.read_fd
+
+    def signal(self):
+        try:
+            os.write(self.write_fd, (1).to_bytes(8, sys.byteorder))  # An eventfd takes exactly 8 bytes
+        except BlockingIOError:
+            pass  # Already signalled
+
+    def clear(self):
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+
+
+class SpscRing:
+    """
+    A single producer, single consumer ring of messages in shared memory.
+
+    Parameters:
+    - buffer (memoryview): The ring's header and data, RING_HEADER bytes plus a power of two.
+    - wakeup (Wakeup): Signalled after every message pushed.
+    """
+
+    def __init__(self, buffer, wakeup):
+        self.buffer = buffer
+        self.data = buffer[RING_HEADER:]
+        self.capacity = len(self.data)
+        if self.capacity & (self.capacity - 1):
+            raise ValueError("Ring capacity " + str(self.capacity) + " is not a power of two")
+        self.wakeup = wakeup
+        self.reserved = None  # (head, end) of a record being written
+
+    def head(self):
+        return COUNTER.unpack_from(self.buffer, HEAD_OFFSET)[0]
+
+    def tail(self):
+        return COUNTER.unpack_from(self.buffer, TAIL_OFFSET)[0]
+
+    def used(self):
+        return (self.head() - self.tail()) & 0xFFFFFFFF
+
+    # Producer
+
+    def reserve(self, op, topic, length):
+        """
+        Space for a message with a body of length bytes, or None when the ring is full.
+        Returns a memoryview to write the body into, the message is sent by commit().
+        """
+        topic_bytes = topic.encode("utf-8")
+        size = align(HEADER.size + len(topic_bytes) + length)
+        if size > self.capacity // 2:
+            raise ValueError("Message of " + str(length) + " bytes is too long for the ring")
+
+        head = self.head()
+        free = self.capacity - ((head - self.tail()) & 0xFFFFFFFF)
+        offset = head & (self.capacity - 1)
+        skip = self.capacity - offset if offset + size > self.capacity else 0
+        if skip + size > free:
+            return None
+        if skip:
+            COUNTER.pack_into(self.data, offset, PADDING)
+            offset = 0
+
+        HEADER.pack_into(self.data, offset, 2 + len(topic_bytes) + length, op, len(topic_bytes))
+        start = offset + HEADER.size
+        self.data[start:start + len(topic_bytes)] = topic_bytes
+        start += len(topic_bytes)
+        self.reserved = (head, (head + skip + size) & 0xFFFFFFFF)
+        return self.data[start:start + length]
+
+    def commit(self):
+        end = self.reserved[1]
+        self.reserved = None
+        COUNTER.pack_into(self.buffer, HEAD_OFFSET, end)
+        self.wakeup.signal()
+
+    def push(self, op, topic, body):
+        """
+        Copy a message into the ring. Returns False when the ring is full.
+        """
+        space = self.reserve(op, topic, len(body))
+        if space is None:
+            return False
+        space[:] = body
+        self.commit()
+        return True
+
+    # Consumer
+
+    def drain(self, callback):
+        """
+        Call callback(op, topic, body) for every message in the ring and return how many there were.
+        body is a memoryview into the ring, only valid until the callback returns.
+        Clear the wakeup before draining, so a message pushed meanwhile leaves it signalled.
+        """
+        count = 0
+        tail = self.tail()
+        head = self.head()
+        while tail != head:
+            offset = tail & (self.capacity - 1)
+            length = COUNTER.unpack_from(self.data, offset)[0]
+            if length == PADDING:
+                tail = (tail + self.capacity - offset) & 0xFFFFFFFF
+                continue
+            _, op, topic_length = HEADER.unpack_from(self.data, offset)
+            start = offset + HEADER.size
+            topic = bytes(self.data[start:start + topic_length]).decode("utf-8")
+            body = self.data[start + topic_length:offset + 4 + length]
+            try:
+                callback(op, topic, body)
+            finally:
+                body.release()
+            tail = (tail + align(4 + length)) & 0xFFFFFFFF
+            COUNTER.pack_into(self.buffer, TAIL_OFFSET, tail)
+            count += 1
+            if tail == head:
+                head = self.head()  # Catch messages pushed meanwhile before going back to sleep
+        return count
+
+
+class SharedRings:
+    """
+    The inbound and outbound rings for one client, in one shared memory file.
+
+    Parameters:
+    - ring_bytes (int): Data bytes in each ring, a power of two.
+    - fds (list, optional): Received from the daemon, see fds(), creates new rings when None.
+    - description (dict, optional): Received from the daemon with the fds.
+    """
+
+    def __init__(self, ring_bytes=DEFAULT_RING_BYTES, fds=None, description=None):
+        if fds is None:
+            if hasattr(os, "memfd_create"):
+                fd = os.memfd_create("v5_link_rings", os.MFD_CLOEXEC)
+            else:
+                with tempfile.TemporaryFile() as temporary:
+                    fd = os.dup(temporary.fileno())
+            os.ftruncate(fd, 2 * (RING_HEADER + ring_bytes))
+            inbound_wakeup = Wakeup()
+            outbound_wakeup = Wakeup()
+        else:
+            ring_bytes = description["ring_bytes"]
+            fd = fds[0]
+            split = 1 + description["inbound_fds"]
+            inbound_wakeup = Wakeup(fds[1:split])
+            outbound_wakeup = Wakeup(fds[split:])
+
+        self.fd = fd
+        self.ring_bytes = ring_bytes
+        self.map = mmap.mmap(fd, 2 * (RING_HEADER + ring_bytes))
+        self.view = memoryview(self.map)
+        half = RING_HEADER + ring_bytes
+        self.inbound = SpscRing(self.view[:half], inbound_wakeup)
+        self.outbound = SpscRing(self.view[half:], outbound_wakeup)
+
+    def fds(self):
+        """
+        The file descriptors to pass to the client, and the description of them.
+        """
+        description = {
+            "ring_bytes": self.ring_bytes,
+            "inbound_fds": len(self.inbound.wakeup.fds),
+            "outbound_fds": len(self.outbound.wakeup.fds),
+        }
+        return [self.fd] + self.inbound.wakeup.fds + self.outbound.wakeup.fds, description
+
+    def close(self):
+        for ring in (self.inbound, self.outbound):
+            ring.data.release()
+            ring.buffer.release()
+            ring.wakeup.close()
+        self.view.release()
+        self.map.close()
+        os.close(self.fd)
@@ -0,0 +1,254 @@
+# Columnar store for telemetry received on the Pi, backed by NumPy.
+#
+# Every field gets a pair of fixed size ring buffers, the time each value
+# arrived and the value, so memory stays bounded however long the robot
+# runs. Values go in from the link callbacks and come out as arrays, for
+# windowed statistics, downsampling for plots and export, without parsing
+# strings again or keeping growing Python lists.
+#
+#     store = TelemetryStore(capacity=30000)
+#     comm = V5ExternalComm(..., fields={"x": int, "y": int}, on_fields_received=store.on_fields)
+#     comm.register_delta_channel(1, 3, callback=store.handler(("left", "right", "heading")))
+#     store.mean("x", seconds=5)
+#     times, values = store.downsample("heading", bucket_s=0.5)
+#     store.to_csv("match.csv")
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CAPACITY = 10000  # Values kept per field
+
+
+class FieldSeries:
+    """
+    The times and values of one field, in a pair of ring buffers.
+
+    Parameters:
+    - capacity (int): Values kept, the oldest is overwritten once full.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)  # time.monotonic() of each value
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.index = 0  # Next slot to write
+        self.count = 0  # Values written, up to capacity
+
+    def latest_time(self):
+        return self.times[self.index - 1] if self.count else None
+
+    def append(self, timestamp, value):
+        index = self.index
+        self.times[index] = timestamp
+        self.values[index] = value
+        index += 1
+        self.index = index if index < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def arrays(self):
+        """
+        Copies of the times and values, oldest first.
+        """
+        if self.count < self.capacity:
+            return self.times[:self.count].copy(), self.values[:self.count].copy()
+        order = np.r_[self.index:self.capacity, 0:self.index]
+        return self.times[order], self.values[order]
+
+    def last(self, n):
+        """
+        The latest n times and values, oldest first.
+        """
+        n = min(n, self.count)
+        order = (np.arange(self.index - n, self.index)) % self.capacity
+        return self.times[order], self.values[order]
+
+
+class TelemetryStore:
+    """
+    Ring buffers of received values per field, with windowed queries.
+
+    Parameters:
+    - capacity (int, optional): Values kept per field.
+
+    Fields are created the first time a value arrives for them. Values are
+    stored as 64 bit floats, None values are skipped. It is safe to query the
+    store from the main loop while the link callbacks add to it.
+
+    Times are time.monotonic() readings, so windows stay correct when the Pi's
+    wall clock is set while the robot runs. The export functions convert them
+    to time.time() values.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.series = {}
+        self.lock = threading.Lock()
+        self.wall_offset = time.time() - time.monotonic()  # Added to stored times on export
+
+    def field_names(self):
+        return list(self.series)
+
+    def append(self, field, value, timestamp=None):
+        """
+        Add one value, at time.monotonic() by default.
+        """
+        self.append_many({field: value}, timestamp)
+
+    def append_many(self, values, timestamp=None):
+        """
+        Add a dict of field values that arrived together, eg from a FieldParser,
+        at time.monotonic() by default.
+        Raises ValueError when the timestamp is older than a field's latest value.
+        """
+        with self.lock:
+            if timestamp is None:
+                timestamp = time.monotonic()
+            else:
+                for field, value in values.items():
+                    series = self.series.get(field)
+                    latest = series.latest_time() if series is not None and value is not None else None
+                    if latest is not None and timestamp < latest:
+                        raise ValueError(f"Timestamp {timestamp} is older than the latest {field} value at {latest}")
+            for field, value in values.items():
+                if value is None:
+                    continue
+                series = self.series.get(field)
+                if series is None:
+                    series = self.series[field] = FieldSeries(self.capacity)
+                series.append(timestamp, value)
+
+    def on_fields(self, values):
+        """
+        An on_fields_received callback that stores every field.
+        """
+        self.append_many(values)
+
+    def handler(self, names):
+        """
+        A callback for typed messages or delta channels that stores each value under its name in names.
+        """
+        def store_values(values):
+            self.append_many(dict(zip(names, values)))
+
+        return store_values
+
+    # Queries
+
+    def window(self, field, seconds=None, start=None, end=None):
+        """
+        Times and values of a field, oldest first, for the last `seconds`
+        or from start to end (time.monotonic() values). The whole ring when none are given.
+        """
+        with self.lock:
+            series = self.series.get(field)
+            if series is None:
+                return np.zeros(0), np.zeros(0)
+            times, values = series.arrays()
+        if seconds is not None:
+            start = time.monotonic() - seconds
+        first = np.searchsorted(times, start, side="left") if start is not None else 0
+        last = np.searchsorted(times, end, side="right") if end is not None else len(times)
+        return times[first:last], values[first:last]
+
+    def last(self, field, n):
+        """
+        The latest n times and values of a field, oldest first.
+        """
+        with self.lock:
+            series = self.series.get(field)
+            if series is None:
+                return np.zeros(0), np.zeros(0)
+            return series.last(n)
+
+    def latest(self, field):
+        """
+        The latest value of a field, or None.
+        """
+        values = self.last(field, 1)[1]
+        return float(values[0]) if len(values) else None
+
+    def mean(self, field, seconds=None):
+        values = self.window(field, seconds)[1]
+        return float(values.mean()) if len(values) else None
+
+    def max(self, field, seconds=None):
+        values = self.window(field, seconds)[1]
+        return float(values.max()) if len(values) else None
+
+    def min(self, field, seconds=None):
+        values = self.window(field, seconds)[1]
+        return float(values.min()) if len(values) else None
+
+    def downsample(self, field, bucket_s, seconds=None, how="mean"):
+        """
+        One value per bucket_s of time, "mean", "max", "min" or "last" of the values in each bucket.
+        Returns the start time of each bucket holding values, and their values.
+        """
+        times, values = self.window(field, seconds)
+        if not len(times):
+            return times, values
+        buckets = np.floor((times - times[0]) / bucket_s).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        bucket_times = times[0] + buckets[starts] * bucket_s
+        if how == "mean":
+            return bucket_times, np.add.reduceat(values, starts) / np.diff(np.r_[starts, len(values)])
+        if how == "max":
+            return bucket_times, np.maximum.reduceat(values, starts)
+        if how == "min":
+            return bucket_times, np.minimum.reduceat(values, starts)
+        if how == "last":
+            return bucket_times, values[np.r_[starts[1:], len(values)] - 1]
+        raise ValueError("Unknown downsample " + repr(how))
+
+    # Export
+
+    def columns(self, fields=None):
+        """
+        Every stored value as three columns: field name, time and value.
+        The times are time.time() values.
+        """
+        names = []
+        all_times = []
+        all_values = []
+        for field in fields or self.field_names():
+            times, values = self.window(field)
+            names.append(np.full(len(times), field, dtype=object))
+            all_times.append(times)
+            all_values.append(values)
+        if not names:
+            return np.zeros(0, dtype=object), np.zeros(0), np.zeros(0)
+        return np.concatenate(names), np.concatenate(all_times) + self.wall_offset, np.concatenate(all_values)
+
+    def to_csv(self, path, fields=None):
+        """
+        Write the stored values to a CSV file, one row of field, time and value per value.
+        """
+        names, times, values = self.columns(fields)
+        table = np.empty((len(names), 3), dtype=object)
+        table[:, 0] = names
+        table[:, 1] = times
+        table[:, 2] = values
+        np.savetxt(path, table, fmt=("%s", "%.6f", "%.10g"), delimiter=",", header="field,time,value", comments="")
+
+    def to_parquet(self, path, fields=None):
+        """
+        Write the stored values to a Parquet file with field, time and value columns. Needs pyarrow.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow, pip install pyarrow") from None
+        names, times, values = self.columns(fields)
+        table = pyarrow.table({
+            "field": pyarrow.array(names.tolist()).dictionary_encode(),
+            "time": times,
+            "value": values,
+        })
+        pyarrow.parquet.write_table(table, path)
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
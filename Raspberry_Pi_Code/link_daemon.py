@@ -0,0 +1,430 @@
+# Share the link to the brain between processes.
+#
+# Only one process can own the GPIO pins, so this daemon owns the
+# V5ExternalComm and serves it on a Unix socket, and optionally over TCP.
+# Clients, see lib/link_client.py, subscribe to topics to receive messages
+# from the brain and publish messages to send to it. Messages from different
+# clients take turns on the link by deficit round robin, so a client sending
+# a lot cannot hold up the others, and every message received is copied to
+# each client subscribed to its topic. Clients on the same Pi can exchange
+# their messages through shared memory rings instead, see lib/shm_ring.py.
+#
+# Run from the Raspberry_Pi_Code folder:
+#   python link_daemon.py
+#   python link_daemon.py --tcp 127.0.0.1:7350 --stats-interval 10
+import argparse
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from lib.V5_External_Comm_Lib import (FRAME_BYTES, FRAME_DELTA, FRAME_KEYFRAME, FRAME_STATE, FRAME_TYPED,
+                                      LOG_WARNING, V5ExternalComm)
+from lib.link_client import (DEFAULT_SOCKET, OP_HELLO, OP_MESSAGE, OP_PUBLISH, OP_SHARED_MEMORY, OP_STATS,
+                             OP_SUBSCRIBE, OP_UNSUBSCRIBE, decode_messages, encode_message, topic_matches)
+from lib.shm_ring import DEFAULT_RING_BYTES, MAX_RING_BYTES, SharedRings
+
+QUANTUM_BYTES = 64  # Bytes of link time a client earns each turn
+CLIENT_QUEUE_LIMIT = 64  # Messages from one client waiting for the link, more are dropped
+CLIENT_BUFFER_LIMIT = 1 << 20  # Bytes waiting to be read by one client, more are dropped
+
+
+def payload_topic(payload):
+    """
+    The topic of a frame payload received on the link, or None for frames
+    the library handles itself, such as ERROR, RPC and resync frames.
+    """
+    if len(payload) == 0 or payload[0] >= 0x20:
+        return None if payload == b"ERROR" else "text"
+    kind = payload[0]
+    if kind == FRAME_BYTES:
+        return "bytes"
+    if kind == FRAME_TYPED:
+        return "typed/" + str(payload[1])
+    if kind == FRAME_KEYFRAME or kind == FRAME_DELTA:
+        return "delta/" + str(payload[1])
+    if kind == FRAME_STATE:
+        return "state"
+    return None
+
+
+class Client:
+    """
+    A connected process: its socket buffers, subscriptions, queue for the link and throughput.
+    """
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.name = str(address or "unix")
+        self.subscriptions = set()
+        self.inbox = bytearray()  # Read from the socket, not yet a whole message
+        self.outbox = bytearray()  # Waiting to be written to the socket
+        self.queue = deque()  # (topic, body) waiting for the link
+        self.deficit = 0  # Bytes it may still send this turn
+        self.active = False  # In the round robin
+        self.rings = None  # SharedRings, when the client asked for them
+        self.connected = time.monotonic()
+
+        self.published = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.send_failures = 0
+        self.queue_drops = 0
+        self.delivered = 0
+        self.delivered_bytes = 0
+        self.slow_drops = 0  # Messages not copied because the client was not reading
+
+    def snapshot(self):
+        seconds = max(time.monotonic() - self.connected, 1e-6)
+        return {
+            "name": self.name,
+            "shared_memory": self.rings is not None,
+            "subscriptions": sorted(self.subscriptions),
+            "connected_s": round(seconds, 1),
+            "published": self.published,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "sent_Bps": round(self.sent_bytes / seconds, 1),
+            "send_failures": self.send_failures,
+            "queue_drops": self.queue_drops,
+            "queued": len(self.queue),
+            "delivered": self.delivered,
+            "delivered_bytes": self.delivered_bytes,
+            "delivered_Bps": round(self.delivered_bytes / seconds, 1),
+            "slow_drops": self.slow_drops,
+        }
+
+
+class LinkBridge:
+    """
+    Serves one V5ExternalComm to many clients.
+
+    Parameters:
+    - comm (V5ExternalComm): The link, its messages are taken over from its callbacks.
+    - unix_path (str): Unix socket to listen on, None for none.
+    - tcp_address (tuple, optional): (host, port) to also listen on over TCP.
+    """
+
+    def __init__(self, comm, unix_path=DEFAULT_SOCKET, tcp_address=None):
+        self.comm = comm
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}  # Socket -> Client
+        self.round = deque()  # Clients with messages for the link, in turn order
+        self.lock = threading.Condition()  # Guards the clients' queues and outboxes
+        self.running = True
+        self.unix_path = unix_path
+
+        # Received frames are fanned out before the library's own dispatch
+        self.dispatch_payload = comm.dispatch_payload
+        comm.dispatch_payload = self.on_payload
+
+        # The link threads wake the select loop through this pair when there is output
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, "wake")
+
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)  # Left behind by an earlier run
+            self.listen(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), unix_path)
+        if tcp_address:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen(listener, tcp_address)
+
+        self.sender = threading.Thread(target=self.send_loop, daemon=True)
+        self.sender.start()
+
+    def listen(self, listener, address):
+        listener.bind(address)
+        listener.listen()
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, "listen")
+
+    # Link to clients
+
+    def on_payload(self, payload):
+        """
+        Copy a received frame to the clients subscribed to its topic.
+        """
+        topic = payload_topic(payload)
+        if topic is None:
+            self.dispatch_payload(payload)
+            return
+
+        body = bytes(payload[1:]) if topic == "bytes" else bytes(payload)
+        message = None
+        with self.lock:
+            for client in self.clients.values():
+                if not any(topic_matches(subscription, topic) for subscription in client.subscriptions):
+                    continue
+                if client.rings is not None:
+                    if client.rings.inbound.push(OP_MESSAGE, topic, body):
+                        client.delivered += 1
+                        client.delivered_bytes += len(body)
+                    else:
+                        client.slow_drops += 1
+                    continue
+                if message is None:
+                    message = encode_message(OP_MESSAGE, topic, body)
+                if len(client.outbox) > CLIENT_BUFFER_LIMIT:
+                    client.slow_drops += 1
+                    continue
+                client.outbox.extend(message)
+                client.delivered += 1
+                client.delivered_bytes += len(body)
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b"\0")
+        except BlockingIOError:
+            pass  # Already woken
+
+    # Clients to link
+
+    def next_message(self):
+        """
+        Take the next message for the link by deficit round robin, called with the lock held.
+        Each turn a client earns QUANTUM_BYTES and sends while it has enough for its next message.
+        """
+        while True:
+            client = self.round[0]
+            if not client.queue:
+                self.round.popleft()
+                client.active = False
+                client.deficit = 0
+                if not self.round:
+                    return None, None, None
+                continue
+            topic, body = client.queue[0]
+            if client.deficit >= len(body):
+                client.deficit -= len(body)
+                client.queue.popleft()
+                return client, topic, body
+            client.deficit += QUANTUM_BYTES
+            self.round.rotate(-1)
+
+    def send_loop(self):
+        while self.running:
+            with self.lock:
+                while self.running and not self.round:
+                    self.lock.wait()
+                if not self.running:
+                    return
+                client, topic, body = self.next_message()
+            if client is None:
+                continue
+            try:
+                if topic == "text":
+                    self.comm.send_data(body.decode("utf-8", "replace"))
+                elif topic == "bytes":
+                    self.comm.send_bytes(body)
+                else:
+                    self.comm.send_frame(body)
+            except ValueError:
+                client.send_failures += 1  # Too long for one frame
+                continue
+            client.sent += 1
+            client.sent_bytes += len(body)
+
+    def publish(self, client, topic, body):
+        with self.lock:
+            client.published += 1
+            if len(client.queue) >= CLIENT_QUEUE_LIMIT:
+                client.queue_drops += 1
+                return
+            client.queue.append((topic, body))
+            if not client.active:
+                client.active = True
+                self.round.append(client)
+                self.lock.notify()
+
+    # Sockets
+
+    def accept(self, listener):
+        sock, address = listener.accept()
+        sock.setblocking(False)
+        client = Client(sock, address)
+        with self.lock:
+            self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def disconnect(self, client):
+        self.selector.unregister(client.sock)
+        client.sock.close()
+        with self.lock:
+            del self.clients[client.sock]
+            client.queue.clear()  # Left for next_message to take out of the round
+            if client.rings is not None:
+                self.selector.unregister(client.rings.outbound.wakeup)
+                client.rings.close()
+                client.rings = None
+
+    def share_memory(self, client, body):
+        """
+        Give a client shared memory rings, passing their file descriptors over its socket.
+        body holds the size of each ring, the default when empty. An empty reply
+        without them refuses, eg over TCP or for a size that is not a power of two.
+        """
+        try:
+            ring_bytes = int(body or DEFAULT_RING_BYTES)
+        except ValueError:
+            ring_bytes = 0
+        valid_size = 0 < ring_bytes <= MAX_RING_BYTES and not ring_bytes & (ring_bytes - 1)
+        if client.sock.family != socket.AF_UNIX or client.rings is not None or not valid_size:
+            with self.lock:
+                client.outbox.extend(encode_message(OP_SHARED_MEMORY))
+            return
+        rings = SharedRings(ring_bytes)
+        fds, description = rings.fds()
+        reply = encode_message(OP_SHARED_MEMORY, "", json.dumps(description).encode("utf-8"))
+        with self.lock:
+            # The client waits for this reply before anything else, so it can skip the outbox
+            socket.send_fds(client.sock, [reply], fds)
+            client.rings = rings
+        self.selector.register(rings.outbound.wakeup, selectors.EVENT_READ, ("ring", client))
+
+    def drain_ring(self, client):
+        def publish(op, topic, body):
+            if op == OP_PUBLISH:
+                self.publish(client, topic, bytes(body))
+
+        client.rings.outbound.wakeup.clear()
+        client.rings.outbound.drain(publish)
+
+    def read(self, client):
+        try:
+            chunk = client.sock.recv(65536)
+        except ConnectionError:
+            chunk = b""
+        if not chunk:
+            self.disconnect(client)
+            return
+        client.inbox.extend(chunk)
+        try:
+            messages = decode_messages(client.inbox)
+        except ValueError:
+            self.disconnect(client)
+            return
+        for op, topic, body in messages:
+            if op == OP_PUBLISH:
+                self.publish(client, topic, body)
+            elif op == OP_SUBSCRIBE:
+                client.subscriptions.add(topic)
+            elif op == OP_UNSUBSCRIBE:
+                client.subscriptions.discard(topic)
+            elif op == OP_HELLO:
+                client.name = topic
+            elif op == OP_SHARED_MEMORY:
+                self.share_memory(client, body)
+            elif op == OP_STATS:
+                reply = encode_message(OP_STATS, "", json.dumps(self.snapshot_stats()).encode("utf-8"))
+                with self.lock:
+                    client.outbox.extend(reply)
+
+    def write(self, client):
+        with self.lock:
+            try:
+                written = client.sock.send(client.outbox)
+            except BlockingIOError:
+                return
+            except ConnectionError:
+                written = None
+            if written is not None:
+                del client.outbox[:written]
+        if written is None:
+            self.disconnect(client)
+
+    def serve_forever(self, stats_interval=None):
+        """
+        Run the socket loop until stop() is called, printing the client statistics every stats_interval seconds.
+        """
+        next_stats = time.monotonic() + stats_interval if stats_interval else None
+        while self.running:
+            for key, events in self.selector.select(timeout=1):
+                if key.data == "listen":
+                    self.accept(key.fileobj)
+                elif key.data == "wake":
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif isinstance(key.data, tuple):
+                    if key.data[1].rings is not None:
+                        self.drain_ring(key.data[1])
+                else:
+                    if events & selectors.EVENT_READ and key.fileobj in self.clients:
+                        self.read(key.data)
+                    if events & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                        self.write(key.data)
+
+            # Only wait to write to clients with something to write
+            with self.lock:
+                waiting = [(client, bool(client.outbox)) for client in self.clients.values()]
+            for client, has_output in waiting:
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if has_output else 0)
+                if self.selector.get_key(client.sock).events != events:
+                    self.selector.modify(client.sock, events, client)
+
+            if next_stats is not None and time.monotonic() >= next_stats:
+                next_stats += stats_interval
+                print(format_client_stats(self.snapshot_stats()))
+
+    def snapshot_stats(self):
+        with self.lock:
+            clients = [client.snapshot() for client in self.clients.values()]
+        return {"link": self.comm.snapshot_stats(), "clients": clients}
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            self.lock.notify()
+        self.wake()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+
+def format_client_stats(stats):
+    lines = [f"{'client':16} {'sent':>7} {'B/s':>8} {'queued':>6} {'drops':>6} {'recv':>7} {'B/s':>8} {'slow':>5}"]
+    for client in stats["clients"]:
+        lines.append(f"{client['name'][:16]:16} {client['sent']:7} {client['sent_Bps']:8.1f} {client['queued']:6} "
+                     f"{client['queue_drops']:6} {client['delivered']:7} {client['delivered_Bps']:8.1f} "
+                     f"{client['slow_drops']:5}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Share the link to the brain between processes.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--tcp", help="also listen on HOST:PORT, eg 127.0.0.1:7350")
+    parser.add_argument("--cs-pin", type=int, default=21)
+    parser.add_argument("--clock-pin", type=int, default=22)
+    parser.add_argument("--data-pin", type=int, default=23)
+    parser.add_argument("--stats-interval", type=float, help="print client throughput every this many seconds")
+    args = parser.parse_args()
+
+    tcp_address = None
+    if args.tcp:
+        host, port = args.tcp.rsplit(":", 1)
+        tcp_address = (host, int(port))
+
+    comm = V5ExternalComm(cs_pin=args.cs_pin, clock_pin=args.clock_pin, data_pin=args.data_pin,
+                          log_level=LOG_WARNING)
+    bridge = LinkBridge(comm, args.socket, tcp_address)
+    print(f"Serving the link on {args.socket}" + (f" and {args.tcp}" if args.tcp else ""))
+    try:
+        bridge.serve_forever(args.stats_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.stop()
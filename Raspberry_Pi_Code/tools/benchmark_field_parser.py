@@ -0,0 +1,50 @@
+# Benchmark the precompiled FieldParser against naive split/int parsing.
+#
+# Run from the Raspberry_Pi_Code folder:
+#   python -m tools.benchmark_field_parser
+import timeit
+
+from lib.V5_External_Comm_Lib import FieldParser
+
+# Payloads in the style the senders already use, with the field spec of each stream
+STREAMS = [
+    ("x90,y100", {"x": int, "y": int}),
+    ("x-1203,y877,h359,s12", {"x": int, "y": int, "h": int, "s": int}),
+    ("left1520,right1498,heading271,battery87", {"left": int, "right": int, "heading": int, "battery": int}),
+    # Fields out of order, so the parser has to fall back to scanning for keys
+    ("y877,x-1203,s12,h359", {"x": int, "y": int, "h": int, "s": int}),
+]
+
+
+def naive_parse(payload):
+    """
+    The parsing usually hand written inside on_message_received.
+    """
+    result = {}
+    for part in payload.split(","):
+        i = 0
+        while not (part[i].isdigit() or part[i] == "-"):
+            i += 1
+        result[part[:i]] = int(part[i:])
+    return result
+
+
+def run(label, parse, payload, number):
+    seconds = min(timeit.repeat(lambda: parse(payload), number=number, repeat=5))
+    per_call_us = seconds / number * 1e6
+    print(f"{label:<14}{payload:<42}{per_call_us:8.2f} us")
+    return per_call_us
+
+
+if __name__ == "__main__":
+
+    NUMBER = 100000
+
+    for payload, fields in STREAMS:
+        parser = FieldParser(fields)
+        record_parser = FieldParser(fields, record=True)
+
+        naive = run("naive", naive_parse, payload, NUMBER)
+        compiled = run("FieldParser", parser.parse, payload, NUMBER)
+        record = run("record", record_parser.parse, payload, NUMBER)
+        print(f"{'speedup':<14}{'':<42}{naive / compiled:8.2f} x  (record {naive / record:.2f} x)\n")
@@ -0,0 +1,374 @@
+# Decode logic analyser captures of the link offline.
+#
+# Loads the clock, data and CS lines from a sigrok CSV, sigrok binary, sigrok
+# session (.sr) or VCD capture into NumPy arrays, finds the rising clock edges
+# and CS windows with array operations and decodes every frame with the same
+# length, data and checksum rules as process_buffer in the libraries. Frames
+# are written out as a table with their status and timing, followed by a
+# summary. Captures of millions of edges decode in seconds.
+#
+# Run from the Raspberry_Pi_Code folder, naming the channels as they appear in
+# the capture (bit numbers for sigrok binary files):
+#   python -m tools.decode_capture soak.csv --clock D0 --data D1 --cs D2
+#   python -m tools.decode_capture soak.bin --clock 0 --data 1 --cs 2 --samplerate 1MHz
+#   python -m tools.decode_capture trace.vcd --clock clock --data data --cs cs --out frames.csv
+import argparse
+import configparser
+import csv
+import sys
+import zipfile
+
+import numpy as np
+
+STATUS_OK = "ok"
+STATUS_CHECKSUM = "checksum"  # Checksum mismatch, the receiver answers ERROR
+STATUS_SHORT = "short"  # Fewer than 16 bits, ignored by the receiver
+STATUS_TRUNCATED = "truncated"  # Fewer bits than the length byte promised
+
+FRAME_COLUMNS = (
+    "frame", "start_s", "duration_us", "bits", "length", "status", "checksum",
+    "calculated", "bit_period_us", "min_period_us", "max_period_us", "payload",
+)
+
+UNITS = {"": 1, "k": 1e3, "m": 1e6, "g": 1e9}
+TIMESCALES = {"s": 1, "ms": 1e-3, "us": 1e-6, "ns": 1e-9, "ps": 1e-12, "fs": 1e-15}
+
+
+def parse_samplerate(text):
+    """
+    Parse a sample rate such as "1 MHz", "500kHz" or "2000000" into Hz.
+    """
+    text = text.strip().lower().replace(" ", "")
+    if text.endswith("hz"):
+        text = text[:-2]
+    scale = UNITS.get(text[-1:], None)
+    if scale is not None and text[-1:].isalpha():
+        return float(text[:-1]) * scale
+    return float(text)
+
+
+def samples_to_changes(samples, samplerate):
+    """
+    Turn one channel of uniform samples into (times, values) at each change,
+    starting with the value of the first sample.
+    """
+    samples = np.asarray(samples, dtype=np.uint8)
+    changes = np.concatenate(([0], np.flatnonzero(np.diff(samples)) + 1))
+    return changes / samplerate, samples[changes]
+
+
+def load_sigrok_csv(path, names, samplerate=None):
+    """
+    Load channels from sigrok CSV output. Comment lines give the sample rate
+    when it is not passed in, a "Time" column is used when present.
+    """
+    header = None
+    comments = []
+    with open(path) as capture:
+        for line in capture:
+            if line.startswith(";"):
+                comments.append(line)
+                continue
+            header = [column.strip() for column in line.split(",")]
+            break
+        table = np.loadtxt(capture, delimiter=",", ndmin=2)
+
+    if samplerate is None:
+        for comment in comments:
+            if "samplerate" in comment.lower():
+                samplerate = parse_samplerate(comment.split(":", 1)[1])
+    time_column = next((i for i, column in enumerate(header) if column.lower().startswith("time")), None)
+    if samplerate is None and time_column is None:
+        raise SystemExit("No sample rate in the capture, pass --samplerate")
+
+    channels = {}
+    for name in names:
+        samples = table[:, header.index(name)].astype(np.uint8)
+        if time_column is None:
+            channels[name] = samples_to_changes(samples, samplerate)
+        else:
+            changes = np.concatenate(([0], np.flatnonzero(np.diff(samples)) + 1))
+            channels[name] = table[changes, time_column], samples[changes]
+    return channels
+
+
+def unpack_logic(raw, unitsize, names, samplerate):
+    """
+    Split packed sigrok logic samples (bit n = channel n) into channels.
+    """
+    dtype = {1: np.uint8, 2: np.dtype("<u2"), 4: np.dtype("<u4")}[unitsize]
+    words = np.frombuffer(raw, dtype=dtype)
+    return {name: samples_to_changes((words >> bit) & 1, samplerate) for name, bit in names.items()}
+
+
+def load_sigrok_binary(path, names, samplerate, unitsize=1):
+    """
+    Load channels, named by bit number, from sigrok binary output.
+    """
+    if samplerate is None:
+        raise SystemExit("Binary captures need --samplerate")
+    with open(path, "rb") as capture:
+        raw = capture.read()
+    return unpack_logic(raw, unitsize, {name: int(name) for name in names}, samplerate)
+
+
+def load_sigrok_session(path, names, samplerate=None):
+    """
+    Load channels, named as in the session, from a sigrok .sr session file.
+    """
+    with zipfile.ZipFile(path) as session:
+        metadata = configparser.ConfigParser()
+        metadata.read_string(session.read("metadata").decode("utf-8"))
+        device = metadata["device 1"]
+        unitsize = int(device.get("unitsize", "1"))
+        if samplerate is None:
+            samplerate = parse_samplerate(device["samplerate"])
+
+        probes = {device[key]: int(key[5:]) - 1 for key in device if key.startswith("probe")}
+        chunks = sorted((name for name in session.namelist() if name.startswith("logic-1")),
+                        key=lambda name: int(name.rsplit("-", 1)[1]))
+        raw = b"".join(session.read(name) for name in chunks)
+
+    return unpack_logic(raw, unitsize, {name: probes[name] for name in names}, samplerate)
+
+
+def load_vcd(path, names):
+    """
+    Load scalar signals from a VCD file, as written by EdgeTracer.write_vcd.
+    """
+    codes = {}
+    timescale = 1.0
+    definitions = []
+    now = 0
+
+    with open(path) as capture:
+        for line in capture:
+            definitions.append(line)
+            if "$enddefinitions" in line:
+                break
+
+        header = " ".join(definitions).split("$end")
+        for declaration in header:
+            words = declaration.split()
+            if not words:
+                continue
+            if words[0] == "$var" and len(words) >= 5 and words[4] in names:
+                codes[words[3]] = words[4]
+            elif words[0] == "$timescale":
+                amount = "".join(words[1:])
+                digits = amount.rstrip("abcdefghijklmnopqrstuvwxyz")
+                timescale = float(digits or 1) * TIMESCALES[amount[len(digits):]]
+
+        missing = set(names) - set(codes.values())
+        if missing:
+            raise SystemExit(f"Signals not found in the VCD: {', '.join(sorted(missing))}")
+        changes = {code: ([], []) for code in codes}
+
+        for line in capture:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == "#":
+                now = int(line[1:])
+            elif line[0] in "01xXzZ":
+                entry = changes.get(line[1:])
+                if entry is not None:
+                    entry[0].append(now)
+                    entry[1].append(1 if line[0] == "1" else 0)
+
+    # Signals are taken as low before their first change, so a first change
+    # to 1 counts as a rising edge
+    return {
+        name: (np.concatenate(([-np.inf], np.asarray(changes[code][0], dtype=np.float64) * timescale)),
+               np.concatenate(([0], np.asarray(changes[code][1], dtype=np.uint8))))
+        for code, name in codes.items()
+    }
+
+
+def rising_edges(times, values):
+    """
+    Times at which a signal goes from 0 to 1.
+    """
+    return times[1:][(values[1:] == 1) & (values[:-1] == 0)]
+
+
+def falling_edges(times, values):
+    """
+    Times at which a signal goes from 1 to 0.
+    """
+    return times[1:][(values[1:] == 0) & (values[:-1] == 1)]
+
+
+def value_at(times, values, at):
+    """
+    The value of a signal at each of the given times.
+    """
+    index = np.searchsorted(times, at, side="right") - 1
+    return np.where(index >= 0, values[np.maximum(index, 0)], 0).astype(np.uint8)
+
+
+def cs_windows(cs_times, cs_values):
+    """
+    The (start, end) times of each frame. Like the receivers, the buffer is
+    cleared on every rising CS edge and processed on the falling edge, so a
+    frame runs from the last rise before each fall.
+    """
+    rises = rising_edges(cs_times, cs_values)
+    falls = falling_edges(cs_times, cs_values)
+
+    last_rise = np.searchsorted(rises, falls, side="left") - 1
+    keep = last_rise >= 0
+    previous_fall = np.concatenate(([-np.inf], falls[:-1]))
+    keep &= rises[np.maximum(last_rise, 0)] > previous_fall
+    return rises[last_rise[keep]], falls[keep]
+
+
+def decode(channels, clock, data, cs):
+    """
+    Decode every frame in the capture. Returns a dict of per frame columns.
+    """
+    clock_edges = rising_edges(*channels[clock])
+    bits = value_at(*channels[data], clock_edges)
+    starts, ends = cs_windows(*channels[cs])
+
+    first = np.searchsorted(clock_edges, starts, side="left")
+    last = np.searchsorted(clock_edges, ends, side="right")
+    bit_counts = last - first
+
+    # The byte starting at every bit position, so a frame's bytes can be read
+    # at any alignment: byte_at[i] = bits[i] .. bits[i + 7], MSB first
+    padded = np.concatenate((bits, np.zeros(8, dtype=np.uint8))).astype(np.int64)
+    byte_at = np.zeros(len(bits) + 1, dtype=np.int64)
+    for k in range(8):
+        byte_at += padded[k:k + len(bits) + 1] << (7 - k)
+
+    frame_count = len(starts)
+    lengths = np.where(bit_counts >= 16, byte_at[np.minimum(first, len(bits))], 0)
+    status = np.full(frame_count, STATUS_OK, dtype=object)
+    status[bit_counts < 8 + lengths * 8 + 8] = STATUS_TRUNCATED
+    status[bit_counts < 16] = STATUS_SHORT
+    complete = status == STATUS_OK
+
+    # Sum the data bytes of every complete frame in one pass
+    data_lengths = np.where(complete, lengths, 0)
+    owners = np.repeat(np.arange(frame_count), data_lengths)
+    group_starts = np.repeat(np.cumsum(data_lengths) - data_lengths, data_lengths)
+    positions = np.repeat(first + 8, data_lengths) + 8 * (np.arange(len(owners)) - group_starts)
+    data_bytes = byte_at[positions]
+    calculated = np.bincount(owners, weights=data_bytes, minlength=frame_count).astype(np.int64) % 256
+
+    checksums = np.where(complete, byte_at[np.minimum(first + 8 + lengths * 8, len(bits))], -1)
+    calculated = np.where(complete, calculated, -1)
+    status[complete & (checksums != calculated)] = STATUS_CHECKSUM
+
+    # Clock period within each frame. Frames never overlap, so the periods of
+    # every frame can be reduced at once from interleaved start/end indices
+    periods = np.append(np.diff(clock_edges), 0.0)
+    timed = (bit_counts >= 2).nonzero()[0]
+    mean_period = np.full(frame_count, np.nan)
+    min_period = np.full(frame_count, np.nan)
+    max_period = np.full(frame_count, np.nan)
+    if len(timed):
+        bounds = np.empty(2 * len(timed), dtype=np.int64)
+        bounds[0::2] = first[timed]
+        bounds[1::2] = last[timed] - 1
+        mean_period[timed] = (clock_edges[last[timed] - 1] - clock_edges[first[timed]]) / (bit_counts[timed] - 1)
+        min_period[timed] = np.minimum.reduceat(periods, bounds)[0::2]
+        max_period[timed] = np.maximum.reduceat(periods, bounds)[0::2]
+
+    data_bytes = data_bytes.astype(np.uint8).tobytes()
+    offsets = np.cumsum(data_lengths) - data_lengths
+    payloads = [
+        format_payload(data_bytes[offset:offset + length]) if ok else ""
+        for offset, length, ok in zip(offsets.tolist(), data_lengths.tolist(), complete.tolist())
+    ]
+
+    return {
+        "frame": np.arange(frame_count),
+        "start_s": starts,
+        "duration_us": (ends - starts) * 1e6,
+        "bits": bit_counts,
+        "length": lengths,
+        "status": status,
+        "checksum": checksums,
+        "calculated": calculated,
+        "bit_period_us": mean_period * 1e6,
+        "min_period_us": min_period * 1e6,
+        "max_period_us": max_period * 1e6,
+        "payload": payloads,
+    }
+
+
+def format_payload(payload):
+    """
+    Show a payload as text when it is printable, otherwise as hex.
+    """
+    if payload and payload[0] >= 0x20:
+        try:
+            text = payload.decode("utf-8")
+            if text.isprintable():
+                return text
+        except UnicodeDecodeError:
+            pass
+    return payload.hex(" ")
+
+
+def write_table(frames, out):
+    """
+    Write the frames as CSV.
+    """
+    writer = csv.writer(out)
+    writer.writerow(FRAME_COLUMNS)
+    for row in zip(*(frames[column] for column in FRAME_COLUMNS)):
+        row = [f"{value:.3f}" if isinstance(value, float) else value for value in row]
+        row[1] = f"{float(row[1]):.6f}"
+        writer.writerow(row)
+
+
+def summary(frames):
+    """
+    Count the frames by status and summarise the bit period.
+    """
+    status = frames["status"]
+    lines = [f"frames: {len(status)}"]
+    for name in (STATUS_OK, STATUS_CHECKSUM, STATUS_TRUNCATED, STATUS_SHORT):
+        lines.append(f"  {name:<10}{int((status == name).sum())}")
+
+    periods = frames["bit_period_us"][~np.isnan(frames["bit_period_us"])]
+    if len(periods):
+        lines.append(f"bit period: mean {periods.mean():.1f} us, min {np.nanmin(frames['min_period_us']):.1f} us, "
+                     f"max {np.nanmax(frames['max_period_us']):.1f} us")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Decode frames from a logic analyser capture.")
+    parser.add_argument("capture", help="sigrok .csv, .bin or .sr file, or a .vcd file")
+    parser.add_argument("--clock", required=True, help="clock channel name (bit number for .bin)")
+    parser.add_argument("--data", required=True, help="data channel name (bit number for .bin)")
+    parser.add_argument("--cs", required=True, help="chip select channel name (bit number for .bin)")
+    parser.add_argument("--samplerate", type=parse_samplerate, help="eg 1MHz, read from the capture when possible")
+    parser.add_argument("--unitsize", type=int, default=1, help="bytes per sample in .bin files")
+    parser.add_argument("--out", help="write the frame table to this CSV file instead of stdout")
+    args = parser.parse_args()
+
+    names = [args.clock, args.data, args.cs]
+    extension = args.capture.rsplit(".", 1)[-1].lower()
+    if extension == "vcd":
+        channels = load_vcd(args.capture, names)
+    elif extension == "sr":
+        channels = load_sigrok_session(args.capture, names, args.samplerate)
+    elif extension == "csv":
+        channels = load_sigrok_csv(args.capture, names, args.samplerate)
+    else:
+        channels = load_sigrok_binary(args.capture, names, args.samplerate, args.unitsize)
+
+    frames = decode(channels, args.clock, args.data, args.cs)
+
+    if args.out:
+        with open(args.out, "w", newline="") as out:
+            write_table(frames, out)
+    else:
+        write_table(frames, sys.stdout)
+    print(summary(frames), file=sys.stderr)
@@ -0,0 +1,73 @@
+# List the frames in a binary frame log written by comm.enable_frame_log.
+#
+# Writes a CSV table of the frames between two times, in seconds from the
+# start of the log, using the log's index to skip straight to the start,
+# followed by a summary of the frames in each direction and status.
+#
+# Run from the Raspberry_Pi_Code folder:
+#   python -m tools.frame_log match.v5log
+#   python -m tools.frame_log match.v5log --from 95 --to 100 --out incident.csv
+import argparse
+import csv
+import sys
+from collections import Counter
+
+from lib.V5_External_Comm_Lib import FRAME_IN, FRAME_STATUS_NAMES, FRAME_STATUS_OK, FrameLogReader
+
+FRAME_COLUMNS = ("time_s", "direction", "status", "length", "payload")
+
+
+def format_payload(payload):
+    """
+    Text payloads as they are, others as hex.
+    """
+    if len(payload) and payload[0] < 0x20:
+        return payload.hex()
+    return payload.decode("utf-8", "replace")
+
+
+def write_table(reader, start_s, end_s, out):
+    """
+    Write the frames from start_s to end_s to a CSV file like object. Returns the count of each (direction, status).
+    """
+    first_ns = reader.first_ns()
+    counts = Counter()
+    if first_ns is None:
+        return counts
+    start_ns = first_ns + int(start_s * 1e9) if start_s is not None else None
+    end_ns = first_ns + int(end_s * 1e9) if end_s is not None else None
+
+    writer = csv.writer(out)
+    writer.writerow(FRAME_COLUMNS)
+    for timestamp_ns, direction, status, frame in reader.records(start_ns, end_ns):
+        counts[direction, status] += 1
+        payload = frame[1:1 + frame[0]] if status == FRAME_STATUS_OK else frame
+        writer.writerow((f"{(timestamp_ns - first_ns) / 1e9:.6f}", "in" if direction == FRAME_IN else "out",
+                         FRAME_STATUS_NAMES[status], len(payload), format_payload(payload)))
+    return counts
+
+
+def summary(counts):
+    lines = []
+    for (direction, status), count in sorted(counts.items()):
+        lines.append(f"{'in' if direction == FRAME_IN else 'out':3} {FRAME_STATUS_NAMES[status]:10} {count}")
+    return "\n".join(lines) or "No frames"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="List the frames in a binary frame log.")
+    parser.add_argument("log", help="file written by comm.enable_frame_log")
+    parser.add_argument("--from", dest="start_s", type=float, help="seconds from the start of the log")
+    parser.add_argument("--to", dest="end_s", type=float, help="seconds from the start of the log")
+    parser.add_argument("--out", help="write the frame table to this CSV file instead of stdout")
+    args = parser.parse_args()
+
+    reader = FrameLogReader(args.log)
+    if args.out:
+        with open(args.out, "w", newline="") as out:
+            counts = write_table(reader, args.start_s, args.end_s, out)
+    else:
+        counts = write_table(reader, args.start_s, args.end_s, sys.stdout)
+    print(summary(counts), file=sys.stderr)
+    reader.close()
@@ -0,0 +1,122 @@
+# Train a preset compression dictionary from a captured message log.
+#
+# The log is a text file with one string message per line, eg the messages
+# written out by an on_message_received callback. The resulting dictionary is
+# written as a Python list to paste into the code on both ends of the link,
+# and passed to V5ExternalComm as `dictionary=PRESET_DICTIONARY`.
+#
+# Run from the Raspberry_Pi_Code folder:
+#   python -m tools.train_dictionary messages.log --out preset_dictionary.py
+import argparse
+import random
+from collections import Counter
+
+from lib.V5_External_Comm_Lib import DictionaryCodec
+
+MIN_ENTRY_LENGTH = 2
+SEPARATOR = b"\x00"  # Stands in for text already covered by a chosen entry
+
+
+def load_messages(path):
+    """
+    Read one message per line, skipping empty lines.
+    """
+    with open(path, "rb") as log:
+        return [line.rstrip(b"\r\n") for line in log if line.strip()]
+
+
+def count_substrings(weighted_messages, max_length):
+    """
+    Count every substring, weighted by how often its message occurs.
+    Text already covered by a chosen entry is split out and not counted.
+    """
+    counts = Counter()
+    for message, weight in weighted_messages.items():
+        for segment in message.split(SEPARATOR):
+            for start in range(len(segment) - 1):
+                for end in range(start + MIN_ENTRY_LENGTH, min(start + max_length, len(segment)) + 1):
+                    counts[segment[start:end]] += weight
+    return counts
+
+
+def train(messages, entries, max_length, min_count):
+    """
+    Greedily pick the substrings that save the most bytes over the messages.
+    An entry replaces len(entry) bytes with a single code byte.
+    """
+    weighted_messages = Counter(messages)
+    dictionary = []
+
+    while len(dictionary) < entries:
+        counts = count_substrings(weighted_messages, max_length)
+        if not counts:
+            break
+
+        entry, count = max(counts.items(), key=lambda item: item[1] * (len(item[0]) - 1))
+        if count < min_count:
+            break
+
+        dictionary.append(entry)
+
+        # Take the entry out of the messages so overlapping substrings are not counted again
+        replaced = Counter()
+        for message, weight in weighted_messages.items():
+            replaced[message.replace(entry, SEPARATOR)] += weight
+        weighted_messages = replaced
+
+    return dictionary
+
+
+def wire_bytes(messages, codec):
+    """
+    Bytes sent for the messages with and without compression, compressing
+    only when it wins, the same as V5ExternalComm.compress_payload.
+    """
+    raw = 0
+    compressed = 0
+    for message in messages:
+        raw += len(message)
+        compressed += min(len(message), len(codec.compress(message)) + 1)
+    return raw, compressed
+
+
+def format_dictionary(dictionary):
+    """
+    Format the dictionary as Python source, using str entries where possible.
+    """
+    lines = ["PRESET_DICTIONARY = ["]
+    for entry in dictionary:
+        try:
+            lines.append(f"    {entry.decode('utf-8')!r},")
+        except UnicodeDecodeError:
+            lines.append(f"    {entry!r},")
+    lines.append("]")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Train a preset dictionary from a message log.")
+    parser.add_argument("log", help="text file with one message per line")
+    parser.add_argument("--out", help="write the dictionary to this file instead of printing it")
+    parser.add_argument("--entries", type=int, default=128, help="maximum entries, at most 128")
+    parser.add_argument("--max-length", type=int, default=16, help="longest entry in bytes")
+    parser.add_argument("--min-count", type=int, default=3, help="ignore substrings seen fewer times")
+    parser.add_argument("--sample", type=int, default=2000, help="train on at most this many messages")
+    args = parser.parse_args()
+
+    messages = load_messages(args.log)
+    sample = messages if len(messages) <= args.sample else random.sample(messages, args.sample)
+
+    dictionary = train(sample, min(args.entries, 128), args.max_length, args.min_count)
+    source = format_dictionary(dictionary)
+
+    if args.out:
+        with open(args.out, "w") as out:
+            out.write(source)
+    else:
+        print(source)
+
+    raw, compressed = wire_bytes(messages, DictionaryCodec(dictionary))
+    print(f"{len(dictionary)} entries, {len(messages)} messages: "
+          f"{raw} bytes -> {compressed} bytes ({compressed / max(raw, 1):.0%})")
@@ -0,0 +1,280 @@
+# Benchmark the libraries against each other over the simulated bus.
+#
+# Every combination of the swept settings is one run: a pair of libraries
+# sends a number of binary messages over a VirtualBus, with bits flipped on
+# the data line at a given rate. Each run reports the bit rate while CS is
+# high, goodput, frames per second and delivery latency in simulated time,
+# and the host CPU time per byte to encode and decode a frame. The runs are
+# written to a JSON file, which a later run can be compared against.
+#
+# Run from the Simulator_Code folder:
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --pairs pi:v5 --bit-delay-us default,200,500 --payload-bytes 4,16,28 --error-rate 0,0.001
+#   python benchmark.py --baseline baseline.json --out new.json
+import argparse
+import json
+import platform
+import time
+from itertools import product
+
+from faults import BitFlip
+from virtual_bus import BusStalled, VirtualBus
+
+CPU_REPEATS = 200  # Frames encoded and decoded to time the CPU cost
+MESSAGE_DEADLINE_US = 60000000  # A message not delivered in this simulated time ends the run
+
+# The link has one data lane and an 8 bit sum checksum, recorded with each run
+# so runs stay comparable if other modes are added
+LANES = 1
+CHECKSUM = "sum8"
+
+
+def message_body(index, size):
+    """
+    The payload of message index, a 2 byte index and then a pattern that depends on it.
+    """
+    return bytes((index >> 8 & 0xFF, index & 0xFF)) + bytes((index * 7 + i) & 0xFF for i in range(size - 2))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FrameMeter:
+    """
+    Clock rises and time with CS high, for the bit rate on the wire.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.bits = 0
+        self.busy_us = 0
+        self.cs_rose = None
+
+    def __call__(self, line, level):
+        if line.name == "clock" and level and self.cs_rose is not None:
+            self.bits += 1
+        elif line.name == "cs":
+            if level:
+                self.cs_rose = self.bus.now_us
+            elif self.cs_rose is not None:
+                self.busy_us += self.bus.now_us - self.cs_rose
+                self.cs_rose = None
+
+
+def decode_once(comm, frame, bits):
+    """
+    Run a received frame through the receiver's frame processing.
+    """
+    if hasattr(comm, "received_data"):  # Pi, bytes are assembled as the bits arrive
+        comm.received_data[:len(frame)] = frame
+        comm.received_count = len(frame)
+        comm.process_and_display_buffer()
+    else:
+        comm.buffer = bits
+        comm.process_buffer()
+
+
+def cpu_cost(sender, receiver, body):
+    """
+    Host CPU nanoseconds per payload byte to encode a frame on the sender and
+    to check and dispatch it on the receiver. Capturing the bits in the pin
+    handlers is not included.
+    """
+    payload = bytes((sender.library_frame_bytes,)) + body
+    checksum = sender.calculate_checksum(payload)
+    bits = sender.encode_payload(len(payload), payload, checksum)
+    frame = bytes((len(payload),)) + payload + bytes((checksum,))
+
+    started = time.perf_counter_ns()
+    for _ in range(CPU_REPEATS):
+        sender.encode_payload(len(payload), payload, sender.calculate_checksum(payload))
+    encode_ns = (time.perf_counter_ns() - started) / CPU_REPEATS
+
+    callback, receiver.on_bytes_received = receiver.on_bytes_received, lambda message: None
+    try:
+        started = time.perf_counter_ns()
+        for _ in range(CPU_REPEATS):
+            decode_once(receiver, frame, bits)
+        decode_ns = (time.perf_counter_ns() - started) / CPU_REPEATS
+    finally:
+        receiver.on_bytes_received = callback
+
+    return encode_ns / len(body), decode_ns / len(body)
+
+
+def run(sender_platform, receiver_platform, bit_delay_us, payload_bytes, error_rate, messages, seed):
+    """
+    One benchmark run, returns its results as a dict.
+    """
+    bus = VirtualBus(seed=seed)
+    sender_side = bus.attach("sender", sender_platform)
+    receiver_side = bus.attach("receiver", receiver_platform)
+
+    sent_at = {}
+    delivered = {}
+    corrupted = [0]
+    unexpected = [0]
+
+    def on_bytes(message):
+        data = bytes(message.data)
+        if len(data) != payload_bytes:
+            unexpected[0] += 1  # Not one of the messages, eg a resend of something else
+            return
+        index = data[0] << 8 | data[1]
+        if index in sent_at and data == message_body(index, payload_bytes):
+            delivered.setdefault(index, bus.now_us - sent_at[index])
+        else:
+            corrupted[0] += 1
+
+    # Rejected frames are counted in the results, not logged
+    sender = sender_side.create_comm(log_level=sender_side.load_library().LOG_ERROR)
+    receiver = receiver_side.create_comm(on_bytes_received=on_bytes, log_level=receiver_side.load_library().LOG_ERROR)
+    sender.library_frame_bytes = sender_side.library.FRAME_BYTES
+    if bit_delay_us is not None:
+        sender.BIT_DELAY_US = bit_delay_us
+        receiver.BIT_DELAY_US = bit_delay_us  # For ERROR replies
+
+    # A corrupted frame kind can reach a handler that does not expect it,
+    # count it with the other corrupted frames
+    dispatch_payload = receiver.dispatch_payload
+
+    def guarded_dispatch(payload):
+        try:
+            dispatch_payload(payload)
+        except Exception:
+            corrupted[0] += 1
+
+    receiver.dispatch_payload = guarded_dispatch
+
+    meter = FrameMeter(bus)
+    flipper = BitFlip(bus, error_rate)
+    bus.taps.extend((meter, flipper))
+
+    stalled = False
+    started_us = bus.now_us
+    for index in range(messages):
+        sent_at[index] = bus.now_us
+        bus.deadline_us = bus.now_us + MESSAGE_DEADLINE_US
+        try:
+            sender.send_bytes(message_body(index, payload_bytes))
+            bus.settle()
+        except BusStalled:
+            stalled = True
+            break
+    bus.deadline_us = None
+    elapsed_s = (bus.now_us - started_us) / 1000000
+    bus.taps.clear()
+
+    latencies_ms = [latency / 1000 for latency in delivered.values()]
+    stats = receiver.snapshot_stats()
+    sender_stats = sender.snapshot_stats()
+    encode_ns, decode_ns = cpu_cost(sender, receiver, message_body(0, payload_bytes))
+
+    return {
+        "sender": sender_platform,
+        "receiver": receiver_platform,
+        "bit_delay_us": sender.BIT_DELAY_US,
+        "payload_bytes": payload_bytes,
+        "lanes": LANES,
+        "checksum": CHECKSUM,
+        "error_rate": error_rate,
+        "messages": messages,
+        "delivered": len(delivered),
+        "corrupted": corrupted[0],
+        "unexpected": unexpected[0],
+        "stalled": stalled,
+        "bits_flipped": len(flipper.times),
+        "checksum_failures": stats["checksum_failures"],
+        "truncated_frames": stats["truncated_frames"],
+        "error_resends": sender_stats["error_resends"],
+        "simulated_s": elapsed_s,
+        "bit_rate_bps": meter.bits / (meter.busy_us / 1000000) if meter.busy_us else 0,
+        "goodput_Bps": len(delivered) * payload_bytes / elapsed_s if elapsed_s else 0,
+        "frames_per_s": len(delivered) / elapsed_s if elapsed_s else 0,
+        "latency_p50_ms": percentile(latencies_ms, 0.5),
+        "latency_p99_ms": percentile(latencies_ms, 0.99),
+        "encode_ns_per_byte": encode_ns,
+        "decode_ns_per_byte": decode_ns,
+    }
+
+
+def run_key(result):
+    return (result["sender"], result["receiver"], result["bit_delay_us"], result["payload_bytes"],
+            result["lanes"], result["checksum"], result["error_rate"])
+
+
+def compare(results, baseline):
+    """
+    Print the change in goodput and p99 latency from the matching baseline runs.
+    """
+    previous = {run_key(result): result for result in baseline["runs"]}
+    print("\nAgainst the baseline:")
+    for result in results:
+        old = previous.get(run_key(result))
+        if old is None:
+            continue
+        goodput_change = (result["goodput_Bps"] / old["goodput_Bps"] - 1) if old["goodput_Bps"] else float("nan")
+        p99 = result["latency_p99_ms"]
+        old_p99 = old["latency_p99_ms"]
+        p99_change = f"{p99 - old_p99:+.1f} ms" if p99 is not None and old_p99 is not None else "n/a"
+        print(f"  {format_key(result):44} goodput {goodput_change:+7.1%}  p99 {p99_change}")
+
+
+def format_key(result):
+    return (f"{result['sender']}->{result['receiver']} delay {result['bit_delay_us']}us "
+            f"{result['payload_bytes']}B err {result['error_rate']}")
+
+
+def number_list(text, cast):
+    """
+    Parse a comma separated list, "default" stands for the library's own value.
+    """
+    return [None if item == "default" else cast(item) for item in text.split(",")]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the libraries over the simulated bus.")
+    parser.add_argument("--pairs", default="pi:v5,v5:pi,pi:pico,pico:pi,pico:v5,v5:pico",
+                        help="sender:receiver pairs, comma separated")
+    parser.add_argument("--bit-delay-us", default="default",
+                        help="BIT_DELAY_US values, 'default' keeps the library's")
+    parser.add_argument("--payload-bytes", default="4,16,28", help="message sizes, at least 2")
+    parser.add_argument("--error-rate", default="0,0.001,0.01", help="fraction of bits flipped")
+    parser.add_argument("--messages", type=int, default=20, help="messages per run")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the jitter and the bit flips")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    pairs = [pair.split(":") for pair in args.pairs.split(",")]
+    sweep = product(pairs, number_list(args.bit_delay_us, int), number_list(args.payload_bytes, int),
+                    number_list(args.error_rate, float))
+
+    results = []
+    for (sender, receiver), bit_delay_us, payload_bytes, error_rate in sweep:
+        result = run(sender, receiver, bit_delay_us, payload_bytes, error_rate, args.messages, args.seed)
+        results.append(result)
+        p50 = result["latency_p50_ms"]
+        print(f"{format_key(result):44} {result['delivered']:3}/{result['messages']} "
+              f"{result['bit_rate_bps']:8.0f} bit/s {result['goodput_Bps']:8.1f} B/s "
+              f"{result['frames_per_s']:6.2f} fps  p50 {p50 if p50 is not None else float('nan'):8.1f} ms  "
+              f"enc {result['encode_ns_per_byte']:6.0f} dec {result['decode_ns_per_byte']:6.0f} ns/B"
+              f"{'  STALLED' if result['stalled'] else ''}")
+
+    with open(args.out, "w") as out:
+        json.dump({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "runs": results,
+        }, out, indent=2)
+    print(f"\n{len(results)} runs written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare(results, json.load(baseline_file))
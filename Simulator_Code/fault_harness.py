@@ -0,0 +1,229 @@
+# Measure how the libraries recover from faults on the link.
+#
+# Each trial sends messages from one library to another over the simulated
+# bus with one kind of fault from faults.py injected at a rate per bit, using
+# one of the integrity and retransmit strategies the libraries offer:
+#   resend  send_bytes, a checksum failure is answered with ERROR and the
+#           sender resends its last message
+#   delta   send_delta samples, a lost frame is noticed by its sequence
+#           number and the stream picks up again at the next keyframe
+#   rpc     call with an echo handler, the reply is the acknowledgement and a
+#           call without one is made again, up to --retries times
+#
+# For each trial it reports goodput, how many messages got through intact,
+# were lost or were delivered corrupted (passed the checksum but wrong),
+# frames that were none of the messages, and the recovery time: from a fault
+# to the next message delivered intact.
+#
+# Run from the Simulator_Code folder:
+#   python fault_harness.py --out faults.json
+#   python fault_harness.py --pairs pi:v5 --faults bit_flip,cs_glitch --rate 0.005 --strategies resend,rpc
+import argparse
+import json
+import time
+from itertools import product
+
+from benchmark import message_body, percentile
+from faults import FAULTS
+from virtual_bus import BusStalled, VirtualBus
+
+STRATEGIES = ("resend", "delta", "rpc")
+DELTA_CHANNEL = 1
+MESSAGE_DEADLINE_US = 60000000  # A message not finished in this simulated time ends the trial
+
+
+def delta_sample(index):
+    return [index, index * 3, 1000 - index]
+
+
+def echo_text(index, size):
+    return "".join(chr(97 + (index + i) % 26) for i in range(size))
+
+
+class Trial:
+    """
+    One strategy sending messages between two libraries with one fault injected.
+    """
+
+    def __init__(self, sender_platform, receiver_platform, fault_name, rate, strategy,
+                 payload_bytes, retries, seed):
+        self.strategy = strategy
+        self.payload_bytes = payload_bytes
+        self.retries = retries
+
+        self.bus = bus = VirtualBus(seed=seed)
+        sender_side = bus.attach("sender", sender_platform)
+        receiver_side = bus.attach("receiver", receiver_platform)
+
+        # Rejected frames are counted in the results, not logged
+        self.sender = sender_side.create_comm(log_level=sender_side.load_library().LOG_ERROR)
+        self.receiver = receiver_side.create_comm(on_bytes_received=self.on_bytes,
+                                                  log_level=receiver_side.load_library().LOG_ERROR)
+        self.sender.register_delta_channel(DELTA_CHANNEL, 3)
+        self.receiver.register_delta_channel(DELTA_CHANNEL, 3, callback=self.on_sample)
+        self.receiver.register_handler("echo", lambda *args: args)
+
+        for comm in (self.sender, self.receiver):
+            self.guard(comm)
+        handle_response = self.sender.handle_response
+
+        def timed_response(payload):
+            self.response_us = bus.now_us
+            handle_response(payload)
+
+        self.sender.handle_response = timed_response
+
+        self.fault = FAULTS[fault_name](bus, rate)
+        bus.taps.append(self.fault)
+
+        self.delivered = {}  # Message index -> time it arrived intact
+        self.corrupted = 0
+        self.unexpected = 0  # Frames that are not one of the messages, eg a resend of something else
+        self.retried = 0
+        self.response_us = 0
+        self.recoveries_us = []
+        self.faults_seen = 0  # Faults already matched to a recovery
+
+    def guard(self, comm):
+        """
+        A corrupted frame that passes the checksum can reach a handler that
+        does not expect it, count it as corrupted rather than stopping.
+        """
+        dispatch_payload = comm.dispatch_payload
+
+        def guarded_dispatch(payload):
+            try:
+                dispatch_payload(payload)
+            except Exception:
+                self.corrupted += 1
+
+        comm.dispatch_payload = guarded_dispatch
+
+    def arrived(self, index, intact, at_us):
+        if not intact:
+            self.corrupted += 1
+            return
+        self.delivered.setdefault(index, at_us)
+        times = self.fault.times
+        if len(times) > self.faults_seen:
+            self.recoveries_us.append(at_us - times[self.faults_seen])
+            self.faults_seen = len(times)
+
+    def on_bytes(self, message):
+        data = bytes(message.data)
+        if self.strategy != "resend" or len(data) != self.payload_bytes:
+            self.unexpected += 1
+            return
+        index = data[0] << 8 | data[1]
+        self.arrived(index, data == message_body(index, self.payload_bytes), self.bus.now_us)
+
+    def on_sample(self, values):
+        self.arrived(values[0], values == delta_sample(values[0]), self.bus.now_us)
+
+    def send(self, index):
+        """
+        Send one message with the trial's strategy and wait for the link to go quiet.
+        """
+        if self.strategy == "resend":
+            self.sender.send_bytes(message_body(index, self.payload_bytes))
+            self.bus.settle()
+        elif self.strategy == "delta":
+            self.sender.send_delta(DELTA_CHANNEL, delta_sample(index))
+            self.bus.settle()
+        else:
+            expected = (index, echo_text(index, self.payload_bytes))
+            for attempt in range(self.retries + 1):
+                self.retried += attempt > 0
+                future = self.sender.call("echo", expected)
+                self.bus.settle()
+                if future.done:
+                    self.arrived(index, future.error is None and future.value == expected, self.response_us)
+                    return
+                self.sender.expire_call(future)
+
+    def run(self, messages):
+        bus = self.bus
+        stalled = False
+        started_us = bus.now_us
+        for index in range(messages):
+            bus.deadline_us = bus.now_us + MESSAGE_DEADLINE_US
+            try:
+                self.send(index)
+            except BusStalled:
+                stalled = True
+                break
+        bus.deadline_us = None
+        elapsed_s = (bus.now_us - started_us) / 1000000
+        bus.taps.clear()
+
+        intact = len(self.delivered)
+        recoveries_ms = [recovery / 1000 for recovery in self.recoveries_us]
+        stats = self.receiver.snapshot_stats()
+        sender_stats = self.sender.snapshot_stats()
+        return {
+            "sender": self.sender_platform(),
+            "receiver": self.receiver_platform(),
+            "fault": self.fault.name,
+            "rate": self.fault.rate,
+            "strategy": self.strategy,
+            "messages": messages,
+            "faults": len(self.fault.times),
+            "intact": intact,
+            "lost": messages - intact,
+            "corrupted": self.corrupted,
+            "unexpected": self.unexpected,
+            "undetected_corruption_rate": self.corrupted / (intact + self.corrupted) if intact + self.corrupted else 0,
+            "stalled": stalled,
+            "simulated_s": elapsed_s,
+            "goodput_per_s": intact / elapsed_s if elapsed_s else 0,
+            "goodput_Bps": intact * self.payload_bytes / elapsed_s if elapsed_s and self.strategy != "delta" else None,
+            "recovery_p50_ms": percentile(recoveries_ms, 0.5),
+            "recovery_p99_ms": percentile(recoveries_ms, 0.99),
+            "recovery_max_ms": max(recoveries_ms) if recoveries_ms else None,
+            "unrecovered": len(self.fault.times) > self.faults_seen,
+            "checksum_failures": stats["checksum_failures"],
+            "truncated_frames": stats["truncated_frames"],
+            "error_resends": sender_stats["error_resends"],
+            "rpc_retries": self.retried,
+        }
+
+    def sender_platform(self):
+        return self.bus.sides[0].platform
+
+    def receiver_platform(self):
+        return self.bus.sides[1].platform
+
+
+def format_ms(value):
+    return f"{value:8.1f}" if value is not None else "       -"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Measure recovery from faults on the simulated bus.")
+    parser.add_argument("--pairs", default="pi:v5,v5:pi,pi:pico,pico:pi", help="sender:receiver pairs, comma separated")
+    parser.add_argument("--faults", default=",".join(FAULTS), help="faults to inject, comma separated")
+    parser.add_argument("--rate", type=float, default=0.002, help="fraction of bits a fault strikes")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="strategies, comma separated")
+    parser.add_argument("--messages", type=int, default=30, help="messages per trial")
+    parser.add_argument("--payload-bytes", type=int, default=12, help="message size for resend and rpc, at least 2")
+    parser.add_argument("--retries", type=int, default=2, help="times an unanswered rpc call is made again")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the jitter and the faults")
+    parser.add_argument("--out", default="faults.json", help="JSON file for the results")
+    args = parser.parse_args()
+
+    pairs = [pair.split(":") for pair in args.pairs.split(",")]
+    results = []
+    print(f"{'trial':44} {'intact':>6} {'lost':>4} {'bad':>4} {'odd':>4} {'msg/s':>6} {'rec p50':>8} {'rec p99':>8} ms")
+    for (sender, receiver), fault, strategy in product(pairs, args.faults.split(","), args.strategies.split(",")):
+        trial = Trial(sender, receiver, fault, args.rate, strategy, args.payload_bytes, args.retries, args.seed)
+        result = trial.run(args.messages)
+        results.append(result)
+        print(f"{sender + '->' + receiver + ' ' + fault + ' ' + strategy:44} {result['intact']:6} {result['lost']:4} "
+              f"{result['corrupted']:4} {result['unexpected']:4} {result['goodput_per_s']:6.2f} {format_ms(result['recovery_p50_ms'])} "
+              f"{format_ms(result['recovery_p99_ms'])}{'  STALLED' if result['stalled'] else ''}")
+
+    with open(args.out, "w") as out:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": args.seed, "rate": args.rate,
+                   "runs": results}, out, indent=2)
+    print(f"\n{len(results)} trials written to {args.out}")
@@ -0,0 +1,124 @@
+# Faults injected into a VirtualBus, as taps on its edges.
+#
+# Each fault hits a random fraction of the clock's rising edges, so the rate
+# is per bit sent, and keeps the times it struck in `times`:
+#   bit_flip      the data line is inverted while the clock is high
+#   clock_drop    the rising and falling edge never reach the receiver
+#   clock_double  the rising edge reaches the receiver twice, like a bounce
+#   cs_glitch     CS drops low for a moment in the middle of a frame
+#   stuck         a random line is held at its level for a while
+#
+#   flip = BitFlip(bus, 0.001)
+#   bus.taps.append(flip)
+
+DOUBLE_GAP_US = 2  # Time between a rising edge and its bounce
+GLITCH_US = 200  # Time CS is held low by a glitch
+STUCK_US = 5000  # Time a stuck line is held
+
+
+class Fault:
+    """
+    A fault that strikes a random fraction of the clock's rising edges.
+    """
+
+    name = "none"
+
+    def __init__(self, bus, rate):
+        self.bus = bus
+        self.rate = rate
+        self.times = []  # Simulated times the fault struck, in us
+
+    def __call__(self, line, level):
+        if line.name == "clock" and level and self.rate and self.bus.random.random() < self.rate:
+            self.times.append(self.bus.now_us)
+            return self.strike(line)
+        return self.edge(line, level)
+
+    def strike(self, clock):
+        """
+        Inject the fault at a rising clock edge. Returns True to hide the edge.
+        """
+        return False
+
+    def edge(self, line, level):
+        """
+        Any other edge, returns True to hide it.
+        """
+        return False
+
+
+class BitFlip(Fault):
+
+    name = "bit_flip"
+
+    def strike(self, clock):
+        data = self.bus.lines["data"]
+        if data.forced is None:
+            data.force(1 - data.level)
+        return False
+
+    def edge(self, line, level):
+        data = self.bus.lines["data"]
+        if line.name == "clock" and not level and data.forced is not None:
+            data.force(None)
+        return False
+
+
+class ClockDrop(Fault):
+
+    name = "clock_drop"
+
+    def __init__(self, bus, rate):
+        super().__init__(bus, rate)
+        self.dropping = False
+
+    def strike(self, clock):
+        self.dropping = True
+        return True
+
+    def edge(self, line, level):
+        if line.name == "clock" and not level and self.dropping:
+            self.dropping = False
+            return True
+        return False
+
+
+class ClockDouble(Fault):
+
+    name = "clock_double"
+
+    def strike(self, clock):
+        def bounce():
+            for side in self.bus.sides:
+                side.edge(clock, 1)
+
+        self.bus.schedule(self.bus.now_us + DOUBLE_GAP_US, bounce)
+        return False
+
+
+class CsGlitch(Fault):
+
+    name = "cs_glitch"
+
+    def strike(self, clock):
+        cs = self.bus.lines["cs"]
+        if cs.forced is None:
+            cs.force(0)
+            self.bus.schedule(self.bus.now_us + GLITCH_US, lambda: cs.force(None))
+        return False
+
+
+class StuckLine(Fault):
+
+    name = "stuck"
+
+    def strike(self, clock):
+        line = self.bus.lines[self.bus.random.choice(sorted(self.bus.lines))]
+        if line.forced is None:
+            line.force(line.level)
+            self.bus.schedule(self.bus.now_us + STUCK_US, lambda: line.force(None))
+        return False
+
+
+FAULTS = {fault.name: fault for fault in (BitFlip, ClockDrop, ClockDouble, CsGlitch, StuckLine)}
+
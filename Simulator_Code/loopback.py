@@ -0,0 +1,56 @@
+# Send messages between two libraries over the simulated bus.
+#
+# Run from the Simulator_Code folder, naming the sending and receiving
+# platforms, "pi", "pico" or "v5":
+#   python loopback.py pi v5 --messages 10
+#   python loopback.py v5 pico --latency-us 150 --jitter-us 100
+import argparse
+
+from virtual_bus import PROFILES, SideProfile, VirtualBus
+
+
+def receiving_side_profile(args):
+    """
+    The receiver's platform profile, with any timing given on the command line.
+    """
+    profile = PROFILES[args.receiver]
+    return SideProfile(
+        profile.name,
+        latency_us=profile.latency_us if args.latency_us is None else args.latency_us,
+        jitter_us=profile.jitter_us if args.jitter_us is None else args.jitter_us,
+        granularity_us=profile.granularity_us if args.granularity_us is None else args.granularity_us,
+        pin_cost_us=profile.pin_cost_us,
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Send messages between two libraries over a simulated bus.")
+    parser.add_argument("sender", choices=sorted(PROFILES))
+    parser.add_argument("receiver", choices=sorted(PROFILES))
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1, help="seed for the jitter")
+    parser.add_argument("--latency-us", type=float, help="receiver interrupt latency")
+    parser.add_argument("--jitter-us", type=float, help="receiver jitter")
+    parser.add_argument("--granularity-us", type=float, help="receiver sleep and timer resolution")
+    args = parser.parse_args()
+
+    bus = VirtualBus(seed=args.seed)
+    sender_side = bus.attach("sender", args.sender)
+    receiver_side = bus.attach("receiver", args.receiver, receiving_side_profile(args))
+
+    received = []
+    sender = sender_side.create_comm()
+    receiver = receiver_side.create_comm(
+        on_message_received=lambda data: received.append((bus.now_us, data)))
+
+    for count in range(args.messages):
+        sender.send_data(f"Hello {count}")
+        bus.settle()
+
+    for at_us, data in received:
+        print(f"{at_us / 1000:10.3f} ms  {data}")
+
+    stats = receiver.snapshot_stats()
+    print(f"\n{len(received)}/{args.messages} received in {bus.now_us / 1000:.1f} ms simulated, "
+          f"{stats['checksum_failures']} checksum failures, {stats['truncated_frames']} truncated frames")
@@ -0,0 +1,119 @@
+# Run brain code on a PC against the emulated vex module in shims/vex.py.
+#
+# The script runs as it would on the brain, on a simulated clock with the
+# brain's interrupt latency and 5 ms timer, until --seconds of simulated time
+# have passed. Ports a, b and c are wired to the clock, data and cs lines of
+# a VirtualBus, where the other end can be a Pi or Pico library, or a square
+# wave on port a.
+#
+# Run from the Simulator_Code folder:
+#   python run_brain.py ../V5_Brain_Code/main.py --peer pi --seconds 10
+#   python run_brain.py ../V5_Brain_Code/XX_PWM_investigation.py --pulse-ms 200 --profile brain_pwm_trial
+import argparse
+import sys
+from pathlib import Path
+
+from virtual_bus import NAMED_PROFILES, BusStalled, VirtualBus, load_profile
+
+PEER_SEND_INTERVAL_S = 5
+
+
+def start_peer(bus, platform):
+    """
+    The other end of the link, sending a message every PEER_SEND_INTERVAL_S
+    and printing what it receives.
+    """
+    side = bus.attach("peer", platform)
+    comm = side.create_comm(
+        on_message_received=lambda data: print(f"{bus.now_us / 1000:10.1f} ms  {platform} received: {data}"))
+
+    def send_loop():
+        count = 0
+        while True:
+            comm.send_data(f"RPI_OUT {count}")
+            count += 1
+            side.time.sleep(PEER_SEND_INTERVAL_S)
+
+    side.start_task(send_loop)
+    return comm
+
+
+def start_pulses(bus, line, period_us):
+    """
+    Drive a line high and low in turn, each for period_us.
+    """
+    def toggle(level):
+        line.drive("pulse", level)
+        bus.schedule(bus.now_us + period_us, lambda: toggle(1 - level), background=True)
+
+    bus.schedule(bus.now_us + period_us, lambda: toggle(1), background=True)
+
+
+def run_script(path, side):
+    """
+    Run a brain script as __main__ with the emulated vex and time modules.
+    Returns the script's globals, also when it stops at the deadline.
+    """
+    shims = side.shim_modules()
+    modules = {"vex": shims["vex"], "time": side.time}
+    saved = {name: sys.modules.get(name) for name in modules}
+    script_globals = {"__name__": "__main__", "__file__": str(path)}
+    sys.modules.update(modules)
+    try:
+        exec(compile(path.read_text(), str(path), "exec"), script_globals)
+    except BusStalled:
+        pass  # Reached --seconds
+    finally:
+        for name, previous in saved.items():
+            if previous is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = previous
+    return script_globals
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run brain code against an emulated vex module.")
+    parser.add_argument("script", type=Path, help="brain program, eg ../V5_Brain_Code/main.py")
+    parser.add_argument("--seconds", type=float, default=10, help="simulated time to run for")
+    parser.add_argument("--profile", default="brain",
+                        help=f"brain timing, one of {', '.join(sorted(NAMED_PROFILES))} or a .json file")
+    parser.add_argument("--peer", choices=["pi", "pico"], help="run a library on the other end of the link")
+    parser.add_argument("--pulse-ms", type=float, help="drive port a high and low for this long each")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the jitter")
+    parser.add_argument("--screen", action="store_true", help="print the screen rows as they change")
+    args = parser.parse_args()
+
+    bus = VirtualBus(seed=args.seed)
+    brain_side = bus.attach("brain", "v5", load_profile(args.profile))
+    brain_side.wire(**brain_side.default_pins()[1])
+
+    vex = brain_side.shim_modules()["vex"]
+    screens = []
+    brain_class = vex.Brain
+
+    class EchoBrain(brain_class):
+        def __init__(self):
+            super().__init__()
+            self.screen.echo = args.screen
+            screens.append(self.screen)
+
+    vex.Brain = EchoBrain
+
+    peer = start_peer(bus, args.peer) if args.peer else None
+    if args.pulse_ms:
+        start_pulses(bus, bus.lines["clock"], args.pulse_ms * 1000)
+
+    bus.deadline_us = bus.now_us + args.seconds * 1000000
+    script_globals = run_script(args.script, brain_side)
+
+    print(f"\n{bus.now_us / 1000000:.3f} s simulated, {brain_side.dispatched} interrupts handled on {brain_side.profile}")
+    for screen in screens:
+        if screen.text():
+            print("\nScreen:\n" + screen.text())
+    for name, value in script_globals.items():
+        if type(value).__name__ == "V5ExternalComm":
+            print(f"\n{name}: {value.snapshot_stats()}")
+    if peer is not None:
+        print(f"\npeer: {peer.snapshot_stats()}")
@@ -0,0 +1,51 @@
+# Stand-in for RPi.GPIO on one side of a VirtualBus, loaded by virtual_bus.py
+# with `side` set to the Side the library runs on.
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+    side.setup(channel, direction == OUT, initial)
+
+
+def output(channel, value):
+    side.write(channel, value)
+
+
+def input(channel):
+    return side.read(channel)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    if side.watching(channel):
+        raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+    if edge in (RISING, BOTH):
+        side.watch(channel, 1, lambda: callback(channel))
+    if edge in (FALLING, BOTH):
+        side.watch(channel, 0, lambda: callback(channel))
+
+
+def remove_event_detect(channel):
+    side.unwatch(channel)
+
+
+def cleanup(channel=None):
+    side.reset()
@@ -0,0 +1,44 @@
+# Stand-in for MicroPython's machine module on one side of a VirtualBus,
+# loaded by virtual_bus.py with `side` set to the Side the library runs on.
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        if mode != -1:
+            side.setup(id, mode == Pin.OUT, value or 0)
+
+    def value(self, level=None):
+        if level is None:
+            return side.read(self.id)
+        side.write(self.id, level)
+
+    def __call__(self, level=None):
+        return self.value(level)
+
+    def on(self):
+        side.write(self.id, 1)
+
+    def off(self):
+        side.write(self.id, 0)
+
+    high = on
+    low = off
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        # Like MicroPython, a pin has one irq and each call replaces it
+        side.unwatch(self.id)
+        if handler is None:
+            return
+        if trigger & Pin.IRQ_RISING:
+            side.watch(self.id, 1, lambda: handler(self))
+        if trigger & Pin.IRQ_FALLING:
+            side.watch(self.id, 0, lambda: handler(self))
@@ -0,0 +1,275 @@
+# Emulation of the vex module on one side of a VirtualBus, loaded by
+# virtual_bus.py with `side` set to the Side the code runs on.
+#
+# Covers the parts of the VEX Python API used in V5_Brain_Code: Brain with its
+# three wire ports, timer, screen and battery, DigitalIn, DigitalOut, AnalogIn,
+# Thread and wait. Timing follows the side's profile: callbacks run after the
+# interrupt latency and jitter, the timer reads to the profile's granularity
+# and sleeps end on its ticks.
+__all__ = [
+    "Brain", "DigitalIn", "DigitalOut", "AnalogIn", "Thread", "wait",
+    "TimeUnits", "AnalogUnits", "PercentUnits", "FontType", "Color",
+    "MSEC", "SECONDS", "PERCENT",
+]
+
+SCREEN_ROWS = 12  # Rows and columns of the brain's screen in the default mono20 font
+SCREEN_COLUMNS = 48
+
+
+class TimeUnits:
+    SECONDS = "sec"
+    SEC = "sec"
+    MSEC = "msec"
+
+
+class AnalogUnits:
+    PCT = "pct"
+    EIGHTBIT = "8bit"
+    TENBIT = "10bit"
+    TWELVEBIT = "12bit"
+    MV = "mv"
+
+
+class PercentUnits:
+    PERCENT = "pct"
+
+
+class FontType:
+    MONO20 = "mono20"
+    MONO30 = "mono30"
+    MONO40 = "mono40"
+    PROP20 = "prop20"
+
+
+class Color:
+    BLACK = "black"
+    WHITE = "white"
+    RED = "red"
+    GREEN = "green"
+    BLUE = "blue"
+
+
+SECONDS = TimeUnits.SECONDS
+MSEC = TimeUnits.MSEC
+PERCENT = PercentUnits.PERCENT
+
+
+def to_us(time, units):
+    return time * 1000000 if units in (SECONDS, TimeUnits.SEC) else time * 1000
+
+
+class Port:
+    """
+    One of the brain's three wire ports, a to h.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "Port(" + self.name + ")"
+
+
+# The same port objects for every Brain, so they can be wired once per side
+PORTS = {name: Port(name) for name in "abcdefgh"}
+
+
+class ThreeWirePort:
+
+    def __init__(self):
+        for name, port in PORTS.items():
+            setattr(self, name, port)
+
+
+class Timer:
+    """
+    The brain's timer. time() reads to the profile's granularity, the 5 ms
+    seen on the brain, system_high_res() to the microsecond.
+    """
+
+    def __init__(self):
+        self.cleared_ms = side.ticks_ms()
+
+    def time(self, units=MSEC):
+        ms = side.ticks_ms() - self.cleared_ms
+        return ms / 1000 if units in (SECONDS, TimeUnits.SEC) else ms
+
+    def value(self):
+        return self.time(SECONDS)
+
+    def clear(self):
+        self.cleared_ms = side.ticks_ms()
+
+    def reset(self):
+        self.clear()
+
+    def system(self):
+        return side.ticks_ms()
+
+    def system_high_res(self):
+        return side.ticks_us()
+
+    def event(self, callback, delay, arg=()):
+        """
+        Call callback(*arg) once after delay ms.
+        """
+        side.bus.schedule(side.bus.now_us + delay * 1000, lambda: callback(*arg))
+
+
+class Screen:
+    """
+    The brain's screen as a grid of text. Drawing calls are accepted and ignored.
+    Set `echo` to print each row as it changes.
+    """
+
+    def __init__(self):
+        self.lines = [""] * SCREEN_ROWS
+        self.cursor_row = 1
+        self.cursor_column = 1
+        self.echo = False
+
+    def print(self, *args, sep=" ", precision=2):
+        text = sep.join(f"{arg:.{precision}f}" if isinstance(arg, float) else str(arg) for arg in args)
+        index = self.cursor_row - 1
+        if 0 <= index < SCREEN_ROWS:
+            start = self.cursor_column - 1
+            line = self.lines[index].ljust(start)
+            self.lines[index] = (line[:start] + text + line[start + len(text):])[:SCREEN_COLUMNS]
+            if self.echo:
+                print(f"[screen {self.cursor_row:2}] {self.lines[index]}")
+        self.cursor_column += len(text)
+
+    def set_cursor(self, row, column):
+        self.cursor_row = row
+        self.cursor_column = column
+
+    def next_row(self):
+        self.cursor_row += 1
+        self.cursor_column = 1
+
+    new_line = next_row
+
+    def row(self):
+        return self.cursor_row
+
+    def column(self):
+        return self.cursor_column
+
+    def clear_screen(self, color=None):
+        self.lines = [""] * SCREEN_ROWS
+        self.set_cursor(1, 1)
+
+    def clear_row(self, row=None, color=None):
+        index = (row if row is not None else self.cursor_row) - 1
+        if 0 <= index < SCREEN_ROWS:
+            self.lines[index] = ""
+
+    def text(self):
+        """
+        The screen contents, one line per row, without trailing empty rows.
+        """
+        return "\n".join(line.rstrip() for line in self.lines).rstrip("\n")
+
+    def ignore(self, *args, **kwargs):
+        pass
+
+    set_font = set_pen_color = set_pen_width = set_fill_color = set_origin = ignore
+    draw_pixel = draw_line = draw_rectangle = draw_circle = draw_image_from_file = render = ignore
+
+
+class Battery:
+
+    def capacity(self, units=PERCENT):
+        return 100
+
+    def voltage(self, units=None):
+        return 12800
+
+    def current(self, units=None):
+        return 1.0
+
+    def temperature(self, units=None):
+        return 25
+
+
+class Brain:
+
+    def __init__(self):
+        self.three_wire_port = ThreeWirePort()
+        self.timer = Timer()
+        self.screen = Screen()
+        self.battery = Battery()
+
+
+class DigitalIn:
+    """
+    Digital input on a three wire port, with callbacks on rising (high) and falling (low) edges.
+    Callbacks are called with `arg` unpacked, no arguments by default.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        side.unwatch(port)  # A new device on the port replaces the old one
+        side.setup(port, False)
+
+    def value(self):
+        return side.read(self.port)
+
+    def high(self, callback, arg=()):
+        side.watch(self.port, 1, lambda: callback(*arg))
+
+    def low(self, callback, arg=()):
+        side.watch(self.port, 0, lambda: callback(*arg))
+
+
+class DigitalOut:
+
+    def __init__(self, port):
+        self.port = port
+        side.unwatch(port)
+        side.setup(port, True, 0)
+
+    def set(self, value):
+        side.write(self.port, value)
+
+    def value(self):
+        return side.read(self.port)
+
+
+class AnalogIn:
+    """
+    Analog input on a three wire port. The bus lines are digital, so reads
+    are full scale or zero.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        side.unwatch(port)
+        side.setup(port, False)
+
+    def value(self, units=AnalogUnits.TWELVEBIT):
+        level = side.read(self.port)
+        full_scale = {AnalogUnits.PCT: 100, AnalogUnits.EIGHTBIT: 255, AnalogUnits.TENBIT: 1023,
+                      AnalogUnits.MV: 5000}.get(units, 4095)
+        return full_scale * level
+
+
+class Thread:
+    """
+    A vex thread. Like on the brain, threads take turns with the main program
+    and hand over whenever they wait, see virtual_bus.Task.
+    """
+
+    def __init__(self, callback, arg=()):
+        self.task = side.start_task(callback, *arg)
+
+    def stop(self):
+        self.task.stop()
+
+    @staticmethod
+    def sleep_for(duration, units=MSEC):
+        wait(duration, units)
+
+
+def wait(time, units=MSEC):
+    side.sleep_us(to_us(time, units))
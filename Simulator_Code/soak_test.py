@@ -0,0 +1,267 @@
+# Soak the link with mixed match traffic over the simulated bus.
+#
+# Each traffic class generates messages on one end of the link, periodically
+# or at random, and puts them on that end's send queue. One send loop per end
+# takes them off the queue in order and sends them, like a main loop would,
+# while the other end may be sending at the same time. Every message carries
+# its class and a sequence number, so each class gets its own delivery
+# latency, from being queued to arriving, and its own counts of messages
+# dropped on a full queue, lost on the link or delivered corrupted.
+#
+# Run from the Simulator_Code folder:
+#   python soak_test.py --seconds 300
+#   python soak_test.py --mix vision --peer pico --queue 8 --out soak.json
+#   python soak_test.py --mix my_mix.json
+import argparse
+import json
+import time
+from collections import deque
+
+from benchmark import percentile
+from virtual_bus import VirtualBus, load_profile
+
+POLL_S = 0.001  # Send loop sleep while its queue is empty
+REPORT_EVERY_S = 60  # Simulated time between progress lines
+
+
+class TrafficClass:
+    """
+    One kind of message in a traffic mix.
+
+    Parameters:
+    - name (str): Shown in the report.
+    - sender (str): "brain" or "peer", the end that sends it.
+    - size (int): Payload bytes of each message, at least 4.
+    - rate_hz (float): Messages, or bursts, per second.
+    - periodic (bool): Sent at a fixed rate, otherwise at random times averaging rate_hz.
+    - burst (int): Messages queued together each time.
+    """
+
+    def __init__(self, name, sender, size, rate_hz, periodic=False, burst=1):
+        if size < 4:
+            raise ValueError("A traffic class needs at least 4 bytes for its id and sequence number")
+        self.name = name
+        self.sender = sender
+        self.size = size
+        self.rate_hz = rate_hz
+        self.periodic = periodic
+        self.burst = burst
+
+        self.generated = 0
+        self.dropped = 0  # Queue full
+        self.delivered = 0
+        self.corrupted = 0
+        self.latencies_ms = []
+        self.pending = {}  # Sequence number -> time queued
+
+    def body(self, class_id, sequence):
+        """
+        Class id, 24 bit sequence number and filler that depends on both.
+        """
+        head = bytes((class_id, sequence >> 16 & 0xFF, sequence >> 8 & 0xFF, sequence & 0xFF))
+        return head + bytes((class_id + sequence + i) & 0xFF for i in range(self.size - 4))
+
+
+ODOMETRY = dict(name="odometry", sender="brain", size=12, rate_hz=50, periodic=True)
+VISION = dict(name="vision", sender="peer", size=16, rate_hz=2, burst=5)
+CONFIG = dict(name="config", sender="peer", size=64, rate_hz=0.05)
+COMMAND = dict(name="command", sender="peer", size=4, rate_hz=0.2)
+
+MIXES = {
+    # 50 Hz odometry from the brain, bursts of detections from the camera,
+    # the odd config push and rare urgent commands
+    "match": [ODOMETRY, VISION, CONFIG, COMMAND],
+    "telemetry": [ODOMETRY],
+    "vision": [VISION, COMMAND],
+}
+
+
+def load_mix(name):
+    """
+    New traffic classes for a named mix, or a .json file with a list of TrafficClass fields.
+    """
+    if name.endswith(".json"):
+        with open(name) as mix_file:
+            return [TrafficClass(**fields) for fields in json.load(mix_file)]
+    return [TrafficClass(**fields) for fields in MIXES[name]]
+
+
+class Soak:
+    """
+    A traffic mix run between the brain and a peer on one VirtualBus.
+    """
+
+    def __init__(self, mix, peer="pi", queue_limit=32, brain_profile="brain", seed=1):
+        self.mix = mix
+        self.queue_limit = queue_limit
+        self.bus = bus = VirtualBus(seed=seed)
+
+        self.sides = {
+            "brain": bus.attach("brain", "v5", load_profile(brain_profile)),
+            "peer": bus.attach("peer", peer),
+        }
+        self.comms = {}
+        self.queues = {}
+        self.unexpected = 0  # Frames that are not from the mix, eg ERROR resends of something else
+        self.collisions = 0  # Frames where both ends drove CS high at once
+        self.colliding = False
+        for name, side in self.sides.items():
+            self.comms[name] = side.create_comm(on_bytes_received=self.on_bytes,
+                                                log_level=side.load_library().LOG_ERROR)
+            self.queues[name] = deque()
+        for comm in self.comms.values():
+            self.guard(comm)
+
+        bus.taps.append(self.watch_collisions)
+        for class_id, traffic in enumerate(mix):
+            self.schedule_next(class_id, traffic)
+        for name, side in self.sides.items():
+            side.start_task(self.send_loop, name)
+
+    def guard(self, comm):
+        """
+        Count a corrupted frame that reaches a handler not expecting it, rather than stopping.
+        """
+        dispatch_payload = comm.dispatch_payload
+
+        def guarded_dispatch(payload):
+            try:
+                dispatch_payload(payload)
+            except Exception:
+                self.unexpected += 1
+
+        comm.dispatch_payload = guarded_dispatch
+
+    def watch_collisions(self, line, level):
+        if line.name == "clock" and level and not self.colliding and sum(self.bus.lines["cs"].drivers.values()) > 1:
+            self.colliding = True
+            self.collisions += 1
+        elif line.name == "cs" and not level:
+            self.colliding = False
+        return False
+
+    def schedule_next(self, class_id, traffic):
+        if traffic.periodic:
+            gap_s = 1 / traffic.rate_hz
+        else:
+            gap_s = self.bus.random.expovariate(traffic.rate_hz)
+        self.bus.schedule(self.bus.now_us + gap_s * 1000000, lambda: self.generate(class_id, traffic),
+                          background=True)
+
+    def generate(self, class_id, traffic):
+        queue = self.queues[traffic.sender]
+        for _ in range(traffic.burst):
+            sequence = traffic.generated & 0xFFFFFF
+            traffic.generated += 1
+            if len(queue) >= self.queue_limit:
+                traffic.dropped += 1
+                continue
+            traffic.pending[sequence] = self.bus.now_us
+            queue.append(traffic.body(class_id, sequence))
+        self.schedule_next(class_id, traffic)
+
+    def send_loop(self, name):
+        comm = self.comms[name]
+        queue = self.queues[name]
+        sleep = self.sides[name].time.sleep
+        while True:
+            if queue:
+                comm.send_bytes(queue.popleft())
+            else:
+                sleep(POLL_S)
+
+    def on_bytes(self, message):
+        data = bytes(message.data)
+        if len(data) < 4 or data[0] >= len(self.mix):
+            self.unexpected += 1
+            return
+        class_id = data[0]
+        traffic = self.mix[class_id]
+        sequence = data[1] << 16 | data[2] << 8 | data[3]
+        queued_us = traffic.pending.pop(sequence, None)
+        if len(data) != traffic.size or data != traffic.body(class_id, sequence):
+            traffic.corrupted += 1
+        elif queued_us is not None:
+            traffic.delivered += 1
+            traffic.latencies_ms.append((self.bus.now_us - queued_us) / 1000)
+        else:
+            self.unexpected += 1  # A resend of a message already delivered
+
+    def run(self, seconds):
+        """
+        Run the mix for some simulated seconds, printing progress now and then.
+        """
+        end_us = self.bus.now_us + seconds * 1000000
+        while self.bus.now_us < end_us:
+            self.bus.run_until(min(end_us, self.bus.now_us + REPORT_EVERY_S * 1000000))
+            print(f"{self.bus.now_us / 1000000:7.0f} s  " + "  ".join(
+                f"{traffic.name} {traffic.delivered}/{traffic.generated}" for traffic in self.mix))
+
+    def report(self):
+        classes = []
+        for class_id, traffic in enumerate(self.mix):
+            # Still queued when the run ended, not counted as lost
+            in_flight = sum(1 for body in self.queues[traffic.sender] if body[0] == class_id)
+            lost = traffic.generated - traffic.dropped - traffic.delivered - in_flight
+            classes.append({
+                "name": traffic.name,
+                "sender": traffic.sender,
+                "size": traffic.size,
+                "rate_hz": traffic.rate_hz,
+                "burst": traffic.burst,
+                "generated": traffic.generated,
+                "dropped": traffic.dropped,
+                "delivered": traffic.delivered,
+                "lost": lost,
+                "corrupted": traffic.corrupted,
+                "in_flight": in_flight,
+                "drop_rate": (traffic.dropped + lost) / traffic.generated if traffic.generated else 0,
+                "latency_p50_ms": percentile(traffic.latencies_ms, 0.5),
+                "latency_p95_ms": percentile(traffic.latencies_ms, 0.95),
+                "latency_p99_ms": percentile(traffic.latencies_ms, 0.99),
+                "latency_max_ms": max(traffic.latencies_ms) if traffic.latencies_ms else None,
+            })
+        return {
+            "simulated_s": self.bus.now_us / 1000000,
+            "queue_limit": self.queue_limit,
+            "collisions": self.collisions,
+            "unexpected": self.unexpected,
+            "classes": classes,
+            "links": {name: comm.snapshot_stats() for name, comm in self.comms.items()},
+        }
+
+
+def format_ms(value):
+    return f"{value:9.1f}" if value is not None else "        -"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Soak the simulated link with mixed match traffic.")
+    parser.add_argument("--mix", default="match", help=f"one of {', '.join(MIXES)} or a .json file")
+    parser.add_argument("--seconds", type=float, default=120, help="simulated time to run for")
+    parser.add_argument("--peer", choices=["pi", "pico"], default="pi", help="the other end of the link")
+    parser.add_argument("--brain-profile", default="brain", help="brain timing, a profile name or .json file")
+    parser.add_argument("--queue", type=int, default=32, help="send queue length on each end")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the jitter and the traffic")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    soak = Soak(load_mix(args.mix), args.peer, args.queue, args.brain_profile, args.seed)
+    started = time.perf_counter()
+    soak.run(args.seconds)
+    report = soak.report()
+
+    print(f"\n{report['simulated_s']:.0f} s simulated in {time.perf_counter() - started:.1f} s, "
+          f"{report['collisions']} collisions, {report['unexpected']} unexpected frames\n")
+    print(f"{'class':10} {'from':5} {'sent':>6} {'queue':>6} {'lost':>5} {'bad':>4} {'drop %':>7} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for traffic in report["classes"]:
+        print(f"{traffic['name']:10} {traffic['sender']:5} {traffic['generated']:6} {traffic['dropped']:6} "
+              f"{traffic['lost']:5} {traffic['corrupted']:4} {traffic['drop_rate']:7.1%} "
+              f"{format_ms(traffic['latency_p50_ms'])} {format_ms(traffic['latency_p99_ms'])} "
+              f"{format_ms(traffic['latency_max_ms'])}")
+
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
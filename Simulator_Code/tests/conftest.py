@@ -0,0 +1,15 @@
+# Tests of the libraries talking over the simulated bus. Run from the repo root:
+#   python -m pytest Simulator_Code/tests
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from virtual_bus import VirtualBus  # noqa: E402
+
+
+@pytest.fixture
+def bus():
+    return VirtualBus(seed=1)
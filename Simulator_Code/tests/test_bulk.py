@@ -0,0 +1,61 @@
+# Bulk transfers between every pair of platforms.
+import pytest
+
+SENDERS = ["pi", "v5", "pico"]
+
+
+class LinkCut:
+    """
+    A tap that lets a number of frames end, then hides every edge after them.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __call__(self, line, level):
+        if self.frames <= 0:
+            return True
+        if line.name == "cs" and not level:
+            self.frames -= 1
+        return False
+
+
+@pytest.mark.parametrize("sender_platform", SENDERS)
+@pytest.mark.parametrize("share", [0, -0.5, 1.5])
+def test_share_out_of_range_is_refused_before_sending(bus, sender_platform, share):
+    side = bus.attach("sender", sender_platform)
+    sender = side.create_comm()
+    bus.attach("receiver", "pi").create_comm().register_bulk_handler(lambda name, data: None)
+
+    with pytest.raises(ValueError):
+        sender.send_bulk(b"path" * 20, share=share)
+    bus.settle()
+
+    assert sender.next_bulk_id == 0
+    assert not sender.bulk_sending
+    assert sender.snapshot_stats()["frames_out"] == 0
+    assert bus.edges == 0
+
+
+@pytest.mark.parametrize("sender_platform, receiver_platform", [("pi", "v5"), ("v5", "pi"), ("pico", "pi"), ("pi", "pi")])
+def test_transfer_resumes_after_the_link_drops(bus, sender_platform, receiver_platform):
+    sender = bus.attach("sender", sender_platform).create_comm()
+    received = []
+    bus.attach("receiver", receiver_platform).create_comm().register_bulk_handler(
+        lambda name, data: received.append((name, bytes(data))))
+    data = bytes(range(256)) + bytes(range(56))  # 12 chunks of 26 bytes
+    cut = LinkCut(frames=6)
+
+    def arm(transfer):
+        if transfer.status == 0 and not bus.taps:  # The start was acknowledged
+            bus.taps.append(cut)
+
+    first = sender.send_bulk(data, name="path", on_progress=arm)
+    bus.taps.clear()
+    second = sender.send_bulk(data, name="path")
+    bus.settle()
+
+    assert first.error == "no acknowledgement"
+    assert second.complete and second.error is None
+    assert second.chunks_sent < second.chunks  # Started after the chunks the receiver kept
+    assert received == [("path", data)]
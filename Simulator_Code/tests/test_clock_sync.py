@@ -0,0 +1,34 @@
+# Clock sync from the Raspberry Pi's clock sync thread, against a peer whose clock is offset and drifts.
+import pytest
+
+OFFSET_US = (1 << 30) - 2000000
+DRIFT_PPM = 50
+
+
+def skew_clock(side):
+    ticks_us = side.ticks_us
+    side.ticks_us = lambda: int(ticks_us() * (1 + DRIFT_PPM * 1e-6)) + OFFSET_US
+
+
+def true_offset_us(remote, local):
+    offset = (remote.clock.now() - local.clock.now()) & 0xFFFFFFFF
+    return offset - (1 << 32) if offset >= 1 << 31 else offset
+
+
+# The brain clocks a reply out at around 10 ms a bit, so it is asked less often
+@pytest.mark.parametrize("peer, interval_ms", [("pico", 200), ("v5", 2000)])
+def test_clock_sync_thread_runs_in_simulated_time(bus, peer, interval_ms):
+    peer_side = bus.attach("peer", peer)
+    pi_side = bus.attach("pi", "pi")
+    skew_clock(peer_side)
+    remote = peer_side.create_comm()
+    local = pi_side.create_comm()
+
+    local.start_clock_sync(interval_ms=interval_ms)
+    bus.run_for(interval_ms * 50e3)
+
+    snapshot = local.clock.snapshot()
+    assert snapshot["synced"]
+    assert 45 <= snapshot["exchanges"] <= 51  # One every interval of simulated time
+    assert abs(local.clock.offset_us() - true_offset_us(remote, local)) < 100
+    assert abs(snapshot["drift_ppm"] - DRIFT_PPM) < 10
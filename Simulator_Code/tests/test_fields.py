@@ -0,0 +1,39 @@
+# Text messages parsed into fields on every receiving platform.
+import pytest
+
+RECEIVERS = [("v5", "pi"), ("pi", "v5"), ("pi", "pico")]
+
+
+@pytest.mark.parametrize("field_record", [False, True])
+@pytest.mark.parametrize("sender_platform, receiver_platform", RECEIVERS)
+def test_only_field_messages_reach_on_fields_received(bus, sender_platform, receiver_platform, field_record):
+    sender = bus.attach("sender", sender_platform).create_comm()
+    fields, messages = [], []
+    bus.attach("receiver", receiver_platform).create_comm(
+        fields={"x": int, "y": int}, field_record=field_record,
+        on_fields_received=lambda values: fields.append(
+            (values.x, values.y) if field_record else (values["x"], values["y"])),
+        on_message_received=messages.append)
+
+    for text in ("x90,y100", "Hello", "y-7", "x1,y2,z3"):
+        sender.send_data(text)
+        bus.settle()
+
+    assert fields == [(90, 100), (None, -7), (1, 2)]
+    assert messages == ["x90,y100", "Hello", "y-7", "x1,y2,z3"]
+
+
+@pytest.mark.parametrize("sender_platform, receiver_platform", RECEIVERS)
+def test_field_message_with_a_bad_value_is_rejected(bus, sender_platform, receiver_platform):
+    sender = bus.attach("sender", sender_platform).create_comm()
+    fields = []
+    receiver = bus.attach("receiver", receiver_platform).create_comm(
+        fields={"x": int, "y": int}, on_fields_received=lambda values: fields.append(dict(values)))
+
+    sender.send_data("x9.5,y1")
+    bus.settle()
+    sender.send_data("x9,y1")
+    bus.settle()
+
+    assert fields == [{"x": 9, "y": 1}]
+    assert receiver.snapshot_stats()["rejected_frames"] == 1
@@ -0,0 +1,81 @@
+# Frame logs written by the Raspberry Pi library, read back and replayed into a ReplaySink.
+
+
+def record_match(bus, path):
+    """
+    Log the frames of a short exchange with the brain: strings, typed messages,
+    delta samples, a call and a clock exchange. Returns the Pi's library.
+    """
+    pi_side = bus.attach("pi", "pi")
+    brain_side = bus.attach("brain", "v5")
+    pi = pi_side.create_comm(on_message_received=lambda data: None)
+    brain = brain_side.create_comm()
+    for comm in (pi, brain):
+        comm.register_message(1, "hh")
+        comm.register_delta_channel(2, 2, keyframe_interval=4)
+    pi.register_handler("ping", lambda: "pong")
+    pi.enable_frame_log(str(path))
+
+    brain.send_data("Hello")
+    for i in range(3):
+        brain.send_message(1, (i, -i))
+    for i in range(6):
+        brain.send_delta(2, (i, 10 * i))
+    assert brain.call("ping", timeout_ms=60000).result() == "pong"
+    brain.sync_clock()
+    bus.settle()
+    pi.disable_frame_log()
+    return pi_side.library
+
+
+def make_sink(library, received):
+    sink = library.ReplaySink(on_message_received=lambda data: received.append(("text", data)))
+    sink.register_message(1, "hh", callback=lambda values: received.append(("typed", values)))
+    sink.register_delta_channel(2, 2, keyframe_interval=4, callback=lambda values: received.append(("delta", values)))
+    return sink
+
+
+def test_replay_delivers_data_frames_and_sends_nothing(bus, tmp_path):
+    path = tmp_path / "match.v5log"
+    library = record_match(bus, path)
+    received = []
+    sink = make_sink(library, received)
+
+    reader = library.FrameLogReader(str(path))
+    edges = bus.edges
+    replayed = reader.replay(sink, speed=None)
+    reader.close()
+
+    assert received == ([("text", "Hello")] + [("typed", (i, -i)) for i in range(3)]
+                        + [("delta", [i, 10 * i]) for i in range(6)])
+    assert replayed == len(received)  # The call and the clock exchange are left out
+    assert bus.edges == edges
+    assert sink.snapshot_stats()["frames_out"] == 0
+
+
+def test_replay_from_the_middle_drops_deltas_without_sending(bus, tmp_path):
+    path = tmp_path / "match.v5log"
+    library = record_match(bus, path)
+    received = []
+    sink = make_sink(library, received)
+
+    reader = library.FrameLogReader(str(path))
+    times = [record[0] for record in reader.records()]
+    edges = bus.edges
+    reader.replay(sink, speed=None, start_ns=times[5])  # After the first keyframe
+    reader.close()
+
+    assert [values for kind, values in received if kind == "delta"] == [[5, 50]]  # From the next keyframe
+    assert bus.edges == edges
+
+
+def test_reading_a_log_before_its_first_flush(bus, tmp_path):
+    pi = bus.attach("pi", "pi").create_comm()
+    path = tmp_path / "empty.v5log"
+    pi.enable_frame_log(str(path))  # The header is still buffered, the file is empty
+
+    reader = bus.sides[0].library.FrameLogReader(str(path))
+    assert list(reader.records()) == []
+    assert reader.first_ns() is None
+    reader.close()
+    pi.disable_frame_log()
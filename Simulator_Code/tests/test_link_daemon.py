@@ -0,0 +1,101 @@
+# link_daemon.py sharing one link between client processes over its Unix socket.
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from virtual_bus import REPO
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+sys.path.insert(0, str(REPO / "Raspberry_Pi_Code"))
+
+from lib.V5_External_Comm_Lib import FRAME_BYTES, FRAME_TYPED, LOG_WARNING, ReplaySink  # noqa: E402
+from lib.link_client import OP_MESSAGE, LinkClient  # noqa: E402
+from link_daemon import LinkBridge  # noqa: E402
+
+
+class RecordingSink(ReplaySink):
+    """
+    A link that keeps the frames it is asked to send and the frames the library handles itself.
+    """
+
+    def __init__(self):
+        super().__init__(log_level=LOG_WARNING)
+        self.sent = []
+        self.dispatched = []
+
+    def send_frame(self, payload, remember=True):
+        self.sent.append(bytes(payload))
+
+    def dispatch_payload(self, payload):
+        self.dispatched.append(bytes(payload))
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    sink = RecordingSink()
+    path = str(tmp_path / "link.sock")
+    bridge = LinkBridge(sink, path)
+    server = threading.Thread(target=bridge.serve_forever, daemon=True)
+    server.start()
+    clients = []
+
+    def connect(name, *topics):
+        client = LinkClient(path, name=name)
+        for topic in topics:
+            client.subscribe(topic)
+        client.stats()  # Answered after the subscriptions are handled
+        clients.append(client)
+        return client
+
+    yield bridge, sink, connect
+
+    bridge.running = False
+    bridge.wake()
+    server.join(2)
+    bridge.stop()
+    for client in clients:
+        client.close()
+
+
+def test_received_frames_reach_their_subscribers(daemon):
+    bridge, sink, connect = daemon
+    text = connect("text", "text")
+    typed = connect("typed", "typed")
+    everything = connect("all", "*")
+
+    bridge.on_payload(b"RPI_IN 1")
+    bridge.on_payload(bytes((FRAME_TYPED, 3, 0, 7)))
+    bridge.on_payload(bytes((FRAME_BYTES, 1, 2)))
+    bridge.on_payload(b"ERROR")  # Handled by the library, not copied to clients
+
+    assert text.receive() == (OP_MESSAGE, "text", b"RPI_IN 1")
+    assert typed.receive() == (OP_MESSAGE, "typed/3", bytes((FRAME_TYPED, 3, 0, 7)))
+    assert [everything.receive() for _ in range(3)] == [
+        (OP_MESSAGE, "text", b"RPI_IN 1"),
+        (OP_MESSAGE, "typed/3", bytes((FRAME_TYPED, 3, 0, 7))),
+        (OP_MESSAGE, "bytes", b"\x01\x02"),
+    ]
+    assert sink.dispatched == [b"ERROR"]
+
+
+def test_published_messages_are_sent_on_the_link(daemon):
+    bridge, sink, connect = daemon
+    camera = connect("camera")
+    odometry = connect("odometry")
+
+    for i in range(5):
+        camera.publish("text", "RPI_OUT " + str(i))
+        odometry.publish("bytes", bytes((i,)))
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        stats = {client["name"]: client for client in camera.stats()["clients"]}
+        if stats["camera"]["sent"] + stats["odometry"]["sent"] == 10:
+            break
+
+    assert [frame for frame in sink.sent if frame[0] == FRAME_BYTES] == [bytes((FRAME_BYTES, i)) for i in range(5)]
+    assert [frame for frame in sink.sent if frame[0] != FRAME_BYTES] == [b"RPI_OUT " + bytes(str(i), "utf-8")
+                                                                         for i in range(5)]
+    assert stats["camera"]["sent"] == 5 and stats["odometry"]["sent"] == 5
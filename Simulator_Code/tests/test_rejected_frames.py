@@ -0,0 +1,65 @@
+# Frames with a good checksum that the receiver cannot handle are dropped with a warning and counted.
+import pytest
+
+RECEIVERS = [("v5", "pi"), ("pi", "v5"), ("pi", "pico")]
+
+
+def connect(bus, sender_platform, receiver_platform, **receiver_kwargs):
+    sender = bus.attach("sender", sender_platform).create_comm()
+    received = []
+    receiver = bus.attach("receiver", receiver_platform).create_comm(
+        on_message_received=received.append, **receiver_kwargs)
+    return sender, receiver, received
+
+
+@pytest.mark.parametrize("sender_platform, receiver_platform", RECEIVERS)
+def test_unknown_and_malformed_typed_messages(bus, sender_platform, receiver_platform):
+    sender, receiver, received = connect(bus, sender_platform, receiver_platform)
+    sender.register_message(9, "hh")
+    sender.register_message(10, "hh")
+    receiver.register_message(10, "hhh")
+
+    sender.send_message(9, (1, 2))  # Never registered on the receiver
+    bus.settle()
+    sender.send_message(10, (1, 2))  # Shorter than the receiver's layout
+    bus.settle()
+    sender.send_data("Still here")
+    bus.settle()
+
+    assert received == ["Still here"]
+    assert receiver.snapshot_stats()["rejected_frames"] == 2
+
+
+@pytest.mark.parametrize("sender_platform, receiver_platform", RECEIVERS)
+def test_unknown_delta_channel_and_resync(bus, sender_platform, receiver_platform):
+    sender, receiver, received = connect(bus, sender_platform, receiver_platform)
+    sender.register_delta_channel(3, 2)
+    library = bus.sides[0].library
+
+    sender.send_delta(3, (1, 2))  # Channel 3 is not registered on the receiver
+    bus.settle()
+    sender.send_frame(bytes((library.FRAME_RESYNC, 7)))
+    bus.settle()
+    sender.send_data("Still here")
+    bus.settle()
+
+    assert received == ["Still here"]
+    assert receiver.snapshot_stats()["rejected_frames"] == 2
+
+
+@pytest.mark.parametrize("sender_platform, receiver_platform", RECEIVERS)
+def test_compressed_strings_without_a_matching_dictionary(bus, sender_platform, receiver_platform):
+    sender = bus.attach("sender", sender_platform).create_comm(dictionary=["Status ", "Hello ", "RPI_OUT "])
+    received = []
+    receiver = bus.attach("receiver", receiver_platform).create_comm(on_message_received=received.append)
+
+    sender.send_data("Status Status Status")  # The receiver has no dictionary
+    bus.settle()
+    receiver.dictionary_codec = bus.sides[1].library.DictionaryCodec(["Status "])
+    sender.send_data("RPI_OUT RPI_OUT RPI_OUT")  # Entry 2 is past the end of the receiver's dictionary
+    bus.settle()
+    sender.send_data("Status Status Status")
+    bus.settle()
+
+    assert received == ["Status Status Status"]
+    assert receiver.snapshot_stats()["rejected_frames"] == 2
@@ -0,0 +1,36 @@
+# Remote calls between every pair of libraries, made back to back without waiting for replies.
+import pytest
+
+PAIRS = [("pi", "v5"), ("v5", "pi"), ("pi", "pico"), ("pico", "pi"), ("pi", "pi"), ("v5", "pico")]
+
+
+@pytest.mark.parametrize("caller_platform, callee_platform", PAIRS)
+def test_pipelined_calls_all_get_their_reply(bus, caller_platform, callee_platform):
+    caller = bus.attach("caller", caller_platform).create_comm()
+    callee = bus.attach("callee", callee_platform).create_comm()
+    served = []
+
+    def add(x, y):
+        served.append(x)
+        return x + y
+
+    callee.register_handler("add", add)
+
+    futures = [caller.call("add", (i, 1), timeout_ms=60000) for i in range(8)]
+    results = [future.result() for future in futures]
+
+    assert served == list(range(8))
+    assert results == list(range(1, 9))
+    assert caller.rpc_timeouts == {}
+    assert caller.snapshot_stats()["truncated_frames"] == 0
+
+
+@pytest.mark.parametrize("caller_platform, callee_platform", [("pi", "v5"), ("pico", "pi")])
+def test_unknown_method_raises(bus, caller_platform, callee_platform):
+    caller = bus.attach("caller", caller_platform).create_comm()
+    bus.attach("callee", callee_platform).create_comm()
+    library = bus.sides[0].library
+
+    future = caller.call("missing", timeout_ms=60000)
+    with pytest.raises(library.RpcError, match="Unknown method missing"):
+        future.result()
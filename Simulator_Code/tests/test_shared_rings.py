@@ -0,0 +1,103 @@
+# Shared memory rings between link_daemon.py and its clients. Only the wakeups
+# wake the readers, so a lost wakeup shows up as a timeout.
+import select
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from virtual_bus import REPO
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "send_fds"), reason="needs Unix sockets passing descriptors")
+sys.path.insert(0, str(REPO / "Raspberry_Pi_Code"))
+
+from lib.V5_External_Comm_Lib import FRAME_BYTES, ReplaySink  # noqa: E402
+from lib.link_client import OP_PUBLISH, LinkClient  # noqa: E402
+from lib.shm_ring import SharedRings  # noqa: E402
+from link_daemon import LinkBridge  # noqa: E402
+
+MESSAGES = 20000
+
+
+def test_every_message_wakes_a_sleeping_reader():
+    rings = SharedRings(4096)
+    ring = rings.outbound
+
+    def produce():
+        for i in range(MESSAGES):
+            while not ring.push(OP_PUBLISH, "bytes", i.to_bytes(4, "big")):
+                time.sleep(0)  # Full, let the reader catch up
+            if i % 97 == 0:
+                time.sleep(0.0001)  # Let the reader empty the ring and go back to sleep
+
+    received = []
+    producer = threading.Thread(target=produce)
+    producer.start()
+    try:
+        while len(received) < MESSAGES:
+            readable, _, _ = select.select([ring.wakeup], [], [], 5)
+            assert readable, f"Reader never woken, {len(received)} of {MESSAGES} messages"
+            ring.wakeup.clear()
+            ring.drain(lambda op, topic, body: received.append(int.from_bytes(body, "big")))
+    finally:
+        producer.join()
+        rings.close()
+
+    assert received == list(range(MESSAGES))
+
+
+class RecordingSink(ReplaySink):
+    """
+    A link that keeps the frames it is asked to send.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+        self.all_sent = threading.Event()
+
+    def send_frame(self, payload, remember=True):
+        self.sent.append(bytes(payload))
+        if len(self.sent) == 50:
+            self.all_sent.set()
+
+
+def test_client_and_daemon_over_shared_memory(tmp_path):
+    sink = RecordingSink()
+    bridge = LinkBridge(sink, str(tmp_path / "link.sock"))
+    server = threading.Thread(target=bridge.serve_forever, daemon=True)
+    server.start()
+
+    client = LinkClient(str(tmp_path / "link.sock"), name="camera", shared_memory=True)
+    received = []
+    all_received = threading.Event()
+
+    def on_message(topic, body):
+        received.append((topic, bytes(body)))
+        if len(received) == 50:
+            all_received.set()
+
+    client.subscribe("text")
+    client.start(on_message)
+    client.stats()  # Answered after the subscription is handled
+    try:
+        for i in range(50):
+            bridge.on_payload(b"RPI_IN " + str(i).encode())
+            client.publish("bytes", bytes((i,)))
+            if i % 10 == 0:
+                time.sleep(0.01)
+
+        assert all_received.wait(2)
+        assert sink.all_sent.wait(2)
+    finally:
+        bridge.running = False  # stop() belongs to the thread serving, once it returns
+        bridge.wake()
+        server.join(2)
+        bridge.stop()
+        client.thread.join(2)  # The reader stops when the daemon closes the socket
+        client.close()
+
+    assert received == [("text", b"RPI_IN " + str(i).encode()) for i in range(50)]
+    assert sink.sent == [bytes((FRAME_BYTES, i)) for i in range(50)]
@@ -0,0 +1,55 @@
+# The Pi's telemetry store fed by a link, and its handling of time.
+import sys
+import time
+
+import pytest
+
+from virtual_bus import REPO
+
+pytest.importorskip("numpy")
+sys.path.insert(0, str(REPO / "Raspberry_Pi_Code" / "lib"))
+
+from telemetry_store import TelemetryStore  # noqa: E402
+
+
+def test_fields_from_the_link(bus):
+    store = TelemetryStore(capacity=4)
+    sender = bus.attach("v5", "v5").create_comm()
+    bus.attach("pi", "pi").create_comm(fields={"x": int, "y": int}, on_fields_received=store.on_fields)
+
+    for i in range(6):
+        sender.send_data(f"x{i},y{10 * i}")
+        bus.settle()
+
+    assert store.last("x", 10)[1].tolist() == [2, 3, 4, 5]
+    assert store.window("y", seconds=60)[1].tolist() == [20, 30, 40, 50]
+    assert store.latest("y") == 50
+
+
+def test_times_are_monotonic_and_exported_as_wall_clock(tmp_path):
+    store = TelemetryStore()
+    before = time.monotonic()
+    store.append_many({"x": 1, "y": None})
+    times, values = store.window("x", seconds=60)
+
+    assert store.field_names() == ["x"]
+    assert before <= times[0] <= time.monotonic()
+    assert abs(store.columns()[1][0] - time.time()) < 1
+
+    store.to_csv(tmp_path / "store.csv")
+    row = (tmp_path / "store.csv").read_text().splitlines()[1].split(",")
+    assert row[0] == "x" and abs(float(row[1]) - time.time()) < 1
+
+
+def test_timestamps_going_backwards_are_rejected():
+    store = TelemetryStore()
+    store.append("x", 1, timestamp=10.0)
+    store.append("x", 2, timestamp=10.0)
+    store.append("y", 3, timestamp=5.0)  # Each field keeps its own order
+
+    with pytest.raises(ValueError):
+        store.append_many({"y": 4, "x": 5}, timestamp=9.0)
+
+    assert store.window("x")[1].tolist() == [1, 2]
+    assert store.window("y")[1].tolist() == [3]
+    assert store.window("x", start=10.0, end=10.0)[1].tolist() == [1, 2]
@@ -0,0 +1,28 @@
+# Waypoint streaming from the Raspberry Pi to the brain, answered by the Pi's send thread.
+import pytest
+
+
+@pytest.mark.parametrize("capacity, low_water, step_ms", [(16, 6, 200), (16, 6, 50), (4, 1, 50)])
+def test_stream_delivers_whole_path_in_order(bus, capacity, low_water, step_ms):
+    pi_side = bus.attach("pi", "pi")
+    brain_side = bus.attach("brain", "v5")
+    pi = pi_side.create_comm()
+    brain = brain_side.create_comm()
+    path = [(i * 10, -i * 5, i % 360) for i in range(100)]
+    pi.serve_waypoints(1, path, "hhh")
+    streamer = brain.stream_waypoints(1, "hhh", capacity=capacity, low_water=low_water)
+
+    received = []
+
+    def control_loop():
+        while not streamer.finished():
+            waypoint = streamer.next()
+            if waypoint is not None:
+                received.append(waypoint)
+            brain_side.time.sleep(step_ms / 1000)
+
+    brain_side.start_task(control_loop)
+    bus.run_for(60e6)
+
+    assert received == [tuple(float(value) for value in waypoint) for waypoint in path]
+    assert streamer.snapshot()["out_of_order"] == 0
@@ -0,0 +1,719 @@
+# Deterministic in-process three wire bus for running the libraries on Linux.
+#
+# Each end of the bus is a Side with its own timing profile. A side loads one
+# of the three libraries against shim RPi.GPIO, machine or vex modules and a
+# simulated time module, so two V5ExternalComm instances can talk to each
+# other in one process:
+#
+#   bus = VirtualBus(seed=1)
+#   pi = bus.attach("pi", "pi")
+#   brain = bus.attach("brain", "v5")
+#   sender = pi.create_comm()
+#   receiver = brain.create_comm(on_message_received=print)
+#   sender.send_data("Hello")
+#   bus.settle()
+#
+# Time only moves when a library sleeps or touches a pin, or when the bus is
+# run. Edges are handed to the other side's interrupt handlers after that
+# side's latency and jitter, so late handlers read the data line as it is
+# then, the same way bits are lost on the real link.
+import heapq
+import json
+import math
+import random
+import sys
+import threading
+import traceback
+import types
+from collections import deque
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+SHIMS = Path(__file__).resolve().parent / "shims"
+
+LINES = ("cs", "clock", "data")
+WAIT_POLL_US = 200  # How often a library thread waiting on a lock or event looks again
+
+LIBRARIES = {
+    "pi": REPO / "Raspberry_Pi_Code" / "lib" / "V5_External_Comm_Lib.py",
+    "pico": REPO / "Micropython_Code" / "lib" / "V5_External_Comm_Lib.py",
+    "v5": REPO / "V5_Brain_Code" / "main.py",
+}
+V5_EXAMPLE_MARKER = "# Define a callback function to handle received messages"  # main.py's example code starts here
+
+
+class BusStalled(Exception):
+    """
+    Raised when simulated time passes the bus deadline, eg a sender waiting on a stuck CS line.
+    """
+
+
+class TaskStopped(Exception):
+    """
+    Raised inside a task that was stopped, at its next sleep or pin access.
+    """
+
+
+class SideProfile:
+    """
+    Timing of one end of the bus.
+
+    Parameters:
+    - name (str): Name shown in reports.
+    - latency_us (float): Time from an edge on the bus to its interrupt handler running.
+    - jitter_us (float): Random extra time, up to this much, added to every
+        handler dispatch and every sleep.
+    - granularity_us (float): Resolution of sleeps and the coarse timer. Sleeps end
+        on the next tick, eg 5000 for the brain's 5 ms.
+    - pin_cost_us (float): Time each pin read or write takes.
+    """
+
+    def __init__(self, name, latency_us=0, jitter_us=0, granularity_us=1, pin_cost_us=0):
+        self.name = name
+        self.latency_us = latency_us
+        self.jitter_us = jitter_us
+        self.granularity_us = granularity_us
+        self.pin_cost_us = pin_cost_us
+
+    def __repr__(self):
+        return (f"SideProfile({self.name!r}, latency_us={self.latency_us}, jitter_us={self.jitter_us}, "
+                f"granularity_us={self.granularity_us}, pin_cost_us={self.pin_cost_us})")
+
+
+# Starting points, tune them against scope captures of the real hardware
+IDEAL_PROFILE = SideProfile("ideal")
+PI_PROFILE = SideProfile("pi", latency_us=60, jitter_us=40, pin_cost_us=1)
+PICO_PROFILE = SideProfile("pico", latency_us=15, jitter_us=5, pin_cost_us=2)
+BRAIN_PROFILE = SideProfile("brain", latency_us=40, jitter_us=40, granularity_us=5000, pin_cost_us=5)
+# The brain as measured in the PWM investigation: time to the nearest 5 ms and
+# pulse lengths out by around 5 ms
+BRAIN_PWM_TRIAL_PROFILE = SideProfile("brain_pwm_trial", latency_us=2500, jitter_us=5000,
+                                      granularity_us=5000, pin_cost_us=5)
+
+PROFILES = {"pi": PI_PROFILE, "pico": PICO_PROFILE, "v5": BRAIN_PROFILE}
+NAMED_PROFILES = {profile.name: profile for profile in
+                  (IDEAL_PROFILE, PI_PROFILE, PICO_PROFILE, BRAIN_PROFILE, BRAIN_PWM_TRIAL_PROFILE)}
+
+
+def load_profile(name):
+    """
+    A profile by name, eg "brain", or from a JSON file of SideProfile arguments.
+    """
+    if name.endswith(".json"):
+        with open(name) as profile_file:
+            fields = json.load(profile_file)
+        fields.setdefault("name", Path(name).stem)
+        return SideProfile(**fields)
+    return NAMED_PROFILES[name]
+
+
+class Line:
+    """
+    One wire of the bus. It is high while any side drives it high, and pulled
+    down otherwise. A fault can hold it at a level with `forced`.
+    """
+
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+        self.drivers = {}  # Side -> level it drives
+        self.forced = None
+        self.level = 0
+
+    def drive(self, side, level):
+        self.drivers[side] = level
+        self.update()
+
+    def release(self, side):
+        if self.drivers.pop(side, None) is not None:
+            self.update()
+
+    def force(self, level):
+        """
+        Hold the line at a level whatever the sides drive, None to let go.
+        """
+        self.forced = level
+        self.update()
+
+    def update(self):
+        if self.forced is not None:
+            level = self.forced
+        else:
+            level = 1 if any(self.drivers.values()) else 0
+        if level != self.level:
+            self.level = level
+            self.bus.edge(self, level)
+
+
+class SideTime:
+    """
+    Stand-in for the time module seen by a side's library, on the simulated clock.
+    Has the CPython functions the Raspberry Pi library uses and the
+    MicroPython ticks functions.
+    """
+
+    def __init__(self, side):
+        self.side = side
+
+    def sleep(self, seconds):
+        self.side.sleep_us(seconds * 1e6)
+
+    def sleep_ms(self, ms):
+        self.side.sleep_us(ms * 1000)
+
+    def sleep_us(self, us):
+        self.side.sleep_us(us)
+
+    def ticks_us(self):
+        return self.side.ticks_us()
+
+    def ticks_ms(self):
+        return self.side.ticks_ms()
+
+    def ticks_diff(self, later, earlier):
+        return later - earlier
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def monotonic(self):
+        return self.side.ticks_us() / 1e6
+
+    def monotonic_ns(self):
+        return self.side.ticks_us() * 1000
+
+    def perf_counter(self):
+        return self.side.ticks_us() / 1e6
+
+    def perf_counter_ns(self):
+        return self.side.ticks_us() * 1000
+
+    def time(self):
+        return self.side.ticks_us() / 1e6
+
+    def time_ns(self):
+        return self.side.ticks_us() * 1000
+
+
+class SideThreading:
+    """
+    Stand-in for the threading module seen by the Raspberry Pi library. Its
+    threads run as tasks on the side, and its locks and events wait on the
+    simulated clock, so the send and clock sync threads take turns with the
+    rest of the bus instead of running on the wall clock.
+    """
+
+    def __init__(self, side):
+        self.side = side
+
+    def Thread(self, target=None, args=(), daemon=None):
+        return SideThread(self.side, target, args)
+
+    def Lock(self):
+        return SideLock(self.side)
+
+    def Event(self):
+        return SideEvent(self.side)
+
+
+class SideThread:
+    """
+    A library thread, run as a Task once started.
+    """
+
+    def __init__(self, side, target, args):
+        self.side = side
+        self.target = target
+        self.args = args
+        self.task = None
+
+    def start(self):
+        self.task = self.side.start_task(self.target, *self.args)
+
+    def is_alive(self):
+        return self.task is not None and not self.task.finished
+
+
+class SideLock:
+    """
+    A lock for library threads. Only one task runs at a time, so a taken lock
+    is held by a task that handed over, and waiting lets it run.
+    """
+
+    def __init__(self, side):
+        self.side = side
+        self.held = False
+
+    def acquire(self, blocking=True, timeout=-1):
+        while self.held:
+            if not blocking:
+                return False
+            self.side.sleep_us(WAIT_POLL_US)
+        self.held = True
+        return True
+
+    def release(self):
+        self.held = False
+
+    def locked(self):
+        return self.held
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SideEvent:
+    """
+    An event for library threads, waited on in simulated time.
+    """
+
+    def __init__(self, side):
+        self.side = side
+        self.flag = False
+
+    def set(self):
+        self.flag = True
+
+    def clear(self):
+        self.flag = False
+
+    def is_set(self):
+        return self.flag
+
+    def wait(self, timeout=None):
+        side = self.side
+        end_us = None if timeout is None else side.bus.now_us + timeout * 1e6
+        while not self.flag:
+            if end_us is not None and side.bus.now_us >= end_us:
+                return False
+            side.sleep_us(WAIT_POLL_US if end_us is None else min(WAIT_POLL_US, end_us - side.bus.now_us))
+        return True
+
+
+class Task:
+    """
+    Code running on a side as a thread of its own, eg a vex Thread or the
+    main loop of the other end. Tasks and the main thread take turns on the
+    simulated clock: only one runs at a time, and a task hands over whenever
+    its time moves, at a sleep or a pin access, so a task busy waiting on a
+    pin cannot hold up the rest of the bus.
+    """
+
+    def __init__(self, side, target, args=()):
+        self.side = side
+        self.target = target
+        self.args = args
+        self.resume = threading.Event()
+        self.paused = threading.Event()
+        self.finished = False
+        self.stopped = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        side.bus.tasks[self.thread] = self
+        side.bus.schedule(side.bus.now_us, self.switch, background=True)
+
+    def run(self):
+        self.resume.wait()
+        self.resume.clear()
+        try:
+            if not self.stopped:
+                self.target(*self.args)
+        except TaskStopped:
+            pass
+        except BusStalled as e:
+            self.error = e
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.finished = True
+            del self.side.bus.tasks[self.thread]
+            self.paused.set()
+
+    def switch(self):
+        """
+        Let the task run until it next hands over.
+        """
+        if self.finished:
+            return
+        self.resume.set()
+        self.paused.wait()
+        self.paused.clear()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def sleep_until(self, at_us):
+        """
+        Hand over until a time, called on the task's own thread. When nothing
+        else is due by then the clock is just moved on, without a switch.
+        """
+        bus = self.side.bus
+        if at_us <= bus.until_us and (not bus.queue or at_us < bus.queue[0][0]):
+            if at_us > bus.now_us:
+                bus.now_us = at_us
+            bus.check_deadline()
+            if self.stopped:
+                raise TaskStopped()
+            return
+        bus.schedule(at_us, self.switch, background=True)
+        self.paused.set()
+        self.resume.wait()
+        self.resume.clear()
+        if self.stopped:
+            raise TaskStopped()
+
+    def stop(self):
+        self.stopped = True
+
+
+class Side:
+    """
+    One end of the bus: its pins, interrupt handlers, clock and library.
+
+    Interrupt handlers of one side never nest. An edge due while a handler
+    is running waits until it returns, like the queued soft interrupts on
+    the Pico and the single callback thread of RPi.GPIO.
+    """
+
+    def __init__(self, bus, name, platform, profile):
+        self.bus = bus
+        self.name = name
+        self.platform = platform
+        self.profile = profile
+        self.time = SideTime(self)
+        self.pins = {}  # Pin id -> line name
+        self.outputs = set()  # Pin ids this side drives
+        self.handlers = {}  # (line name, level) -> handler
+        self.last_dispatch_us = 0
+        self.in_handler = False
+        self.waiting = deque()  # Handlers due while another was running
+        self.dispatched = 0
+        self.shims = None
+        self.library = None
+        self.comm = None
+
+    def __repr__(self):
+        return f"Side({self.name!r}, {self.platform!r})"
+
+    # Pins, used by the shims
+
+    def wire(self, **pins):
+        """
+        Connect pin ids to bus lines, eg wire(cs=21, clock=22, data=23).
+        """
+        for line, pin in pins.items():
+            self.pins[pin] = line
+
+    def line(self, pin):
+        return self.bus.lines[self.pins[pin]]
+
+    def setup(self, pin, output, level=0):
+        self.spend(self.profile.pin_cost_us)
+        if output:
+            self.outputs.add(pin)
+            self.line(pin).drive(self, 1 if level else 0)
+        else:
+            self.outputs.discard(pin)
+            self.line(pin).release(self)
+
+    def write(self, pin, level):
+        self.spend(self.profile.pin_cost_us)
+        if pin in self.outputs:
+            self.line(pin).drive(self, 1 if level else 0)
+
+    def read(self, pin):
+        self.spend(self.profile.pin_cost_us)
+        return self.line(pin).level
+
+    def watch(self, pin, level, handler):
+        """
+        Call handler on rising (level 1) or falling (level 0) edges of a pin.
+        """
+        self.handlers[(self.pins[pin], level)] = handler
+
+    def watching(self, pin):
+        line = self.pins[pin]
+        return (line, 0) in self.handlers or (line, 1) in self.handlers
+
+    def unwatch(self, pin):
+        line = self.pins[pin]
+        self.handlers.pop((line, 0), None)
+        self.handlers.pop((line, 1), None)
+
+    def reset(self):
+        """
+        Release every pin and forget every handler, eg GPIO.cleanup().
+        """
+        for pin in list(self.outputs):
+            self.line(pin).release(self)
+        self.outputs.clear()
+        self.handlers.clear()
+
+    # Interrupts
+
+    def edge(self, line, level):
+        handler = self.handlers.get((line.name, level))
+        if handler is None:
+            return
+        if any(self.pins.get(pin) == line.name for pin in self.outputs):
+            return  # Edges this side drives itself are not interrupts
+
+        at = self.bus.now_us + self.profile.latency_us + self.jitter()
+        at = max(at, self.last_dispatch_us)  # Edges are handled in order
+        self.last_dispatch_us = at
+        self.bus.schedule(at, lambda: self.dispatch(handler))
+
+    def dispatch(self, handler):
+        if self.in_handler:
+            self.waiting.append(handler)
+            return
+        self.in_handler = True
+        try:
+            self.dispatched += 1
+            handler()
+            while self.waiting:
+                self.dispatched += 1
+                self.waiting.popleft()()
+        finally:
+            self.in_handler = False
+
+    # Time
+
+    def jitter(self):
+        return self.bus.random.uniform(0, self.profile.jitter_us) if self.profile.jitter_us else 0
+
+    def advance_to(self, at_us):
+        """
+        Move this side's time on: a task hands over, the main thread runs the bus.
+        """
+        task = self.bus.tasks.get(threading.current_thread())
+        if task is None:
+            self.bus.run_until(at_us)
+        else:
+            task.sleep_until(at_us)
+
+    def spend(self, us):
+        if us:
+            self.advance_to(self.bus.now_us + us)
+
+    def sleep_us(self, us):
+        target = self.bus.now_us + us + self.jitter()
+        granularity = self.profile.granularity_us
+        if granularity > 1:
+            target = math.ceil(target / granularity) * granularity
+        self.advance_to(target)
+
+    def start_task(self, target, *args):
+        """
+        Run target(*args) as a task on this side, see Task.
+        """
+        return Task(self, target, args)
+
+    def ticks_us(self):
+        return int(self.bus.now_us)
+
+    def ticks_ms(self):
+        """
+        Coarse timer in ms, at the side's granularity.
+        """
+        granularity = max(self.profile.granularity_us, 1000)
+        return int(self.bus.now_us // granularity * granularity) // 1000
+
+    # Libraries
+
+    def shim_modules(self):
+        """
+        Shim modules bound to this side, by the name the library imports.
+        They are loaded once per side, so pin objects stay the same.
+        """
+        if self.shims is None:
+            self.shims = self.load_shims()
+        return self.shims
+
+    def load_shims(self):
+        if self.platform == "pi":
+            gpio = load_shim("RPi.GPIO", SHIMS / "RPi" / "GPIO.py", self)
+            package = types.ModuleType("RPi")
+            package.__path__ = []
+            package.GPIO = gpio
+            return {"RPi": package, "RPi.GPIO": gpio}
+        if self.platform == "pico":
+            return {"machine": load_shim("machine", SHIMS / "machine.py", self)}
+        return {"vex": load_shim("vex", SHIMS / "vex.py", self)}
+
+    def load_library(self):
+        """
+        Load a fresh copy of this side's library against its shims and clock.
+        Only the library part of V5_Brain_Code/main.py is loaded, not the example loop.
+        """
+        path = LIBRARIES[self.platform]
+        source = path.read_text()
+        if self.platform == "v5":
+            source = source[:source.index(V5_EXAMPLE_MARKER)]
+
+        module = types.ModuleType(f"v5_link_{self.name}")
+        module.__file__ = str(path)
+        shims = self.shim_modules()
+        saved = {name: sys.modules.get(name) for name in shims}
+        sys.modules.update(shims)
+        try:
+            exec(compile(source, str(path), "exec"), module.__dict__)
+        finally:
+            for name, previous in saved.items():
+                if previous is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = previous
+
+        module.time = self.time
+        if self.platform == "pi":
+            # The library's threads run as tasks on this side, see SideThreading.
+            # The log is drained by drain_logs instead of a thread of its own,
+            # so what it prints lines up with the end of each settle
+            module.threading = SideThreading(self)
+            module.LinkLog.start = lambda log, interval=0.05: None
+        self.library = module
+        return module
+
+    def default_pins(self):
+        """
+        The constructor's pin arguments and the wiring of the example code.
+        """
+        if self.platform == "pi":
+            return dict(cs_pin=21, clock_pin=22, data_pin=23), dict(cs=21, clock=22, data=23)
+        if self.platform == "pico":
+            return dict(cs_pin_number=20, clock_pin_number=19, data_pin_number=18), dict(cs=20, clock=19, data=18)
+        ports = self.shim_modules()["vex"].PORTS
+        return (dict(cs_pin_number=ports["c"], clock_pin_number=ports["a"], data_pin_number=ports["b"]),
+                dict(cs=ports["c"], clock=ports["a"], data=ports["b"]))
+
+    def create_comm(self, **kwargs):
+        """
+        Create this side's V5ExternalComm on the example code's pins. Keyword
+        arguments go to the constructor, the log level defaults to LOG_WARNING.
+        """
+        if self.library is None:
+            self.load_library()
+        pins, wiring = self.default_pins()
+        self.wire(**wiring)
+        kwargs.setdefault("log_level", self.library.LOG_WARNING)
+        self.comm = self.library.V5ExternalComm(**pins, **kwargs)
+        return self.comm
+
+    def sending(self):
+        """
+        True while the library has frames queued or going out, eg replies
+        waiting for the Raspberry Pi library's send thread.
+        """
+        comm = self.comm
+        return comm is not None and bool(getattr(comm, "outbox", None) or getattr(comm, "sending", False))
+
+    def drain_logs(self):
+        if self.comm is not None:
+            self.comm.log.drain()
+
+
+class VirtualBus:
+    """
+    Three lines, the sides attached to them and a simulated clock in us.
+
+    Parameters:
+    - seed (int): Seed for the jitter, so every run is repeatable.
+    """
+
+    def __init__(self, seed=0):
+        self.now_us = 0.0
+        self.queue = []  # (time, sequence, action)
+        self.sequence = 0
+        self.random = random.Random(seed)
+        self.lines = {name: Line(self, name) for name in LINES}
+        self.sides = []
+        self.edges = 0
+        self.deadline_us = None  # BusStalled is raised past this time
+        self.until_us = 0  # Time the innermost run_until is running to
+        self.foreground = 0  # Queued actions that settle waits for
+        self.tasks = {}  # Thread -> Task
+        self.taps = []  # Called with (line, level) on every edge, a tap returning True hides the edge from the sides
+
+    def attach(self, name, platform, profile=None):
+        """
+        Add a side running "pi", "pico" or "v5", with the platform's profile by default.
+        """
+        side = Side(self, name, platform, profile or PROFILES[platform])
+        self.sides.append(side)
+        return side
+
+    def edge(self, line, level):
+        self.edges += 1
+        for tap in self.taps:
+            if tap(line, level):
+                return  # Swallowed, eg a missed interrupt
+        for side in self.sides:
+            side.edge(line, level)
+
+    def schedule(self, at_us, action, background=False):
+        """
+        Run action at a time. Background actions, such as waking tasks, are
+        not waited for by settle.
+        """
+        self.sequence += 1
+        heapq.heappush(self.queue, (at_us, self.sequence, background, action))
+        if not background:
+            self.foreground += 1
+
+    def run_until(self, until_us):
+        """
+        Run everything due up to a time and move the clock there. Safe to call
+        from inside a handler, eg when it sends a reply.
+        """
+        queue = self.queue
+        outer_until_us, self.until_us = self.until_us, until_us
+        try:
+            while queue and queue[0][0] <= until_us:
+                at, _, background, action = heapq.heappop(queue)
+                if not background:
+                    self.foreground -= 1
+                if at > self.now_us:
+                    self.now_us = at
+                self.check_deadline()
+                action()
+        finally:
+            self.until_us = outer_until_us
+        if until_us > self.now_us:
+            self.now_us = until_us
+        self.check_deadline()
+
+    def run_for(self, us):
+        self.run_until(self.now_us + us)
+
+    def settle(self, limit_us=10000000):
+        """
+        Run until nothing but background actions is left and no side has frames
+        waiting to be sent, or limit_us has passed.
+        """
+        end = self.now_us + limit_us
+        while (self.foreground or any(side.sending() for side in self.sides)) and self.queue and self.queue[0][0] <= end:
+            self.run_until(self.queue[0][0])
+        for side in self.sides:
+            side.drain_logs()
+
+    def check_deadline(self):
+        if self.deadline_us is not None and self.now_us > self.deadline_us:
+            self.deadline_us = None
+            raise BusStalled(f"Simulated time passed the deadline at {self.now_us:.0f} us")
+
+
+def load_shim(name, path, side):
+    """
+    Load a fresh copy of a shim module, with `side` as a global.
+    """
+    module = types.ModuleType(name)
+    module.__file__ = str(path)
+    module.side = side
+    exec(compile(path.read_text(), str(path), "exec"), module.__dict__)
+    return module
@@ -1,17 +1,1695 @@
 # Import necessary modules
 from vex import *
+import struct
 import time
 
 # Initialize the brain
 brain = Brain()
 
+# Frame kinds. A payload starting with a printable ASCII character is a plain
+# string message, a first byte below 0x20 marks one of the binary frame kinds.
+FRAME_TEXT = 0x00  # Not sent, used as the kind of plain string messages
+FRAME_TYPED = 0x01  # [FRAME_TYPED][type id][struct packed values]
+FRAME_BYTES = 0x02  # [FRAME_BYTES][raw bytes]
+FRAME_KEYFRAME = 0x03  # [FRAME_KEYFRAME][channel][sequence][zigzag varint values]
+FRAME_DELTA = 0x04  # [FRAME_DELTA][channel][sequence][zigzag varint changes]
+FRAME_RESYNC = 0x05  # [FRAME_RESYNC][channel], asks the sender for a keyframe
+
+FRAME_STATE = 0x06  # [FRAME_STATE]([key length][key][value tag][value])...
+
+FRAME_REQUEST = 0x07  # [FRAME_REQUEST][call id][method length][method][tagged values]
+FRAME_RESPONSE = 0x08  # [FRAME_RESPONSE][call id][status][tagged values]
+
+RPC_OK = 0
+RPC_FAILED = 1  # The values hold the error text
+RPC_UNKNOWN_METHOD = 2
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BIT_PERIOD_BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+STAGE_BUCKETS_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+# Stages timed by StageProfiler
+STAGE_CS_WAIT = "cs_wait"  # Waiting for the other end to release CS before sending
+STAGE_ENCODE = "encode"  # Checksum and bit encoding of the payload
+STAGE_CLOCKING = "clocking"  # Toggling the clock and data pins
+STAGE_PROCESS = "process"  # Decoding and checking a received frame
+STAGE_CALLBACK = "callback"  # dispatch_payload and the callbacks it runs
+PROFILE_STAGES = (STAGE_CS_WAIT, STAGE_ENCODE, STAGE_CLOCKING, STAGE_PROCESS, STAGE_CALLBACK)
+
+# Interrupt handlers timed by IsrMonitor
+ISR_CLOCK = 0
+ISR_CS = 1
+ISR_NAMES = ("clock", "cs")
+ISR_BUCKETS_US = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Signals recorded by EdgeTracer
+SIGNAL_CS = 0
+SIGNAL_CLOCK = 1
+SIGNAL_DATA = 2
+TRACE_SIGNALS = ("cs", "clock", "data")
+
+# Log levels, see LinkLog
+LOG_DEBUG = 10  # Full frame dumps
+LOG_INFO = 20  # Messages sent and received
+LOG_WARNING = 30  # Rejected frames and ERROR replies
+LOG_ERROR = 40
+LOG_LEVEL_NAMES = {LOG_DEBUG: "DEBUG", LOG_INFO: "INFO", LOG_WARNING: "WARNING", LOG_ERROR: "ERROR"}
+LOG_SIZE = 64  # Records kept waiting to be drained
+
+# Value tags in state and RPC frames
+VALUE_INT = 0  # Zigzag varint
+VALUE_FLOAT = 1  # 32 bit float
+VALUE_TEXT = 2  # [length][utf-8 bytes]
+STATE_FRAME_LENGTH = 30  # Fits the 256 bit receive buffer of the MicroPython and V5 libraries
+
+# Flag bit on the frame kind, set when the rest of the frame is dictionary compressed
+FLAG_COMPRESSED = 0x10
+FRAME_COMPRESSED_TEXT = FRAME_TEXT | FLAG_COMPRESSED  # [0x10][compressed string]
+ESCAPE_BYTE = 0x7F  # Marks a literal byte in dictionary compressed data
+
+MAX_PAYLOAD_LENGTH = 255  # The length is sent in a single byte
+MESSAGE_POOL_SIZE = 2  # Received message objects recycled between frames
+RESYNC_RETRY = 10  # Repeat a resync request after this many dropped deltas
+
+# Bulk transfers, see send_bulk
+FRAME_BULK_START = 0x09  # [FRAME_BULK_START][transfer id][length, 4 bytes][chunk size][window][digest, 4 bytes][name]
+FRAME_BULK_CHUNK = 0x0A  # [FRAME_BULK_CHUNK][transfer id][chunk index, 2 bytes][data]
+FRAME_BULK_ACK = 0x0B  # [FRAME_BULK_ACK][transfer id][chunks received in order, 2 bytes][status]
+BULK_HEADER = ">IBBI"  # Length, chunk size, window and digest in a start frame
+BULK_HEADER_SIZE = 10
+BULK_RECEIVING = 0
+BULK_DONE = 1  # Every chunk arrived and the digest matched
+BULK_DIGEST_MISMATCH = 2  # Every chunk arrived but the digest did not match, the data is dropped
+BULK_REFUSED = 3  # No bulk handler, or too long
+BULK_MISSING = 4  # A chunk was skipped, send again from the count of chunks received
+BULK_STATUS_NAMES = ("receiving", "done", "digest mismatch", "refused", "missing")
+BULK_CHUNK_SIZE = 26  # Fits a chunk frame in the 256 bit receive buffer of the MicroPython and V5 libraries
+BULK_WINDOW = 8  # Chunks sent past the last acknowledged one
+BULK_ACK_TIMEOUT_MS = 1000  # Chunks are sent again from the last acknowledged one after this
+BULK_RETRIES = 5  # Timeouts in a row before a transfer is given up
+BULK_GAP_MS = 2  # Least time between chunks, so the receiver sees each frame end
+BULK_MAX_BYTES = 65536  # Longest transfer accepted
+BULK_KEEP = 2  # Unfinished transfers kept to resume
+
+# Waypoint streams, see WaypointStreamer
+FRAME_WAYPOINT_REQUEST = 0x0C  # [FRAME_WAYPOINT_REQUEST][stream id][first index, 2 bytes][count]
+FRAME_WAYPOINTS = 0x0D  # [FRAME_WAYPOINTS][stream id][first index, 2 bytes][flags][packed waypoints]
+WAYPOINTS_LAST = 0x01  # Flag on the frame holding the final waypoint of a path
+WAYPOINT_HEADER_SIZE = 5
+WAYPOINT_FRAME_LENGTH = 30  # Fits the 256 bit receive buffer of the MicroPython and V5 libraries
+WAYPOINT_REQUEST_TIMEOUT_MS = 500  # A request not answered in this time is made again
+
+# Clock synchronisation, see ClockSync
+FRAME_TIME = 0x0E  # [FRAME_TIME][sequence] asks for the time, answered with [FRAME_TIME][sequence][t2, 4 bytes][t3, 4 bytes]
+FRAME_STAMPED = 0x0F  # [FRAME_STAMPED][sender time, 4 bytes][a payload of any other kind]
+TIME_REQUEST_LENGTH = 2
+TIME_REPLY_LENGTH = 10
+TIME_REPLY = ">BBII"
+STAMP_HEADER = ">BI"
+STAMP_HEADER_SIZE = 5
+CLOCK_MASK = 0xFFFFFFFF  # Link times are microseconds modulo 2**32
+SYNC_INTERVAL_MS = 1000  # Time between exchanges from start_clock_sync
+SYNC_SAMPLES = 8  # Exchanges the least delayed offset is picked from
+SYNC_AGE_PENALTY = 0.00002  # Delay added per microsecond of a sample's age when picking, as NTP's dispersion
+SYNC_DRIFT_POINTS = 16  # Picked offsets the drift is fitted over
+
+FRAME_GAP_US = 2000  # Least time between frames sent, frames sent back to back are lost
+
+
+class MessageSchema:
+    """
+    A precompiled binary layout for one message type.
+
+    Parameters:
+    - type_id (int): One byte identifier sent in front of the packed values.
+    - fmt (str): A `struct` format for the values, eg "hhH". Big endian is used
+        unless the format starts with its own byte order character.
+    - scales (sequence, optional): One scale factor per value for fixed point
+        fields. A value is multiplied by its scale and rounded before packing,
+        and divided by it after unpacking. Use 1 (or None) for raw fields.
+    - callback (callable, optional): Called with the decoded values when a
+        message of this type is received.
+    """
+
+    def __init__(self, type_id, fmt, scales=None, callback=None):
+        if not 0 <= type_id <= 255:
+            raise ValueError("Message type id must fit in one byte")
+
+        if fmt[:1] not in ("<", ">", "!", "=", "@"):
+            fmt = ">" + fmt
+
+        self.type_id = type_id
+        self.fmt = fmt
+        self.size = struct.calcsize(fmt)
+        self.header = bytes((FRAME_TYPED, type_id))
+        self.callback = callback
+
+        # Only the fixed point fields are touched when encoding and decoding
+        self.scaled_fields = []
+        if scales:
+            self.scaled_fields = [(i, scale) for i, scale in enumerate(scales) if scale not in (None, 1)]
+
+    def encode(self, values):
+        """
+        Pack the values into a complete typed frame payload.
+        """
+        if self.scaled_fields:
+            values = list(values)
+            for i, scale in self.scaled_fields:
+                values[i] = int(round(values[i] * scale))
+        return self.header + struct.pack(self.fmt, *values)
+
+    def decode(self, body):
+        """
+        Unpack the bytes following the frame header back into values.
+        """
+        if len(body) != self.size:
+            raise ValueError("Typed message has the wrong length")
+
+        values = struct.unpack(self.fmt, body)
+        if self.scaled_fields:
+            values = list(values)
+            for i, scale in self.scaled_fields:
+                values[i] = values[i] / scale
+            values = tuple(values)
+        return values
+
+
+class MessageRegistry:
+    """
+    Maps one byte type ids to their precompiled message schemas.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register(self, type_id, fmt, scales=None, callback=None):
+        """
+        Register (or replace) the schema for a message type and return it.
+        """
+        schema = MessageSchema(type_id, fmt, scales, callback)
+        self.schemas[type_id] = schema
+        return schema
+
+    def encode(self, type_id, values):
+        """
+        Encode values for a registered type into a frame payload.
+        """
+        schema = self.schemas.get(type_id)
+        if schema is None:
+            raise KeyError("Unknown message type " + str(type_id))
+        return schema.encode(values)
+
+    def decode(self, payload):
+        """
+        Decode a typed frame payload into its schema and values.
+        """
+        schema = self.schemas.get(payload[1])
+        if schema is None:
+            raise KeyError("Unknown message type " + str(payload[1]))
+        return schema, schema.decode(payload[2:])
+
+
+class ReceivedMessage:
+    """
+    A reusable view onto a received frame, handed to `on_bytes_received`.
+
+    `data` is a memoryview onto the receive buffer, so nothing is copied when a
+    frame arrives. The text and struct views are only decoded when asked for.
+    The object is recycled for later frames, copy `bytes(message.data)` to keep it.
+    """
+
+    def __init__(self):
+        self.kind = FRAME_BYTES
+        self.data = memoryview(b"")
+        self._text = None
+
+    def load(self, kind, data):
+        """
+        Point the message at a new frame body.
+        """
+        self.kind = kind
+        self.data = data
+        self._text = None
+        return self
+
+    @property
+    def text(self):
+        """
+        The body decoded as UTF-8, decoded once on first access.
+        """
+        if self._text is None:
+            self._text = bytes(self.data).decode('utf-8')
+        return self._text
+
+    def unpack(self, fmt, offset=0):
+        """
+        Unpack values straight from the receive buffer with a `struct` format.
+        """
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FieldRecord:
+    """
+    A reused record returned by FieldParser when `record=True`, one attribute per field.
+    """
+    pass
+
+
+class FieldParser:
+    """
+    A parser for 'x90,y100' style string payloads, compiled once from a field spec.
+
+    Parameters:
+    - fields (dict): Maps each key to the function converting its value, eg
+        {"x": int, "y": int, "heading": float}.
+    - separator (str, optional): The character between fields, "," by default.
+    - record (bool, optional): Return a reused FieldRecord with one attribute per
+        field instead of a reused dict.
+
+    The same dict (or record) is returned for every payload, its keys are the
+    spec's own strings. Fields missing from a payload are set to None and
+    unknown keys are skipped. A payload holding none of the fields parses to None.
+    """
+
+    def __init__(self, fields, separator=",", record=False):
+        self.separator = separator
+        self.keys = tuple(fields)
+
+        # Candidate fields by first character, longest key first so "xv" is tried before "x"
+        self.candidates = {}
+        for key in self.keys:
+            self.candidates.setdefault(key[0], []).append((key, len(key), fields[key]))
+        for entries in self.candidates.values():
+            entries.sort(key=lambda entry: -entry[1])
+
+        self.blank = {key: None for key in self.keys}
+        self.values = dict(self.blank)
+        self.record = FieldRecord() if record else None
+
+    def parse(self, payload):
+        """
+        Parse a payload in a single pass over its fields, returning None when
+        it holds none of them.
+        Raises ValueError when a known field has a value that does not convert.
+        """
+        values = self.values
+        values.update(self.blank)
+        candidates = self.candidates
+        found = False
+
+        for token in payload.split(self.separator):
+            for key, length, convert in candidates.get(token[:1], ()):
+                if token.startswith(key) and not token[length:length + 1].isalpha():
+                    values[key] = convert(token[length:])
+                    found = True
+                    break
+
+        if not found:
+            return None
+
+        record = self.record
+        if record is None:
+            return values
+        for key in self.keys:
+            setattr(record, key, values[key])
+        return record
+
+
+def elapsed_ms(started):
+    """
+    Milliseconds since a brain.timer.time(MSEC) reading.
+    """
+    return brain.timer.time(MSEC) - started
+
+
+def ticks_us():
+    """
+    Microseconds from the brain's high resolution timer, for timing frames.
+    """
+    return brain.timer.system_high_res()
+
+
+def elapsed_us(started):
+    """
+    Microseconds since a ticks_us() reading.
+    """
+    return ticks_diff_us(ticks_us(), started)
+
+
+def ticks_diff_us(later, earlier):
+    """
+    Microseconds between two ticks_us() readings.
+    """
+    return later - earlier
+
+
+def write_varint(out, value):
+    """
+    Append a signed integer to a bytearray as a zigzag varint.
+    """
+    value = (value << 1) if value >= 0 else ((-value) << 1) - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    """
+    Read a zigzag varint from data at offset. Returns (value, next offset).
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    if value & 1:
+        return -((value + 1) >> 1), offset
+    return value >> 1, offset
+
+
+def write_value(out, value):
+    """
+    Append an int, float (as 32 bits) or string to a bytearray, after its value tag.
+    """
+    if isinstance(value, float):
+        out.append(VALUE_FLOAT)
+        out.extend(struct.pack(">f", value))
+    elif isinstance(value, int):
+        out.append(VALUE_INT)
+        write_varint(out, value)
+    else:
+        text = bytes(str(value), 'utf-8')
+        out.append(VALUE_TEXT)
+        out.append(len(text))
+        out.extend(text)
+
+
+def adler32(data, value=1):
+    """
+    Adler-32 checksum of some bytes, the digest of a bulk transfer.
+    """
+    low = value & 0xFFFF
+    high = value >> 16
+    for byte in data:
+        low = (low + byte) % 65521
+        high = (high + low) % 65521
+    return high << 16 | low
+
+
+def read_value(data, offset):
+    """
+    Read a tagged value from data at offset. Returns (value, next offset).
+    """
+    tag = data[offset]
+    offset += 1
+    if tag == VALUE_INT:
+        return read_varint(data, offset)
+    if tag == VALUE_FLOAT:
+        return struct.unpack_from(">f", data, offset)[0], offset + 4
+    length = data[offset]
+    return bytes(data[offset + 1:offset + 1 + length]).decode('utf-8'), offset + 1 + length
+
+
+class DeltaChannel:
+    """
+    Delta codec for one stream of numeric samples, eg encoder counts or odometry.
+
+    Parameters:
+    - channel_id (int): One byte identifier, registered on both ends.
+    - count (int): Number of values in each sample.
+    - scales (sequence, optional): Fixed point scale per value, as for MessageSchema.
+    - keyframe_interval (int, optional): Send a full keyframe after this many deltas.
+    - callback (callable, optional): Called with the decoded values on the receiving end.
+
+    Each sample is sent as zigzag varints of its change from the previous one.
+    A frame that is not rejected with an ERROR moves both ends on to the new
+    reference. The sequence number lets the receiver spot a lost frame, it then
+    drops deltas until the next keyframe and asks the sender for one. A sender
+    that is told about a checksum failure sends a keyframe next.
+    """
+
+    def __init__(self, channel_id, count, scales=None, keyframe_interval=50, callback=None):
+        if not 0 <= channel_id <= 255:
+            raise ValueError("Delta channel id must fit in one byte")
+
+        self.channel_id = channel_id
+        self.count = count
+        self.keyframe_interval = keyframe_interval
+        self.callback = callback
+
+        self.scaled_fields = []
+        if scales:
+            self.scaled_fields = [(i, scale) for i, scale in enumerate(scales) if scale not in (None, 1)]
+
+        # Sending side
+        self.tx_reference = None  # None until a keyframe has been sent
+        self.tx_sequence = 0
+        self.tx_since_keyframe = 0
+
+        # Receiving side
+        self.rx_reference = None  # None while out of sync
+        self.rx_sequence = 0  # Sequence number expected next
+        self.rx_dropped = 0  # Deltas dropped while out of sync
+
+    def force_keyframe(self):
+        """
+        Make the next encoded sample a keyframe.
+        """
+        self.tx_reference = None
+
+    def encode(self, values):
+        """
+        Encode a sample into a keyframe or delta frame payload.
+        """
+        if len(values) != self.count:
+            raise ValueError("Delta channel expects " + str(self.count) + " values")
+
+        values = list(values)
+        for i, scale in self.scaled_fields:
+            values[i] = int(round(values[i] * scale))
+
+        reference = self.tx_reference
+        keyframe = reference is None or self.tx_since_keyframe >= self.keyframe_interval
+
+        out = bytearray((FRAME_KEYFRAME if keyframe else FRAME_DELTA, self.channel_id, self.tx_sequence))
+        if keyframe:
+            for value in values:
+                write_varint(out, value)
+            self.tx_since_keyframe = 0
+        else:
+            for value, previous in zip(values, reference):
+                write_varint(out, value - previous)
+            self.tx_since_keyframe += 1
+
+        self.tx_reference = values
+        self.tx_sequence = (self.tx_sequence + 1) & 0xFF
+        return bytes(out)
+
+    def decode(self, payload):
+        """
+        Decode a keyframe or delta frame payload into the sample values.
+        Returns None when a delta can not be applied until the next keyframe.
+        """
+        kind = payload[0]
+        sequence = payload[2]
+
+        if kind == FRAME_DELTA and (self.rx_reference is None or sequence != self.rx_sequence):
+            self.rx_reference = None
+            self.rx_dropped += 1
+            return None
+
+        values = []
+        offset = 3
+        for _ in range(self.count):
+            value, offset = read_varint(payload, offset)
+            values.append(value)
+
+        if kind == FRAME_DELTA:
+            values = [previous + change for previous, change in zip(self.rx_reference, values)]
+
+        self.rx_reference = values
+        self.rx_sequence = (sequence + 1) & 0xFF
+        self.rx_dropped = 0
+
+        if not self.scaled_fields:
+            return values
+        values = list(values)
+        for i, scale in self.scaled_fields:
+            values[i] = values[i] / scale
+        return values
+
+
+class DictionaryCodec:
+    """
+    Compresses string payloads against a preset dictionary of recurring text,
+    eg "Hello ", "RPI_OUT " or status words. Both ends must use the same
+    dictionary, tools/train_dictionary.py builds one from a message log.
+
+    Parameters:
+    - entries (sequence): Up to 128 strings or bytes, in a fixed order.
+
+    In the compressed form a byte of 0x80 or above stands for dictionary entry
+    (byte - 0x80), ESCAPE_BYTE marks the next byte as a literal, and any other
+    byte is itself. Matching is greedy, longest entry first.
+    """
+
+    def __init__(self, entries):
+        if len(entries) > 128:
+            raise ValueError("A dictionary holds at most 128 entries")
+
+        self.entries = [bytes(entry, 'utf-8') if isinstance(entry, str) else bytes(entry) for entry in entries]
+
+        # Candidate entries by first byte, longest first
+        self.candidates = {}
+        for code, entry in enumerate(self.entries):
+            self.candidates.setdefault(entry[0], []).append((entry, len(entry), 0x80 + code))
+        for matches in self.candidates.values():
+            matches.sort(key=lambda match: -match[1])
+
+    def compress(self, data):
+        """
+        Compress bytes, returns a bytearray.
+        """
+        out = bytearray()
+        candidates = self.candidates
+        i = 0
+        length = len(data)
+        while i < length:
+            byte = data[i]
+            for entry, entry_length, code in candidates.get(byte, ()):
+                if data[i:i + entry_length] == entry:
+                    out.append(code)
+                    i += entry_length
+                    break
+            else:
+                if byte >= ESCAPE_BYTE:
+                    out.append(ESCAPE_BYTE)
+                out.append(byte)
+                i += 1
+        return out
+
+    def decompress(self, data):
+        """
+        Expand compressed bytes, returns a bytearray.
+        """
+        out = bytearray()
+        entries = self.entries
+        i = 0
+        length = len(data)
+        while i < length:
+            byte = data[i]
+            i += 1
+            if byte >= 0x80:
+                out.extend(entries[byte - 0x80])
+            elif byte == ESCAPE_BYTE:
+                out.append(data[i])
+                i += 1
+            else:
+                out.append(byte)
+        return out
+
+
+class StateMirror:
+    """
+    Latest value store for state such as robot pose, target bearing or battery level.
+
+    The sending end calls set(key, value) as often as it likes and
+    V5ExternalComm.flush_state() at its own pace. Only keys whose value changed
+    since the last flush are sent, and a newer value simply replaces one that
+    is still waiting, so the link load follows the rate of change rather than
+    the rate of calls. The receiving end reads get(key), which also gives the
+    age of the value.
+
+    Values can be ints, floats (sent as 32 bit floats) or strings. Changes are
+    packed into frames of up to STATE_FRAME_LENGTH bytes.
+    """
+
+    def __init__(self):
+        self.pending = {}  # Values set since the last flush
+        self.sent = {}  # Values as of the last flush
+        self.values = {}  # Values received from the other end
+        self.stamps = {}  # When each received value arrived, in ms
+
+    def set(self, key, value):
+        """
+        Set the value of a key, to be sent on the next flush if it changed.
+        """
+        self.pending[key] = value
+
+    def get(self, key):
+        """
+        Get a received value. Returns (value, age in ms), or (None, None) for a key never received.
+        """
+        if key not in self.values:
+            return None, None
+        return self.values[key], elapsed_ms(self.stamps[key])
+
+    def encode_changes(self, full=False):
+        """
+        Encode the changed values (every value when full is True) into frame
+        payloads, and mark them as sent.
+        """
+        if full:
+            changes = dict(self.sent)
+            changes.update(self.pending)
+        else:
+            changes = {}
+            for key, value in self.pending.items():
+                if key not in self.sent or self.sent[key] != value:
+                    changes[key] = value
+        self.pending = {}
+
+        frames = []
+        frame = bytearray((FRAME_STATE,))
+        for key, value in changes.items():
+            entry = bytearray()
+            key_bytes = bytes(key, 'utf-8')
+            entry.append(len(key_bytes))
+            entry.extend(key_bytes)
+            write_value(entry, value)
+
+            if len(frame) > 1 and len(frame) + len(entry) > STATE_FRAME_LENGTH:
+                frames.append(bytes(frame))
+                frame = bytearray((FRAME_STATE,))
+            frame.extend(entry)
+            self.sent[key] = value
+
+        if len(frame) > 1:
+            frames.append(bytes(frame))
+        return frames
+
+    def apply(self, payload):
+        """
+        Store the values from a received state frame payload.
+        """
+        now = brain.timer.time(MSEC)
+        offset = 1
+        while offset < len(payload):
+            key_length = payload[offset]
+            key = bytes(payload[offset + 1:offset + 1 + key_length]).decode('utf-8')
+            offset += 1 + key_length
+
+            value, offset = read_value(payload, offset)
+            self.values[key] = value
+            self.stamps[key] = now
+
+
+class LatencyHistogram:
+    """
+    Counts samples, eg latencies in ms, into fixed buckets without allocating.
+
+    Parameters:
+    - bounds (sequence, optional): Upper bound of each bucket, ascending. Samples
+        above the last bound go into one more overflow bucket.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Add one sample.
+        """
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        """
+        Mean of the samples, 0 when there are none.
+        """
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket holding the given percentile, eg 99.
+        Samples in the overflow bucket report the largest sample seen.
+        """
+        if not self.count:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+        Copy the histogram into a dict.
+        """
+        return {
+            "bounds": self.bounds,
+            "buckets": list(self.buckets),
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+    def reset(self):
+        """
+        Clear all samples.
+        """
+        for index in range(len(self.buckets)):
+            self.buckets[index] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class LinkStats:
+    """
+    Link health counters and histograms for one V5ExternalComm. Everything is
+    updated in place, so recording a frame allocates nothing.
+
+    - frames_in, bytes_in: Frames (and their payload bytes) received with a good checksum.
+    - frames_out, bytes_out: Frames (and their payload bytes) sent.
+    - checksum_failures: Frames rejected by the checksum, each answered with an ERROR.
+    - error_resends: Frames sent again because the other end reported an ERROR.
+    - truncated_frames: Frames with fewer bits than their length byte promised.
+    - rejected_frames: Frames with a good checksum that could not be handled, eg of an unknown message type.
+    - frame_latency_ms: Time from CS going high to the payload being handled.
+    - bit_period_us: Average clock period of each received frame.
+    - round_trip_ms: Delay of each clock exchange, see sync_clock.
+    - message_latency_ms: Time from sampling to handling of each stamped message, once the clock is synced.
+    """
+
+    def __init__(self):
+        self.frame_latency_ms = LatencyHistogram()
+        self.bit_period_us = LatencyHistogram(BIT_PERIOD_BUCKETS_US)
+        self.round_trip_ms = LatencyHistogram()
+        self.message_latency_ms = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        """
+        Zero every counter and histogram.
+        """
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.checksum_failures = 0
+        self.error_resends = 0
+        self.truncated_frames = 0
+        self.rejected_frames = 0
+        self.frame_latency_ms.reset()
+        self.bit_period_us.reset()
+        self.round_trip_ms.reset()
+        self.message_latency_ms.reset()
+
+    def snapshot(self):
+        """
+        Copy the current values into a dict.
+        """
+        return {
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "frames_out": self.frames_out,
+            "bytes_out": self.bytes_out,
+            "checksum_failures": self.checksum_failures,
+            "error_resends": self.error_resends,
+            "truncated_frames": self.truncated_frames,
+            "rejected_frames": self.rejected_frames,
+            "frame_latency_ms": self.frame_latency_ms.snapshot(),
+            "bit_period_us": self.bit_period_us.snapshot(),
+            "round_trip_ms": self.round_trip_ms.snapshot(),
+            "message_latency_ms": self.message_latency_ms.snapshot(),
+        }
+
+
+class StageProfiler:
+    """
+    Times the stages of sending and receiving frames into histograms of
+    microseconds, and counts the stages that run past a time budget.
+
+    The library takes a ticks_us() reading where a stage starts and calls
+    record when it ends, so the cost is two timer reads per stage. Only the
+    callback stage has a budget by default, as a slow callback delays
+    every frame after it.
+
+    Parameters:
+    - callback_budget_us (int): Budget for the callback stage.
+    - budgets (dict, optional): Budgets in us for other stages, by stage name.
+    - on_overrun (callable, optional): Called with (stage, elapsed_us) for every overrun.
+    """
+
+    def __init__(self, callback_budget_us=1000, budgets=None, on_overrun=None):
+        self.stages = {stage: LatencyHistogram(STAGE_BUCKETS_US) for stage in PROFILE_STAGES}
+        self.budgets = {STAGE_CALLBACK: callback_budget_us}
+        if budgets:
+            self.budgets.update(budgets)
+        self.overruns = {stage: 0 for stage in PROFILE_STAGES}
+        self.on_overrun = on_overrun
+
+    def record(self, stage, started):
+        """
+        Record a stage that started at a ticks_us() reading. Returns the time
+        now, so the next stage can start from it.
+        """
+        now = ticks_us()
+        elapsed = ticks_diff_us(now, started)
+        self.stages[stage].record(elapsed)
+
+        budget = self.budgets.get(stage)
+        if budget != None and elapsed > budget:
+            self.overruns[stage] += 1
+            if self.on_overrun != None:
+                self.on_overrun(stage, elapsed)
+        return now
+
+    def snapshot(self):
+        """
+        Copy the stage histograms into a dict by stage name, with the total
+        time, budget and overrun count of each stage.
+        """
+        snapshot = {}
+        for stage, histogram in self.stages.items():
+            stage_snapshot = histogram.snapshot()
+            stage_snapshot["total_us"] = histogram.total
+            stage_snapshot["budget_us"] = self.budgets.get(stage)
+            stage_snapshot["overruns"] = self.overruns[stage]
+            snapshot[stage] = stage_snapshot
+        return snapshot
+
+    def reset(self):
+        """
+        Clear all samples and overrun counts.
+        """
+        for stage in PROFILE_STAGES:
+            self.stages[stage].reset()
+            self.overruns[stage] = 0
+
+
+class IsrMonitor:
+    """
+    Times the interrupt handlers from entry to exit, to show how close the
+    link runs to the highest edge rate the handlers can keep up with.
+
+    Pins give no timestamp for the edge itself, so the wait from edge to
+    entry is not measured directly. Instead an entry that starts within
+    `queued_us` of the previous handler's exit is counted as queued: its
+    edge most likely arrived while the previous handler was still running.
+
+    Parameters:
+    - clock_budget_us (int): Budget for one clock edge. Past it, edges from a
+        fast sender start to queue up or be missed.
+    - cs_budget_us (int): Budget for a CS edge, which includes process_buffer
+        and the callbacks on the falling edge.
+    - queued_us (int): Largest gap after the previous exit counted as queued.
+    """
+
+    def __init__(self, clock_budget_us=50, cs_budget_us=5000, queued_us=20):
+        self.durations = [LatencyHistogram(ISR_BUCKETS_US) for _ in ISR_NAMES]
+        self.budgets = [clock_budget_us, cs_budget_us]
+        self.overruns = [0, 0]
+        self.queued = [0, 0]
+        self.queued_us = queued_us
+        self.min_gap_us = [0, 0]  # Shortest time between two entries of each handler
+        self.last_entry = [None, None]
+        self.last_exit = None
+
+    def record(self, handler, entered):
+        """
+        Record one run of a handler, ISR_CLOCK or ISR_CS, that started at a ticks_us() reading.
+        """
+        exited = ticks_us()
+        duration = ticks_diff_us(exited, entered)
+        self.durations[handler].record(duration)
+        if duration > self.budgets[handler]:
+            self.overruns[handler] += 1
+
+        if self.last_exit != None and ticks_diff_us(entered, self.last_exit) <= self.queued_us:
+            self.queued[handler] += 1
+
+        last_entry = self.last_entry[handler]
+        if last_entry != None:
+            gap = ticks_diff_us(entered, last_entry)
+            if gap < self.min_gap_us[handler] or not self.min_gap_us[handler]:
+                self.min_gap_us[handler] = gap
+
+        self.last_entry[handler] = entered
+        self.last_exit = exited
+
+    def snapshot(self):
+        """
+        Copy the timings into a dict by handler name. Each has the duration
+        histogram, the overrun and queued counts, the shortest gap between
+        entries and the edge rate, in Hz, the slowest run could keep up with.
+        """
+        snapshot = {}
+        for handler, name in enumerate(ISR_NAMES):
+            histogram = self.durations[handler]
+            handler_snapshot = histogram.snapshot()
+            handler_snapshot["budget_us"] = self.budgets[handler]
+            handler_snapshot["overruns"] = self.overruns[handler]
+            handler_snapshot["queued"] = self.queued[handler]
+            handler_snapshot["min_gap_us"] = self.min_gap_us[handler]
+            handler_snapshot["ceiling_hz"] = 1000000 // histogram.max if histogram.max else 0
+            snapshot[name] = handler_snapshot
+        return snapshot
+
+    def reset(self):
+        """
+        Clear all timings and counts.
+        """
+        for handler in range(len(ISR_NAMES)):
+            self.durations[handler].reset()
+            self.overruns[handler] = 0
+            self.queued[handler] = 0
+            self.min_gap_us[handler] = 0
+            self.last_entry[handler] = None
+        self.last_exit = None
+
+
+class EdgeTracer:
+    """
+    Opt-in ring buffer of timestamped CS, clock and data edges, see
+    V5ExternalComm.enable_trace. Recording an edge writes into preallocated
+    storage only, so it is safe to leave running inside the pin interrupts.
+
+    Parameters:
+    - size (int, optional): Number of edges kept, older edges are overwritten.
+
+    The receiving side only sees the rising clock edges it is interrupted on,
+    and records the data line as sampled on them.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.times = [0] * size  # ticks_us() of each edge
+        self.edges = bytearray(size)  # (signal << 1) | level of each edge
+        self.index = 0  # Next slot to write
+        self.count = 0  # Edges recorded since the last clear
+
+    def record(self, signal, level):
+        """
+        Record one edge of a signal, SIGNAL_CS, SIGNAL_CLOCK or SIGNAL_DATA.
+        """
+        index = self.index
+        self.times[index] = ticks_us()
+        self.edges[index] = (signal << 1) | level
+        index += 1
+        self.index = index if index < self.size else 0
+        self.count += 1
+
+    def clear(self):
+        """
+        Forget every recorded edge.
+        """
+        self.index = 0
+        self.count = 0
+
+    def events(self):
+        """
+        Copy the ring, oldest edge first, as a list of (time_us, signal, level).
+        The link keeps running while the copy is made.
+        """
+        count = min(self.count, self.size)
+        start = (self.index - count) % self.size
+        events = []
+        for i in range(count):
+            slot = (start + i) % self.size
+            edge = self.edges[slot]
+            events.append((self.times[slot], edge >> 1, edge & 1))
+        return events
+
+    def bit_periods(self):
+        """
+        Periods in us between the rising clock edges of each frame.
+        """
+        periods = []
+        last_rise = None
+        for time_us, signal, level in self.events():
+            if signal == SIGNAL_CS:
+                last_rise = None  # Do not measure across frames
+            elif signal == SIGNAL_CLOCK and level:
+                if last_rise is not None:
+                    periods.append(ticks_diff_us(time_us, last_rise))
+                last_rise = time_us
+        return periods
+
+    def jitter(self):
+        """
+        Bit period statistics from the edges in the ring, in us.
+        """
+        periods = self.bit_periods()
+        if not periods:
+            return {"count": 0, "mean_us": 0, "stdev_us": 0, "min_us": 0, "max_us": 0, "peak_to_peak_us": 0}
+
+        mean = sum(periods) / len(periods)
+        variance = sum((period - mean) ** 2 for period in periods) / len(periods)
+        return {
+            "count": len(periods),
+            "mean_us": mean,
+            "stdev_us": variance ** 0.5,
+            "min_us": min(periods),
+            "max_us": max(periods),
+            "peak_to_peak_us": max(periods) - min(periods),
+        }
+
+    def write_vcd(self, out):
+        """
+        Write the edges in the ring to a file like object as a VCD waveform,
+        for viewing in a waveform viewer such as GTKWave. Times are in us from
+        the oldest edge. When only rising clock edges were recorded, each one
+        is drawn as a 1 us pulse.
+        """
+        events = self.events()
+        codes = ("!", '"', "#")
+
+        out.write("$timescale 1us $end\n$scope module v5_link $end\n")
+        for signal, name in enumerate(TRACE_SIGNALS):
+            out.write("$var wire 1 " + codes[signal] + " " + name + " $end\n")
+        out.write("$upscope $end\n$enddefinitions $end\n")
+        if not events:
+            return
+
+        start = events[0][0]
+        pulse_clock = True
+        for time_us, signal, level in events:
+            if signal == SIGNAL_CLOCK and not level:
+                pulse_clock = False
+                break
+
+        changes = []
+        for time_us, signal, level in events:
+            offset = ticks_diff_us(time_us, start)
+            changes.append((offset, str(level) + codes[signal]))
+            if pulse_clock and signal == SIGNAL_CLOCK:
+                changes.append((offset + 1, "0" + codes[signal]))
+        changes.sort(key=lambda change: change[0])
+
+        last_offset = None
+        for offset, change in changes:
+            if offset != last_offset:
+                out.write("#" + str(offset) + "\n")
+                last_offset = offset
+            out.write(change + "\n")
+
+
+def format_bits(bits):
+    """
+    A sequence of bits as a string of 0s and 1s.
+    """
+    return "".join(map(str, bits))
+
+
+def format_frame_dump(bits):
+    """
+    Describe a received frame bit by bit: the raw bits, the length, each byte
+    in ASCII and binary, and the checksum. Called lazily by LinkLog, so the
+    work is only done for frames logged at LOG_DEBUG.
+
+    Parameters:
+    - bits (list): The bits clocked in between CS going high and low.
+    """
+    lines = ["RECEIVE", "Buffer content (raw): " + format_bits(bits)]
+    if len(bits) < 16:
+        lines.append("Buffer too short to process.")
+        return "\n".join(lines)
+
+    length_bits = format_bits(bits[:8])
+    length = int(length_bits, 2)
+    lines.append(f"Length: {length}\tBinary: {length_bits}")
+    if len(bits) < 8 + length * 8 + 8:
+        lines.append("Insufficient bits for data and checksum.")
+        return "\n".join(lines)
+
+    lines.append("Bytes (ASCII and Binary):")
+    for i in range(length):
+        byte_bits = format_bits(bits[8 + i * 8:16 + i * 8])
+        value = int(byte_bits, 2)
+        lines.append(f"Byte {i + 1}: ASCII '{chr(value) if 32 <= value <= 126 else '.'}' "
+                     f"({value}) Binary {byte_bits}")
+
+    checksum_bits = format_bits(bits[8 + length * 8:16 + length * 8])
+    lines.append(f"Checksum: {int(checksum_bits, 2)}\tBinary: {checksum_bits}")
+    return "\n".join(lines)
+
+
+def format_record(ticks, level, message, args):
+    """
+    Format a LinkLog record as one line: the time in seconds, the level and the message.
+    """
+    if callable(message):
+        text = message(*args)
+    elif args:
+        text = message % args
+    else:
+        text = message
+    return f"[{ticks / 1000:.3f}] {LOG_LEVEL_NAMES.get(level, level)} {text}"
+
+
+class LinkLog:
+    """
+    Leveled log that keeps formatting and printing out of the interrupt handlers.
+
+    A record below the level costs a single comparison. Others are stored
+    unformatted, as the message and its arguments, in a ring of the last
+    `size` records, and are only formatted and written out by drain(),
+    called from a background thread, see start. When the ring is full the oldest record
+    is overwritten and counted as dropped. The message may also be a function,
+    called with the arguments when drained, for output that is costly to
+    build such as format_frame_dump.
+
+    Parameters:
+    - level (int): LOG_DEBUG, LOG_INFO, LOG_WARNING or LOG_ERROR.
+    - size (int): Records kept waiting to be drained.
+    - sink (callable): Called with each formatted line, print by default.
+    """
+
+    def __init__(self, level=LOG_INFO, size=LOG_SIZE, sink=print):
+        self.level = level
+        self.sink = sink
+        self.records = [None] * size
+        self.head = 0  # Index of the oldest record
+        self.count = 0
+        self.dropped = 0
+        self.thread = None
+        self.interval_ms = 0
+
+    def log(self, level, message, *args):
+        """
+        Store a record, when level is at or above the log level.
+        """
+        if level < self.level:
+            return
+        size = len(self.records)
+        if self.count == size:
+            self.head = (self.head + 1) % size  # Overwrite the oldest record
+            self.dropped += 1
+        else:
+            self.count += 1
+        self.records[(self.head + self.count - 1) % size] = (brain.timer.time(MSEC), level, message, args)
+
+    def debug(self, message, *args):
+        self.log(LOG_DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(LOG_INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(LOG_WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(LOG_ERROR, message, *args)
+
+    def drain(self, limit=None):
+        """
+        Format and write out the waiting records, oldest first.
+        Returns the number of records written.
+        """
+        if self.dropped:
+            dropped = self.dropped
+            self.dropped = 0
+            self.sink(f"{dropped} log records dropped")
+
+        written = 0
+        while self.count and (limit == None or written < limit):
+            record = self.records[self.head]
+            self.records[self.head] = None
+            self.head = (self.head + 1) % len(self.records)
+            self.count -= 1
+            self.sink(format_record(*record))
+            written += 1
+        return written
+
+    def start(self, interval_ms=50):
+        """
+        Drain the log from a background thread every `interval_ms` milliseconds.
+        """
+        if self.thread == None:
+            self.interval_ms = interval_ms
+            self.thread = Thread(self.run)
+
+    def run(self):
+        while True:
+            self.drain()
+            wait(self.interval_ms, MSEC)
+
+
+def wrap_signed(value):
+    """
+    A difference of two link times, modulo 2**32, as a signed number.
+    """
+    value &= CLOCK_MASK
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class ClockSync:
+    """
+    Estimates the other end's clock from timed exchanges over the link, NTP
+    style, see V5ExternalComm.sync_clock. Link times are microseconds modulo
+    2**32, from ticks_us() on each end.
+
+    Each exchange gives four times, t1 when the request was sent and t4 when
+    the reply arrived on this end's clock, t2 when the request arrived and t3
+    when the reply was sent on the other end's. Send times are taken just
+    before CS is raised, after any wait for the line, see stamp(), and
+    arrival times when CS went high, so neither the wait nor the length of a
+    frame counts. Then
+
+        offset = ((t2 - t1) + (t3 - t4)) / 2  # Other end's clock minus this end's
+        delay = (t4 - t1) - (t3 - t2)  # Round trip, less the time the other end held the request
+
+    An exchange that waited behind another frame is lopsided, so the offset
+    comes from the exchange with the least delay of the last SYNC_SAMPLES,
+    older exchanges counting as slightly more delayed so newer ones take over.
+    The drift is the slope of a least squares line through those offsets
+    over time, and carries the offset on between exchanges.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.request_sent = None  # t1 of the request awaiting a reply
+        self.samples = []  # (t4, offset, delay) of the latest SYNC_SAMPLES exchanges
+        self.points = []  # (t4, offset) of the least delayed ones, up to SYNC_DRIFT_POINTS
+        self.reference_time = 0  # Link time the estimate is anchored at
+        self.reference_offset = 0  # Offset at reference_time, modulo 2**32
+        self.correction_us = 0.0  # Fitted offset at reference_time, less reference_offset
+        self.drift = 0.0  # Offset change per microsecond
+        self.delay_us = None  # Delay of the exchange the offset comes from
+        self.exchanges = 0
+        self.unanswered = 0  # Requests replaced by a new one before a reply arrived
+
+    def link_time(self, ticks):
+        """
+        Link time of a ticks_us() reading.
+        """
+        return ticks & CLOCK_MASK
+
+    def now(self):
+        return self.link_time(ticks_us())
+
+    def synced(self):
+        return self.exchanges > 0
+
+    def request(self):
+        """
+        The payload of a new request, its send time is taken by stamp().
+        """
+        if self.request_sent is not None:
+            self.unanswered += 1
+        self.sequence = (self.sequence + 1) & 0xFF
+        self.request_sent = None
+        return bytes((FRAME_TIME, self.sequence))
+
+    def reply(self, payload, t2):
+        """
+        The reply to a received request, its send time t3 is filled in by stamp().
+        """
+        return struct.pack(TIME_REPLY, FRAME_TIME, payload[1], t2, 0)
+
+    def stamp(self, payload, now):
+        """
+        Take the send time of a request, or fill it into a reply, called by
+        send_frame just before CS is raised. Returns the payload to send.
+        """
+        if len(payload) == TIME_REQUEST_LENGTH:
+            self.request_sent = now
+            return payload
+        return payload[:TIME_REPLY_LENGTH - 4] + struct.pack(">I", now)
+
+    def add_reply(self, payload, t4):
+        """
+        Take in a reply that arrived at t4. Returns the delay of the exchange in
+        microseconds, or None when the reply was not for the latest request.
+        """
+        _, sequence, t2, t3 = struct.unpack_from(TIME_REPLY, payload)
+        t1 = self.request_sent
+        if t1 is None or sequence != self.sequence:
+            return None
+        self.request_sent = None
+
+        # Both halves as differences that wrap, so only their gap has to be small
+        there = wrap_signed(t2 - t1)
+        offset = (t2 - t1 + wrap_signed(t3 - t4 - there) // 2) & CLOCK_MASK
+        delay = wrap_signed(t4 - t1) - wrap_signed(t3 - t2)
+        self.samples.append((t4, offset, delay))
+        if len(self.samples) > SYNC_SAMPLES:
+            self.samples.pop(0)
+        self.exchanges += 1
+
+        best = min(self.samples, key=lambda sample: sample[2] + wrap_signed(t4 - sample[0]) * SYNC_AGE_PENALTY)
+        if not self.points or self.points[-1][0] != best[0]:
+            self.points.append(best[:2])
+            if len(self.points) > SYNC_DRIFT_POINTS:
+                self.points.pop(0)
+            self.fit()
+        self.delay_us = best[2]
+        return delay
+
+    def fit(self):
+        """
+        Fit the offset and drift to the points, relative to the latest one.
+        """
+        self.reference_time, self.reference_offset = self.points[-1]
+        if len(self.points) < 3:
+            self.correction_us = 0.0
+            self.drift = 0.0
+            return
+        xs = [wrap_signed(time - self.reference_time) for time, _ in self.points]
+        ys = [wrap_signed(offset - self.reference_offset) for _, offset in self.points]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        spread = sum((x - mean_x) ** 2 for x in xs)
+        self.drift = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread if spread else 0.0
+        self.correction_us = mean_y - self.drift * mean_x
+
+    def offset_us(self, local=None):
+        """
+        The other end's clock minus this end's at a link time, now by default, as a signed number.
+        """
+        if local is None:
+            local = self.now()
+        offset = self.correction_us + self.drift * wrap_signed(local - self.reference_time)
+        return wrap_signed(self.reference_offset + round(offset))
+
+    def to_local(self, remote):
+        """
+        This end's link time at the other end's link time remote.
+        """
+        return (remote - self.offset_us()) & CLOCK_MASK
+
+    def to_remote(self, local):
+        """
+        The other end's link time at this end's link time local.
+        """
+        return (local + self.offset_us(local)) & CLOCK_MASK
+
+    def snapshot(self):
+        return {
+            "synced": self.synced(),
+            "offset_us": self.offset_us() if self.synced() else None,
+            "drift_ppm": self.drift * 1e6,
+            "delay_us": self.delay_us,
+            "exchanges": self.exchanges,
+            "unanswered": self.unanswered,
+        }
+
+
+class BulkTransfer:
+    """
+    Progress of a transfer started by V5ExternalComm.send_bulk.
+    """
+
+    def __init__(self, transfer_id, name, data, chunk_size, window):
+        self.transfer_id = transfer_id
+        self.name = name
+        self.data = data
+        self.chunk_size = chunk_size
+        self.window = window
+        self.chunks = (len(data) + chunk_size - 1) // chunk_size
+        self.digest = adler32(data)
+        self.started = brain.timer.time(MSEC)
+        self.acked = 0  # Chunks the receiver has in order
+        self.acks = 0  # Acknowledgements received
+        self.status = None  # Last status the receiver sent, None before the first acknowledgement
+        self.rewind = None  # Chunk to send again from, set by a BULK_MISSING acknowledgement
+        self.chunks_sent = 0
+        self.chunks_resent = 0
+        self.link_ms = 0  # Time spent sending chunks
+        self.elapsed = 0  # Milliseconds from start to finish
+        self.complete = False
+        self.error = None
+
+    def progress(self):
+        """
+        Fraction of the data the receiver has.
+        """
+        return self.acked / self.chunks if self.chunks else float(self.complete)
+
+    def snapshot(self):
+        elapsed = self.elapsed or elapsed_ms(self.started)
+        received = min(self.acked * self.chunk_size, len(self.data))
+        return {
+            "name": self.name,
+            "bytes": len(self.data),
+            "chunks": self.chunks,
+            "acked": self.acked,
+            "progress": self.progress(),
+            "chunks_sent": self.chunks_sent,
+            "chunks_resent": self.chunks_resent,
+            "elapsed_ms": elapsed,
+            "throughput_Bps": received * 1000 / elapsed if elapsed else 0,
+            "link_share": self.link_ms / elapsed if elapsed else 0,
+            "complete": self.complete,
+            "error": self.error,
+        }
+
+    def acknowledge(self, received, status):
+        """
+        Note an acknowledgement from the receiver.
+        """
+        if status == BULK_MISSING:
+            self.rewind = received
+        if received > self.acked:
+            self.acked = received
+        self.status = status
+        self.acks += 1
+
+
+class BulkIncoming:
+    """
+    A transfer being received, kept by its digest so it can be resumed.
+    """
+
+    def __init__(self, name, length, chunk_size, window, digest):
+        self.name = name
+        self.data = bytearray(length)
+        self.chunk_size = chunk_size
+        self.chunks = (length + chunk_size - 1) // chunk_size
+        self.ack_every = max(1, window // 2)
+        self.digest = digest
+        self.received = 0  # Chunks received in order
+        self.missing_sent = False  # A BULK_MISSING acknowledgement was sent for the current gap
+        self.status = BULK_RECEIVING
+
+
+class WaypointStreamer:
+    """
+    A bounded queue of upcoming waypoints, refilled from the other end of the
+    link, see V5ExternalComm.stream_waypoints.
+
+    A background thread requests more waypoints whenever fewer than
+    `low_water` are queued, enough to fill the queue, and requests them again
+    if they do not arrive in WAYPOINT_REQUEST_TIMEOUT_MS. The control loop
+    takes them with next(), which never waits on the link. Asking for a
+    waypoint when the queue is empty before the path has ended is counted as
+    an underrun.
+
+    Parameters:
+    - comm (V5ExternalComm): The link to request waypoints over.
+    - stream_id (int): One byte id shared with serve_waypoints on the other end.
+    - fmt (str): `struct` format of one waypoint, eg "hhh", as in MessageSchema.
+    - scales (sequence, optional): Fixed point scale of each value, as in MessageSchema.
+    - capacity (int): Waypoints queued on the brain, up to 255.
+    - low_water (int): More waypoints are requested below this many.
+    - poll_ms (int): How often the background thread checks the queue.
+    """
+
+    def __init__(self, comm, stream_id, fmt, scales=None, capacity=32, low_water=8, poll_ms=10):
+        if not 0 < low_water <= capacity <= 255:
+            raise ValueError("Need 0 < low_water <= capacity <= 255")
+        self.comm = comm
+        self.stream_id = stream_id
+        self.schema = MessageSchema(stream_id, fmt, scales)
+        self.capacity = capacity
+        self.low_water = low_water
+        self.poll_ms = poll_ms
+
+        self.slots = [None] * capacity
+        self.head = 0  # Slot of the next waypoint to take
+        self.count = 0  # Waypoints queued
+        self.next_index = 0  # Path index of the next waypoint to arrive
+        self.requested_to = 0  # Path index up to which waypoints have been requested
+        self.requested_at = 0  # brain.timer.time(MSEC) of the last request
+        self.ended = False  # The final waypoint has arrived
+        self.running = False
+        self.thread = None
+
+        self.underruns = 0
+        self.requests = 0
+        self.rerequests = 0  # Requests made again after a timeout
+        self.frames = 0
+        self.received = 0
+        self.out_of_order = 0  # Frames dropped because they did not start at next_index
+        self.min_depth = capacity  # Fewest waypoints queued after taking one
+
+    def start(self):
+        """
+        Start requesting waypoints from the background thread.
+        """
+        if self.thread == None:
+            self.running = True
+            self.thread = Thread(self.run)
+
+    def stop(self):
+        self.running = False
+        if self.thread != None:
+            self.thread.stop()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            self.refill()
+            wait(self.poll_ms, MSEC)
+
+    def refill(self):
+        """
+        Request more waypoints when running low, or again when a request went unanswered.
+        """
+        if self.ended:
+            return
+        if self.requested_to > self.next_index:
+            if elapsed_ms(self.requested_at) < WAYPOINT_REQUEST_TIMEOUT_MS:
+                return  # Still on its way
+            self.rerequests += 1
+        elif self.count >= self.low_water:
+            return
+
+        wanted = self.capacity - self.count
+        first = self.next_index
+        self.requested_to = first + wanted
+        self.requests += 1
+        self.comm.send_frame(bytes((FRAME_WAYPOINT_REQUEST, self.stream_id, first >> 8, first & 0xFF, wanted)))
+        self.requested_at = brain.timer.time(MSEC)  # After sending, which can take a while
+
+    def receive(self, payload):
+        """
+        Queue the waypoints of a received frame, called from dispatch_payload.
+        """
+        first = payload[2] << 8 | payload[3]
+        size = self.schema.size
+        offset = WAYPOINT_HEADER_SIZE
+        if first < self.next_index:
+            offset += (self.next_index - first) * size  # Skip waypoints already queued
+        if first > self.next_index or offset >= len(payload):
+            self.out_of_order += 1  # A late reply to a request made again
+            return
+        self.frames += 1
+        self.requested_at = brain.timer.time(MSEC)  # The reply is still coming
+
+        while offset + size <= len(payload) and self.count < self.capacity:
+            self.slots[(self.head + self.count) % self.capacity] = self.schema.decode(payload[offset:offset + size])
+            self.count += 1
+            self.next_index += 1
+            self.received += 1
+            offset += size
+        if payload[4] & WAYPOINTS_LAST and offset + size > len(payload):
+            self.ended = True
+
+    def next(self):
+        """
+        The next waypoint, or None when none is queued.
+        """
+        if self.count == 0:
+            if not self.ended:
+                self.underruns += 1
+            return None
+        values = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        if self.count < self.min_depth:
+            self.min_depth = self.count
+        return values
+
+    def finished(self):
+        """
+        True once the final waypoint has been taken.
+        """
+        return self.ended and self.count == 0
+
+    def snapshot(self):
+        return {
+            "queued": self.count,
+            "next_index": self.next_index,
+            "ended": self.ended,
+            "underruns": self.underruns,
+            "requests": self.requests,
+            "rerequests": self.rerequests,
+            "frames": self.frames,
+            "received": self.received,
+            "out_of_order": self.out_of_order,
+            "min_depth": self.min_depth,
+        }
+
+
+class RpcError(Exception):
+    """
+    Raised by RpcFuture.result() when the remote handler failed.
+    """
+    pass
+
+
+class RpcTimeout(RpcError):
+    """
+    Raised by RpcFuture.result() when no reply arrived in time.
+    """
+    pass
+
+
+class RpcFuture:
+    """
+    The pending result of V5ExternalComm.call().
+    """
+
+    def __init__(self, comm, call_id, method, timeout_ms):
+        self.comm = comm
+        self.call_id = call_id
+        self.method = method
+        self.started = brain.timer.time(MSEC)
+        self.timeout_ms = timeout_ms
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def expired(self):
+        """
+        True once the timeout has passed without a reply.
+        """
+        return not self.done and elapsed_ms(self.started) > self.timeout_ms
+
+    def set_result(self, value, error=None):
+        """
+        Complete the call, called when the reply arrives.
+        """
+        self.value = value
+        self.error = error
+        self.done = True
+
+    def result(self):
+        """
+        Wait for the reply and return the handler's result.
+        Raises RpcTimeout if the timeout passes first, RpcError if the handler failed.
+        """
+        while not self.done and not self.expired():
+            time.sleep_us(1000)  # Replies arrive through the pin interrupts
+        if not self.done:
+            self.comm.expire_call(self)
+        if not self.done:
+            raise RpcTimeout("RPC call " + self.method + " timed out")
+        if self.error is not None:
+            raise RpcError(self.error)
+        return self.value
+
+
 class V5ExternalComm:
     """
     This class facilitates communication with an external device using clock, data, 
     and chip select (CS) pins. It also includes LED indication and payload processing.
     """
 
-    def __init__(self, cs_pin_number, clock_pin_number, data_pin_number, on_message_received=None):
+    def __init__(self, cs_pin_number, clock_pin_number, data_pin_number, on_message_received=None,
+                 on_typed_message_received=None, message_registry=None, on_bytes_received=None,
+                 on_fields_received=None, fields=None, field_record=False, dictionary=None,
+                 log_level=LOG_INFO):
         """
         Initialize the V5ExternalComm class for communication with an external device.
 
@@ -29,6 +1707,32 @@ class V5ExternalComm:
 
         - on_message_received (callable, optional): A callback function to handle messages when they are successfully received.
             The callback function should accept a single parameter (the received message as a string).
+
+        - on_typed_message_received (callable, optional): Called with (type_id, values) when a typed
+            message arrives whose schema has no callback of its own.
+
+        - message_registry (MessageRegistry, optional): Typed message layouts to share with other
+            instances. A new, empty registry is created when not given.
+
+        - on_bytes_received (callable, optional): Called with a ReceivedMessage for every binary
+            frame, and for string messages too when on_message_received is not set.
+
+        - on_fields_received (callable, optional): Called with the parsed fields of every string
+            message, see FieldParser. Requires `fields`.
+
+        - fields (dict, optional): Field spec for 'x90,y100' style string messages, eg
+            {"x": int, "y": int}. It is compiled into a FieldParser once, here.
+
+        - field_record (bool, optional): Hand the parsed fields to on_fields_received as a
+            reused FieldRecord with one attribute per field, instead of a reused dict.
+
+        - dictionary (sequence, optional): Preset dictionary shared with the other end. String
+            messages are compressed against it whenever that makes them shorter.
+
+        - log_level (int, optional): Level of the link's LinkLog, LOG_DEBUG for full frame
+            dumps or LOG_WARNING to only log rejected frames. A background thread prints them.
+
+        Delta encoded telemetry channels are added with register_delta_channel.
         """
 
         # Store the pin numbers provided by the user for later use
@@ -39,9 +1743,81 @@ class V5ExternalComm:
         # Callback function for message handling
         self.on_message_received = on_message_received
 
+        # Typed message layouts and the fallback callback for them
+        self.on_typed_message_received = on_typed_message_received
+        self.message_registry = message_registry if message_registry is not None else MessageRegistry()
+
+        # Binary frames are handed over as recycled message objects
+        self.on_bytes_received = on_bytes_received
+        self.message_pool = [ReceivedMessage() for _ in range(MESSAGE_POOL_SIZE)]
+        self.message_pool_index = 0
+
+        # 'x90,y100' style string messages parsed with a precompiled FieldParser
+        self.on_fields_received = on_fields_received
+        self.field_parser = FieldParser(fields, record=field_record) if fields else None
+
+        # Delta encoded telemetry channels by channel id
+        self.delta_channels = {}
+
+        # String messages are compressed against this preset dictionary when it helps
+        self.dictionary_codec = DictionaryCodec(dictionary) if dictionary else None
+
+        # Latest value state shared with the other end, see flush_state
+        self.state = StateMirror()
+
+        # RPC: handlers served to the other end, calls waiting for a reply and
+        # the reply latency of each method called
+        self.rpc_handlers = {}
+        self.pending_calls = {}
+        self.next_call_id = 0
+        self.rpc_latency = {}
+        self.rpc_timeouts = {}
+
+        # Bulk transfers: the handler for received ones, those being received
+        # by transfer id and by digest, to resume, and those being sent
+        self.bulk_handler = None
+        self.bulk_receiving = {}
+        self.bulk_partial = {}
+        self.bulk_sending = {}
+        self.next_bulk_id = 0
+
+        # Waypoint streams by stream id, see stream_waypoints
+        self.waypoint_streams = {}
+
+        # Link health, see snapshot_stats
+        self.stats = LinkStats()
+        self.frame_started = 0  # ticks_us() when CS last went high
+
+        # Frames waiting to go out, see send_frame. Only the thread that set
+        # sending clocks frames out, so threads never interleave on the pins
+        self.outbox = []
+        self.sending = False
+        self.frame_ended = 0  # ticks_us() when CS last went low after sending
+
+        # Estimate of the other end's clock, see sync_clock, and while the callback for
+        # a stamped message runs, when it was sent on this end's clock and how long ago
+        self.clock = ClockSync()
+        self.clock_thread = None
+        self.message_sent_us = None
+        self.message_latency_us = None
+
+        # Edge trace ring, None until enable_trace is called
+        self.tracer = None
+
+        # Stage timing, None until enable_profiling is called
+        self.profiler = None
+
+        # Interrupt handler timing, None until enable_isr_monitor is called
+        self.isr_monitor = None
+
+        # Log records are kept out of the interrupt handlers until drained
+        self.log = LinkLog(log_level)
+        self.log.start()
+
         # Initialize state variables
         self.buffer = []  # Buffer for storing received bits during communication
-        self.last_message = ""  # Keeps track of the last valid message sent or received
+        self.rx_bytes = bytearray(MAX_PAYLOAD_LENGTH)  # Decoded payload, reused for every frame
+        self.last_message = b""  # Keeps track of the last valid message sent or received
 
         # Initialize pin objects for CS, Clock, and Data signals.
         self.cs_pin = DigitalIn(self.cs_pin_number)
@@ -54,15 +1830,18 @@ class V5ExternalComm:
 
         # Flag to indicate the current mode (True = receiving, False = sending)
         self.reciving = False
+        self.cs_active = False  # From CS going high until the end of the frame is handled
 
         # Set the pins to "receive mode" by default.
         self.set_pins_receive()
 
     def calculate_checksum(self, data):
         """
-        Calculate the checksum of the input string.
+        Calculate the checksum of the input string or bytes.
         """
-        return sum(bytearray(data, 'ascii')) % 256
+        if isinstance(data, str):
+            data = bytearray(data, 'utf-8')
+        return sum(data) % 256
 
     def int_to_bits(self, value, bit_count):
         """
@@ -75,46 +1854,594 @@ class V5ExternalComm:
         Encode the length, data, and checksum into a single bit stream.
         """
         bits = self.int_to_bits(length, 8)  # Encode length (8 bits)
-        for char in data:
-            bits.extend(self.int_to_bits(ord(char), 8))  # Encode each character (8 bits per char)
+        for byte in data:
+            bits.extend(self.int_to_bits(byte, 8))  # Encode each byte (8 bits per byte)
         bits.extend(self.int_to_bits(checksum, 8))  # Encode checksum (8 bits)
         return bits
 
+    def register_message(self, type_id, fmt, scales=None, callback=None):
+        """
+        Register a typed message layout, see MessageSchema for the parameters.
+        Both ends of the link must register the same layouts.
+        """
+        return self.message_registry.register(type_id, fmt, scales, callback)
+
+    def send_message(self, type_id, values):
+        """
+        Send a typed message, packing the values with the registered schema.
+        """
+        self.send_frame(self.message_registry.encode(type_id, values))
+
+    def register_delta_channel(self, channel_id, count, scales=None, keyframe_interval=50, callback=None):
+        """
+        Register a delta encoded telemetry channel, see DeltaChannel for the parameters.
+        Both ends of the link must register the same channels.
+        """
+        channel = DeltaChannel(channel_id, count, scales, keyframe_interval, callback)
+        self.delta_channels[channel_id] = channel
+        return channel
+
+    def snapshot_stats(self, reset=False):
+        """
+        Copy the link statistics, plus the current queue depths, into a dict.
+        With reset=True the statistics are zeroed afterwards.
+        """
+        snapshot = self.stats.snapshot()
+        snapshot["pending_calls"] = len(self.pending_calls)
+        snapshot["pending_state"] = len(self.state.pending)
+        if reset:
+            self.stats.reset()
+        return snapshot
+
+    def enable_trace(self, size=1024):
+        """
+        Start recording CS, clock and data edges into a ring of the given size.
+        Returns the EdgeTracer, which can export VCD and jitter statistics.
+        """
+        self.tracer = EdgeTracer(size)
+        return self.tracer
+
+    def disable_trace(self):
+        """
+        Stop recording edges.
+        """
+        self.tracer = None
+
+    def enable_profiling(self, callback_budget_us=1000, budgets=None):
+        """
+        Start timing each stage of sending and receiving frames. Stages that
+        overrun their budget are counted and logged as warnings.
+        Returns the StageProfiler, see StageProfiler.snapshot.
+        """
+        self.profiler = StageProfiler(callback_budget_us, budgets, self.log_overrun)
+        return self.profiler
+
+    def disable_profiling(self):
+        """
+        Stop timing stages.
+        """
+        self.profiler = None
+
+    def enable_isr_monitor(self, clock_budget_us=50, cs_budget_us=5000):
+        """
+        Start timing the clock and CS interrupt handlers.
+        Returns the IsrMonitor, see IsrMonitor.snapshot.
+        """
+        self.isr_monitor = IsrMonitor(clock_budget_us, cs_budget_us)
+        return self.isr_monitor
+
+    def disable_isr_monitor(self):
+        """
+        Stop timing the interrupt handlers.
+        """
+        self.isr_monitor = None
+
+    def log_overrun(self, stage, elapsed_us):
+        """
+        Log a stage that overran its budget, see enable_profiling.
+        """
+        self.log.warning("%s stage took %s us, over its %s us budget",
+                         stage, elapsed_us, self.profiler.budgets[stage])
+
+    def register_handler(self, method, handler):
+        """
+        Serve RPC calls to a method name. The handler is called with the call's
+        arguments and may return None, one value or a tuple of values.
+        """
+        self.rpc_handlers[method] = handler
+
+    def call(self, method, args=(), timeout_ms=1000):
+        """
+        Call a method registered on the other end and return an RpcFuture for the result.
+        Several calls can be in flight at once, replies are matched by their call id.
+        """
+        # Free the ids of calls that timed out
+        for call_id in [call_id for call_id, future in self.pending_calls.items() if future.expired()]:
+            self.expire_call(self.pending_calls[call_id])
+
+        call_id = self.next_call_id
+        while call_id in self.pending_calls:
+            call_id = (call_id + 1) & 0xFF
+            if call_id == self.next_call_id:
+                raise RpcError("Too many RPC calls in flight")
+        self.next_call_id = (call_id + 1) & 0xFF
+
+        method_bytes = bytes(method, 'utf-8')
+        payload = bytearray((FRAME_REQUEST, call_id, len(method_bytes)))
+        payload.extend(method_bytes)
+        for value in args:
+            write_value(payload, value)
+
+        future = RpcFuture(self, call_id, method, timeout_ms)
+        self.pending_calls[call_id] = future
+        self.send_frame(bytes(payload))
+        return future
+
+    def expire_call(self, future):
+        """
+        Forget a call that timed out, a late reply to it is ignored.
+        """
+        if self.pending_calls.get(future.call_id) is future:
+            del self.pending_calls[future.call_id]
+            self.rpc_timeouts[future.method] = self.rpc_timeouts.get(future.method, 0) + 1
+
+    def handle_request(self, payload):
+        """
+        Run the handler for a received call and send back its result.
+        """
+        call_id = payload[1]
+        method_length = payload[2]
+        method = bytes(payload[3:3 + method_length]).decode('utf-8')
+
+        args = []
+        offset = 3 + method_length
+        while offset < len(payload):
+            value, offset = read_value(payload, offset)
+            args.append(value)
+
+        reply = bytearray((FRAME_RESPONSE, call_id, RPC_OK))
+        handler = self.rpc_handlers.get(method)
+        if handler is None:
+            reply[2] = RPC_UNKNOWN_METHOD
+            write_value(reply, "Unknown method " + method)
+        else:
+            try:
+                result = handler(*args)
+            except Exception as e:
+                reply[2] = RPC_FAILED
+                write_value(reply, str(e))
+            else:
+                if result is not None:
+                    for value in (result if isinstance(result, tuple) else (result,)):
+                        write_value(reply, value)
+
+        self.send_frame(bytes(reply))
+
+    def handle_response(self, payload):
+        """
+        Complete the pending call a reply belongs to.
+        """
+        future = self.pending_calls.pop(payload[1], None)
+        if future is None:
+            return  # Timed out already, or not ours
+
+        values = []
+        offset = 3
+        while offset < len(payload):
+            value, offset = read_value(payload, offset)
+            values.append(value)
+
+        histogram = self.rpc_latency.get(future.method)
+        if histogram is None:
+            histogram = self.rpc_latency[future.method] = LatencyHistogram()
+        histogram.record(elapsed_ms(future.started))
+
+        if payload[2] != RPC_OK:
+            future.set_result(None, values[0] if values else "RPC call failed")
+        elif not values:
+            future.set_result(None)
+        else:
+            future.set_result(values[0] if len(values) == 1 else tuple(values))
+
+    def register_bulk_handler(self, handler):
+        """
+        Accept bulk transfers from the other end. The handler is called with
+        (name, data) once all of a transfer has arrived and its digest matches.
+        """
+        self.bulk_handler = handler
+
+    def send_bulk(self, data, name="", chunk_size=BULK_CHUNK_SIZE, window=BULK_WINDOW, share=0.5, on_progress=None):
+        """
+        Send a block of data, eg a path plan or a log dump, in numbered chunks.
+
+        Up to `window` chunks are sent past the last one the receiver acknowledged,
+        so the link is not left idle waiting for every acknowledgement. After a
+        lost chunk, or no acknowledgement for BULK_ACK_TIMEOUT_MS, chunks are sent
+        again from the last acknowledged one. The receiver checks an Adler-32
+        digest of the whole block. Sending stops after every chunk for long
+        enough that bulk chunks take at most `share` (above 0, up to 1) of the link time, leaving
+        the rest to other messages. on_progress is called with the BulkTransfer
+        whenever an acknowledgement moves it on.
+
+        chunk_size may be up to 251 when the receiver is a Raspberry Pi, chunks
+        over 26 bytes are too long for the MicroPython and V5 libraries.
+
+        Returns the BulkTransfer, check its `complete` and `error`. A transfer that
+        gives up can be resumed by calling send_bulk again with the same data,
+        the receiver keeps the chunks it has and sending starts after them.
+        """
+        if not 0 < share <= 1:
+            raise ValueError("Share must be above 0 and at most 1, not " + str(share))
+        if not 0 < chunk_size <= MAX_PAYLOAD_LENGTH - 4:
+            raise ValueError("Chunk size must be from 1 to " + str(MAX_PAYLOAD_LENGTH - 4))
+        if len(data) > 0xFFFF * chunk_size:
+            raise ValueError("Too much data for 65535 chunks of " + str(chunk_size) + " bytes")
+
+        transfer_id = self.next_bulk_id
+        self.next_bulk_id = (transfer_id + 1) & 0xFF
+        transfer = BulkTransfer(transfer_id, name, data, chunk_size, window)
+        self.bulk_sending[transfer_id] = transfer
+
+        start = bytearray((FRAME_BULK_START, transfer_id))
+        start.extend(struct.pack(BULK_HEADER, len(data), chunk_size, window, transfer.digest))
+        start.extend(bytes(name, 'utf-8'))
+        try:
+            self.run_bulk(transfer, bytes(start), share, on_progress)
+        finally:
+            del self.bulk_sending[transfer_id]
+            transfer.elapsed = elapsed_ms(transfer.started)
+        return transfer
+
+    def run_bulk(self, transfer, start, share, on_progress):
+        """
+        Send the chunks of a transfer until the receiver reports it finished, see send_bulk.
+        """
+        retries = 0
+        next_chunk = None  # Set once the start is acknowledged, with the chunks the receiver already has
+        acks = 0
+        while retries <= BULK_RETRIES:
+            if next_chunk is None:
+                self.send_frame(start)
+            else:
+                # Pipeline up to a window of chunks past the last acknowledged one
+                while next_chunk < min(transfer.acked + transfer.window, transfer.chunks):
+                    if transfer.rewind is not None:
+                        break
+                    offset = next_chunk * transfer.chunk_size
+                    chunk = bytearray((FRAME_BULK_CHUNK, transfer.transfer_id, next_chunk >> 8, next_chunk & 0xFF))
+                    chunk.extend(transfer.data[offset:offset + transfer.chunk_size])
+                    sent = brain.timer.time(MSEC)
+                    self.send_frame(bytes(chunk))
+                    link_ms = elapsed_ms(sent)
+                    transfer.link_ms += link_ms
+                    transfer.chunks_sent += 1
+                    next_chunk += 1
+                    time.sleep_us(int(max(link_ms * (1 - share) / share, BULK_GAP_MS) * 1000))
+
+            # Wait for an acknowledgement
+            waited = brain.timer.time(MSEC)
+            while transfer.acks == acks and elapsed_ms(waited) < BULK_ACK_TIMEOUT_MS:
+                time.sleep_us(1000)  # Acknowledgements arrive through the pin interrupts
+
+            if transfer.acks == acks:
+                retries += 1  # Nothing back, send again from the last acknowledged chunk
+                if next_chunk is not None:
+                    transfer.chunks_resent += next_chunk - transfer.acked
+                    next_chunk = transfer.acked
+                continue
+
+            acks = transfer.acks
+            retries = 0
+            if transfer.status == BULK_DONE:
+                transfer.complete = True
+                return
+            if transfer.status == BULK_REFUSED or transfer.status == BULK_DIGEST_MISMATCH:
+                transfer.error = BULK_STATUS_NAMES[transfer.status]
+                return
+            if next_chunk is None:
+                next_chunk = transfer.acked  # Resumes after the chunks the receiver kept
+            if transfer.rewind is not None:
+                transfer.chunks_resent += max(0, next_chunk - transfer.rewind)
+                next_chunk = transfer.rewind
+                transfer.rewind = None
+            if on_progress:
+                on_progress(transfer)
+
+        transfer.error = "no acknowledgement"
+
+    def send_bulk_ack(self, transfer_id, incoming, status):
+        self.send_frame(bytes((FRAME_BULK_ACK, transfer_id, incoming.received >> 8, incoming.received & 0xFF,
+                               status)))
+
+    def handle_bulk_start(self, payload):
+        """
+        Start receiving a transfer, or resume one already partly received, and acknowledge it.
+        """
+        transfer_id = payload[1]
+        length, chunk_size, window, digest = struct.unpack_from(BULK_HEADER, payload, 2)
+        name = bytes(payload[2 + BULK_HEADER_SIZE:]).decode('utf-8')
+
+        incoming = self.bulk_partial.get(digest)
+        if incoming is None or len(incoming.data) != length or incoming.chunk_size != chunk_size:
+            if self.bulk_handler is None or length > BULK_MAX_BYTES:
+                self.send_frame(bytes((FRAME_BULK_ACK, transfer_id, 0, 0, BULK_REFUSED)))
+                return
+            while len(self.bulk_partial) >= BULK_KEEP:
+                del self.bulk_partial[next(iter(self.bulk_partial))]  # Make room by dropping an unfinished transfer
+            incoming = BulkIncoming(name, length, chunk_size, window, digest)
+            self.bulk_partial[digest] = incoming
+        incoming.missing_sent = False
+        self.bulk_receiving[transfer_id] = incoming
+
+        if incoming.received == incoming.chunks:
+            self.finish_bulk(transfer_id, incoming)
+        else:
+            self.send_bulk_ack(transfer_id, incoming, BULK_RECEIVING)
+
+    def handle_bulk_chunk(self, payload):
+        """
+        Store a chunk that arrived in order, and acknowledge every few chunks or a gap.
+        """
+        transfer_id = payload[1]
+        incoming = self.bulk_receiving.get(transfer_id)
+        if incoming is None:
+            return  # Its start was never received
+        index = payload[2] << 8 | payload[3]
+
+        if incoming.status != BULK_RECEIVING or index < incoming.received:
+            # A chunk sent again because an acknowledgement was lost
+            if index + 1 >= incoming.received or incoming.status != BULK_RECEIVING:
+                self.send_bulk_ack(transfer_id, incoming, incoming.status)
+            return
+
+        if index > incoming.received:
+            if not incoming.missing_sent:
+                incoming.missing_sent = True
+                self.send_bulk_ack(transfer_id, incoming, BULK_MISSING)
+            return
+
+        offset = index * incoming.chunk_size
+        data = payload[4:]
+        incoming.data[offset:offset + len(data)] = data
+        incoming.received += 1
+        incoming.missing_sent = False
+
+        if incoming.received == incoming.chunks:
+            self.finish_bulk(transfer_id, incoming)
+        elif incoming.received % incoming.ack_every == 0:
+            self.send_bulk_ack(transfer_id, incoming, BULK_RECEIVING)
+
+    def finish_bulk(self, transfer_id, incoming):
+        """
+        Check the digest of a complete transfer, acknowledge it and hand it to the bulk handler.
+        """
+        self.bulk_partial.pop(incoming.digest, None)
+        data = incoming.data
+        incoming.data = b""  # Only the status is kept, to answer chunks sent again
+        incoming.status = BULK_DONE if adler32(data) == incoming.digest else BULK_DIGEST_MISMATCH
+        self.send_bulk_ack(transfer_id, incoming, incoming.status)
+        if incoming.status == BULK_DONE:
+            self.bulk_handler(incoming.name, bytes(data))
+        else:
+            self.log.warning("Bulk transfer %s failed its digest", incoming.name)
+
+    def stream_waypoints(self, stream_id, fmt, scales=None, capacity=32, low_water=8):
+        """
+        Start streaming a path from serve_waypoints on the other end, see WaypointStreamer.
+        Returns the started WaypointStreamer, take waypoints with its next().
+        """
+        streamer = WaypointStreamer(self, stream_id, fmt, scales, capacity, low_water)
+        self.waypoint_streams[stream_id] = streamer
+        streamer.start()
+        return streamer
+
+    def sync_clock(self):
+        """
+        Make one clock exchange with the other end, see ClockSync. The estimate
+        in self.clock is updated when the reply arrives.
+        """
+        clock = self.clock
+        self.send_frame(clock.request())
+
+    def start_clock_sync(self, interval_ms=SYNC_INTERVAL_MS):
+        """
+        Sync the clock every interval_ms from a background thread.
+        """
+        if self.clock_thread == None:
+            self.clock_interval_ms = interval_ms
+            self.clock_thread = Thread(self.run_clock_sync)
+
+    def run_clock_sync(self):
+        while True:
+            self.sync_clock()
+            wait(self.clock_interval_ms, MSEC)
+
+    def handle_time(self, payload):
+        """
+        Answer a clock request, or take in the reply to one.
+        """
+        clock = self.clock
+        received = clock.link_time(self.frame_started)
+        if len(payload) == TIME_REQUEST_LENGTH:
+            self.send_frame(clock.reply(payload, received))
+            return
+        delay = clock.add_reply(payload, received)
+        if delay is not None:
+            self.stats.round_trip_ms.record(max(delay, 0) / 1000)
+
+    def send_stamped(self, payload, sampled=None):
+        """
+        Send a string, or the payload of any other frame kind, with the time it was
+        sampled, a ticks_us() reading, now by default. The receiver sees when that
+        was on its own clock in message_sent_us, once its clock is synced.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        stamp = self.clock.link_time(ticks_us() if sampled is None else sampled)
+        self.send_frame(struct.pack(STAMP_HEADER, FRAME_STAMPED, stamp) + bytes(payload))
+
+    def handle_stamped(self, payload):
+        """
+        Dispatch the payload inside a stamped frame, with message_sent_us and
+        message_latency_us set while its callback runs.
+        """
+        clock = self.clock
+        if clock.synced():
+            sent = clock.to_local(struct.unpack_from(STAMP_HEADER, payload)[1])
+            self.message_sent_us = sent
+            self.message_latency_us = wrap_signed(clock.now() - sent)
+            self.stats.message_latency_ms.record(max(self.message_latency_us, 0) / 1000)
+        try:
+            self.dispatch_payload(payload[STAMP_HEADER_SIZE:])
+        finally:
+            self.message_sent_us = None
+            self.message_latency_us = None
+
+    def flush_state(self, full=False):
+        """
+        Send the state values set since the last flush that have changed.
+        With full=True every value is sent, eg to refresh a receiver that restarted.
+        """
+        for payload in self.state.encode_changes(full):
+            self.send_frame(payload)
+
+    def send_delta(self, channel_id, values):
+        """
+        Send a sample on a delta channel, as a keyframe or as changes from the last sample.
+        """
+        self.send_frame(self.delta_channels[channel_id].encode(values))
+
     def send_data(self, data):
         """
-        Send data to the external device by toggling clock and data pins.
+        Send a string message to the external device.
+        """
+        payload = bytes(data, 'utf-8')
+        if self.dictionary_codec != None:
+            payload = self.compress_payload(payload)
+
+        self.send_frame(payload)
+
+        self.log.info("Data sent: %s", data)
+
+    def compress_payload(self, payload):
+        """
+        Dictionary compress a string payload, but only when that makes it shorter.
+        """
+        compressed = self.dictionary_codec.compress(payload)
+        if len(compressed) + 1 < len(payload):
+            return bytes((FRAME_COMPRESSED_TEXT,)) + compressed
+        return payload
+
+    def send_bytes(self, buf):
+        """
+        Send binary data (bytes, bytearray or memoryview) to the external device.
+        """
+        self.send_frame(bytes((FRAME_BYTES,)) + bytes(buf))
+
+    def send_frame(self, payload):
+        """
+        Send a raw payload to the external device by toggling clock and data pins.
+
+        Frames go out one at a time, whichever thread sends them. A frame sent
+        while another is going out is queued and sent next by the thread
+        sending that one, so a receive callback never waits on the main loop.
+        Threads on the brain only switch when one waits, so checking and
+        setting `sending` needs no lock.
+        """
+        if len(payload) > MAX_PAYLOAD_LENGTH:
+            raise ValueError("Payload is longer than " + str(MAX_PAYLOAD_LENGTH) + " bytes")
+
+        self.outbox.append(payload)
+        if self.sending:
+            return
+        self.sending = True
+        try:
+            while self.outbox:
+                self.transmit(self.outbox.pop(0))
+        finally:
+            self.sending = False
+
+    def transmit(self, payload):
+        """
+        Clock one frame out, called by send_frame.
         """
+        gap_us = FRAME_GAP_US - ticks_diff_us(ticks_us(), self.frame_ended)
+        if gap_us > 0:
+            time.sleep_us(gap_us)  # Let the receiver see the last frame end
+
+        profiler = self.profiler
+        started = ticks_us() if profiler is not None else 0
+
         # Ensure the pins are set to receive mode initially
         self.set_pins_receive()
 
-        # Wait until the CS pin is low (ready state)
-        while self.cs_pin.value() == 1:
+        # Wait for CS to be low and for the end of any frame being received to
+        # be handled, or a reply that just arrived would be lost when the pins
+        # switch over. A falling edge that was missed is given up on after
+        # FRAME_GAP_US of CS low
+        low_since = None
+        while True:
+            if self.cs_pin.value() == 1:
+                low_since = None
+            elif not self.cs_active:
+                break
+            elif low_since == None:
+                low_since = ticks_us()
+            elif elapsed_us(low_since) > FRAME_GAP_US:
+                self.cs_active = False
+                break
             time.sleep_us(10)  # Short delay to avoid busy-waiting
 
         # Switch pins to send mode
         self.set_pins_send()
+        if profiler is not None:
+            started = profiler.record(STAGE_CS_WAIT, started)
 
-        # Calculate the payload components
-        length = len(data)
-        checksum = self.calculate_checksum(data)
-        payload = self.encode_payload(length, data, checksum)
+        tracer = self.tracer
+        last_bit = None
 
-        # Activate CS pin to start transmission
+        if len(payload) and payload[0] == FRAME_TIME:
+            payload = self.clock.stamp(payload, self.clock.now())
+
+        # Activate CS pin to start transmission, then encode, as the Raspberry
+        # Pi library does, so a time stamped just before is not held up by it
         self.cs_pin.set(1)
+        if tracer is not None:
+            tracer.record(SIGNAL_CS, 1)
         time.sleep_us(10)  # Brief delay for signal stability
 
+        # Calculate the payload components
+        length = len(payload)
+        checksum = self.calculate_checksum(payload)
+        bits = self.encode_payload(length, payload, checksum)
+        if profiler is not None:
+            started = profiler.record(STAGE_ENCODE, started)
+
         # Send the encoded payload bit by bit
-        for bit in payload:
+        for bit in bits:
             self.data_pin.set(bit)  # Set data pin to the current bit value
             self.clock_pin.set(1)  # Toggle clock pin high
+            if tracer is not None:
+                if bit != last_bit:
+                    tracer.record(SIGNAL_DATA, bit)
+                    last_bit = bit
+                tracer.record(SIGNAL_CLOCK, 1)
             time.sleep_us(self.BIT_DELAY_US)  # Hold for the bit delay
             self.clock_pin.set(0)  # Toggle clock pin low
+            if tracer is not None:
+                tracer.record(SIGNAL_CLOCK, 0)
             time.sleep_us(self.BIT_DELAY_US)
 
         # Deactivate CS pin to end transmission
         self.cs_pin.set(0)
+        self.frame_ended = ticks_us()
+        if tracer is not None:
+            tracer.record(SIGNAL_CS, 0)
+        if profiler is not None:
+            profiler.record(STAGE_CLOCKING, started)
 
-        print(f"Data sent: {data}")  # Print the sent data for debugging
+        self.stats.frames_out += 1
+        self.stats.bytes_out += length
 
         # Reset the pins to receive mode
         self.set_pins_receive()
@@ -129,67 +2456,260 @@ class V5ExternalComm:
         """
         Process and validate the received payload.
         """
+        profiler = self.profiler
+        started = ticks_us() if profiler is not None else 0
+
+        if self.log.level <= LOG_DEBUG:
+            # The buffer is replaced, not cleared, for the next frame, so it can be formatted later
+            self.log.debug(format_frame_dump, self.buffer)
+
         # Check if payload has the minimum required bits
         if len(self.buffer) < 16:
+            self.stats.truncated_frames += 1
             return
 
         # Decode the length from the first 8 bits
-        length_bits = self.buffer[:8]
-        length = int("".join(map(str, length_bits)), 2)
+        length = self.read_byte(0)
 
         # Check if payload has sufficient bits for length, data, and checksum
         if len(self.buffer) >= (8 + length * 8 + 8):
-            data_bits = self.buffer[8:8 + length * 8]
-            data = "".join(
-                chr(int("".join(map(str, data_bits[i:i + 8])), 2)) for i in range(0, len(data_bits), 8))
+            # Decode the data into the reused receive buffer
+            rx_bytes = self.rx_bytes
+            for i in range(length):
+                rx_bytes[i] = self.read_byte(8 + i * 8)
+            payload = memoryview(rx_bytes)[:length]
 
-            checksum_bits = self.buffer[8 + length * 8:8 + length * 8 + 8]
-            received_checksum = int("".join(map(str, checksum_bits)), 2)
+            received_checksum = self.read_byte(8 + length * 8)
 
             # Validate the checksum
-            if received_checksum == self.calculate_checksum(data):
-
-                if data == "ERROR":
-                    self.send_data(self.last_message)  # Resend last message on error
-                else:
-                    self.last_message = data  # Update last message
-                    if self.on_message_received != None:
-                        self.on_message_received(data)
-                    else:
-                        print(f"Received: {data}")  # Print the received data
+            if received_checksum == self.calculate_checksum(payload):
+                self.stats.frames_in += 1
+                self.stats.bytes_in += length
+                if profiler is not None:
+                    started = profiler.record(STAGE_PROCESS, started)
+                self.dispatch_payload(payload)
+                if profiler is not None:
+                    profiler.record(STAGE_CALLBACK, started)
+                self.stats.frame_latency_ms.record(elapsed_us(self.frame_started) / 1000)
             else:
 
+                self.stats.checksum_failures += 1
                 self.receive_error()  # Handle checksum mismatch error
 
             self.reset_buffer()
+        else:
+            self.stats.truncated_frames += 1
+
+    def read_byte(self, offset):
+        """
+        Read 8 bits from the bit buffer, starting at offset, as an integer.
+        """
+        buffer = self.buffer
+        value = 0
+        for i in range(offset, offset + 8):
+            value = (value << 1) | buffer[i]
+        return value
+
+    def next_message(self):
+        """
+        Take the next message object from the pool.
+        """
+        self.message_pool_index = (self.message_pool_index + 1) % MESSAGE_POOL_SIZE
+        return self.message_pool[self.message_pool_index]
+
+    def dispatch_payload(self, payload):
+        """
+        Hand a validated payload to the callback for its frame kind.
+        """
+        kind = payload[0] if len(payload) else FRAME_TEXT
+
+        if kind == FRAME_BYTES:
+            message = self.next_message().load(FRAME_BYTES, payload[1:])
+            if self.on_bytes_received != None:
+                self.on_bytes_received(message)
+            else:
+                self.log.info("Received bytes: %s", bytes(message.data))
+            return
+
+        if kind == FRAME_KEYFRAME or kind == FRAME_DELTA:
+            channel = self.delta_channels.get(payload[1])
+            if channel == None:
+                self.log.warning("Unknown delta channel %s", payload[1])
+                self.stats.rejected_frames += 1
+                return
+
+            values = channel.decode(payload)
+            if values == None:
+                if channel.rx_dropped % RESYNC_RETRY == 1:
+                    self.send_frame(bytes((FRAME_RESYNC, channel.channel_id)))  # Ask for a keyframe
+            elif channel.callback != None:
+                channel.callback(values)
+            else:
+                self.log.info("Received channel %s: %s", channel.channel_id, values)
+            return
+
+        if kind == FRAME_REQUEST:
+            self.handle_request(payload)
+            return
+
+        if kind == FRAME_RESPONSE:
+            self.handle_response(payload)
+            return
+
+        if kind == FRAME_STATE:
+            self.state.apply(payload)
+            return
+
+        if kind == FRAME_BULK_CHUNK:
+            self.handle_bulk_chunk(payload)
+            return
+
+        if kind == FRAME_BULK_ACK:
+            transfer = self.bulk_sending.get(payload[1])
+            if transfer is not None:
+                transfer.acknowledge(payload[2] << 8 | payload[3], payload[4])
+            return
+
+        if kind == FRAME_BULK_START:
+            self.handle_bulk_start(payload)
+            return
+
+        if kind == FRAME_WAYPOINTS:
+            streamer = self.waypoint_streams.get(payload[1])
+            if streamer != None:
+                streamer.receive(payload)
+            return
+
+        if kind == FRAME_TIME:
+            self.handle_time(payload)
+            return
+
+        if kind == FRAME_STAMPED:
+            self.handle_stamped(payload)
+            return
+
+        if kind == FRAME_COMPRESSED_TEXT:
+            if self.dictionary_codec == None:
+                self.log.warning("Compressed message received without a dictionary")
+                self.stats.rejected_frames += 1
+                return
+            try:
+                data = self.dictionary_codec.decompress(payload[1:])
+            except IndexError:
+                self.log.warning("Compressed message does not match the dictionary")
+                self.stats.rejected_frames += 1
+                return
+            self.dispatch_payload(memoryview(data))
+            return
+
+        if kind == FRAME_RESYNC:
+            channel = self.delta_channels.get(payload[1])
+            if channel != None:
+                channel.force_keyframe()
+            else:
+                self.log.warning("Resync asked for unknown delta channel %s", payload[1])
+                self.stats.rejected_frames += 1
+            return
+
+        if kind == FRAME_TYPED:
+            try:
+                schema, values = self.message_registry.decode(payload)
+            except (KeyError, ValueError) as e:
+                self.log.warning("Typed message rejected: %s", e)
+                self.stats.rejected_frames += 1
+                return
+
+            if schema.callback:
+                schema.callback(values)
+            elif self.on_typed_message_received != None:
+                self.on_typed_message_received(schema.type_id, values)
+            else:
+                self.log.info("Received type %s: %s", schema.type_id, values)
+            return
+
+        if len(payload) == 5 and bytes(payload) == b"ERROR":
+            self.stats.error_resends += 1
+            self.send_frame(self.last_message)  # Resend last message on error
+            # The receiver may have lost a delta, so resync every channel
+            for channel in self.delta_channels.values():
+                channel.force_keyframe()
+            return
+
+        self.last_message = bytes(payload)  # Update last message
+        if self.on_fields_received != None and self.field_parser != None:
+            data = self.last_message.decode('utf-8')
+            try:
+                fields = self.field_parser.parse(data)
+            except ValueError as e:
+                self.stats.rejected_frames += 1
+                self.log.warning("Field message rejected: %s", e)
+                return
+            # Text holding none of the fields is an ordinary message
+            if fields != None:
+                self.on_fields_received(fields)
+                if self.on_message_received != None:
+                    self.on_message_received(data)
+                return
+
+        if self.on_message_received != None:
+            self.on_message_received(bytes(payload).decode('utf-8'))
+        elif self.on_bytes_received != None:
+            self.on_bytes_received(self.next_message().load(FRAME_TEXT, payload))
+        else:
+            self.log.info("Received: %s", bytes(payload).decode('utf-8'))
 
     def receive_error(self):
         """
         Handle errors during reception and send an error message.
         """
-        print("Error detected. Sending 'ERROR'.")
-        print("Received data (raw):", "".join(map(str, self.buffer)))
+        self.log.warning("Error detected. Sending 'ERROR'.")
         self.send_data("ERROR")
 
-    def handle_clock_change(self, pin):
+    def handle_clock_change(self, pin=None):
         """
         Handle clock pin rising edge to read incoming bits.
         """
+        monitor = self.isr_monitor
+        entered = ticks_us() if monitor is not None else 0
+
         if self.reciving:
             if self.cs_pin.value() == 1:  # Only read when CS is active
                 if len(self.buffer) < self.MAX_BUFFER_SIZE:
-                    self.buffer.append(self.data_pin.value())  # Append bit to payload
+                    bit = self.data_pin.value()
+                    self.buffer.append(bit)  # Append bit to payload
+                    if self.tracer is not None:
+                        if len(self.buffer) < 2 or self.buffer[-2] != bit:
+                            self.tracer.record(SIGNAL_DATA, bit)
+                        self.tracer.record(SIGNAL_CLOCK, 1)
+
+        if monitor is not None:
+            monitor.record(ISR_CLOCK, entered)
 
-    def handle_cs_change(self, pin):
+    def handle_cs_change(self, pin=None):
         """
         Handle CS pin state changes to manage data transmission.
         """
+        monitor = self.isr_monitor
+        entered = ticks_us() if monitor is not None else 0
+
         if self.reciving:
             if self.cs_pin.value() == 1:  # CS HIGH: Transmission ends
+                self.cs_active = True
                 self.reset_buffer()
+                self.frame_started = ticks_us()
+                if self.tracer is not None:
+                    self.tracer.record(SIGNAL_CS, 1)
             else:  # CS LOW: Transmission starts
+                if self.tracer is not None:
+                    self.tracer.record(SIGNAL_CS, 0)
+                self.cs_active = False
+                if self.buffer:
+                    self.stats.bit_period_us.record(elapsed_us(self.frame_started) / len(self.buffer))
                 self.process_buffer()
 
+        if monitor is not None:
+            monitor.record(ISR_CS, entered)
+
     def set_pins_receive(self):
         """
         Configure the pins for receiving mode.